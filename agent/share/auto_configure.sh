@@ -181,6 +181,12 @@ generate_configuration() {
 	# scheduler_interval = 2
 	# Number of record to keep. Default: 150
 	# history_length = 150
+	# Interval, in second, between each refresh of slow metrics like
+	# databases size. Default: 300
+	# slow_metrics_interval = 300
+	# Interval, in second, between each save of dashboard history to disk,
+	# restored on restart. 0 disables persistence. Default: 0
+	# persist_interval = 0
 
 	[monitoring]
 	# Comma separated list of database names to monitor. * for all.
@@ -191,6 +197,10 @@ generate_configuration() {
 	# Interval, in second, between each run of the process executing
 	# the probes. Default: 60
 	# scheduler_interval = 60
+	# Number of threads running probes concurrently. Default: 1
+	# max_workers = 1
+	# Time, in second, before canceling a probe query. Default: 30
+	# probe_timeout = 30
 
 	[statements]
 	# DB name hosting pg_stat_statements view (the one where the extension has
@@ -1,6 +1,6 @@
 import logging
 
-from bottle import Bottle, default_app, request
+from bottle import Bottle, HTTPError, default_app, request
 
 from . import functions as activity_functions
 from ...notification import NotificationMgmt, Notification
@@ -11,19 +11,49 @@ bottle = Bottle()
 logger = logging.getLogger(__name__)
 
 
+def get_filters(columns):
+    # Parse activity listing filters from query string.
+    query = request.query
+    filters = dict()
+    try:
+        if query.get('state'):
+            filters['state'] = query['state'].split(',')
+        for name in 'database', 'user':
+            if query.get(name):
+                filters[name] = query[name]
+        if query.get('min_duration'):
+            filters['min_duration'] = float(query['min_duration'])
+        for name in 'limit', 'offset', 'query_length':
+            if query.get(name):
+                filters[name] = int(query[name])
+                if filters[name] < 0:
+                    raise ValueError()
+    except ValueError:
+        raise HTTPError(400, "Invalid activity filter.")
+
+    sort = query.get('sort', '-duration')
+    if sort.lstrip('-') not in columns:
+        raise HTTPError(400, "Unknown sort key %s." % sort)
+    filters['sort'] = sort
+    return filters
+
+
 @bottle.get('/')
 def get_activity(pgconn):
-    return activity_functions.get_activity(pgconn)
+    return activity_functions.get_activity(
+        pgconn, **get_filters(activity_functions.ACTIVITY_COLUMNS))
 
 
 @bottle.get('/waiting')
 def get_activity_waiting(pgconn):
-    return activity_functions.get_activity_waiting(pgconn)
+    return activity_functions.get_activity_waiting(
+        pgconn, **get_filters(activity_functions.LOCK_COLUMNS))
 
 
 @bottle.get('/blocking')
 def get_activity_blocking(pgconn):
-    return activity_functions.get_activity_blocking(pgconn)
+    return activity_functions.get_activity_blocking(
+        pgconn, **get_filters(activity_functions.LOCK_COLUMNS))
 
 
 @bottle.post('/kill')
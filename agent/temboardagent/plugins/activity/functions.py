@@ -1,16 +1,90 @@
-from .process import Process, memory_total_size
-import time
-from resource import getpagesize
+from .process import ProcSampler
 
 
-def get_activity(conn):
+# Shared by requests of the HTTP process.
+sampler = ProcSampler()
+
+# Columns of activity listings, accepted as sort key.
+ACTIVITY_COLUMNS = [
+    'pid', 'database', 'client', 'duration', 'wait', 'user', 'state', 'query',
+]
+LOCK_COLUMNS = [
+    'pid', 'database', 'user', 'mode', 'type', 'relation', 'duration', 'state',
+    'query',
+]
+
+
+def filter_activity(conn, query, columns, state=None, database=None,
+                    user=None, min_duration=None, sort='-duration',
+                    limit=None, offset=0, query_length=None):
+    """
+    Filter, sort and paginate backends of query in SQL, then compute CPU,
+    memory and I/O usage of returned backends only. sort is a column name,
+    prefixed with - for descending order. query_length truncates query text.
+    """
+    select = []
+    for name in columns:
+        if 'query' == name and query_length is not None:
+            select.append('left(query, %(query_length)s) AS query')
+        else:
+            select.append('"%s"' % name)
+
+    # Skip backends without query start.
+    where = ['duration IS NOT NULL']
+    if state:
+        where.append('state = ANY(%(state)s)')
+    if database:
+        where.append('database = %(database)s')
+    if user:
+        where.append('"user" = %(user)s')
+    if min_duration is not None:
+        where.append('duration >= %(min_duration)s')
+
+    params = dict(
+        state=state, database=database, user=user,
+        min_duration=min_duration, limit=limit, offset=offset,
+        query_length=query_length,
+    )
+    where = '\n  AND '.join(where)
+    # Count apart so that total does not depend on the page being empty.
+    total = conn.queryscalar("""
+SELECT count(*)
+FROM (%s) AS activity
+WHERE %s
+""" % (query, where), params)
+
+    direction = 'DESC' if sort.startswith('-') else 'ASC'
+    sql = """
+SELECT %s
+FROM (%s) AS activity
+WHERE %s
+ORDER BY "%s" %s NULLS LAST
+LIMIT %%(limit)s OFFSET %%(offset)s
+""" % (', '.join(select), query, where, sort.lstrip('-'), direction)
+
+    rows = list(conn.query(sql, params))
+    return {'rows': add_process_stats(rows), 'total': total}
+
+
+def add_process_stats(rows):
+    """
+    Merge CPU, memory and I/O usage of each backend in rows.
+    """
+    rows = [dict(row) for row in rows]
+    stats = sampler.stats([row['pid'] for row in rows])
+    for row in rows:
+        if row['duration'] < 0:
+            row['duration'] = 0
+        row.update(stats[row['pid']])
+    return rows
+
+
+def get_activity(conn, **filters):
     """
     Returns PostgreSQL backend list based on pg_stat_activity view.
     For each backend (process) we need to compute: CPU and mem. usage, I/O
-    infos.
+    infos. See filter_activity() for filters.
     """
-    mem_total = memory_total_size()
-    page_size = getpagesize()
     if conn.server_version >= 90600 and conn.server_version < 100000:
         query = """
 SELECT
@@ -28,8 +102,6 @@ FROM
   pg_stat_activity
 WHERE
   pid <> pg_backend_pid()
-ORDER BY
-  EXTRACT(epoch FROM (NOW() - pg_stat_activity.query_start)) DESC
         """
     elif conn.server_version < 90600:
         query = """
@@ -47,8 +119,6 @@ FROM
   pg_stat_activity
 WHERE
   pid <> pg_backend_pid()
-ORDER BY
-  EXTRACT(epoch FROM (NOW() - pg_stat_activity.query_start)) DESC
         """
     elif conn.server_version >= 100000:
         query = """
@@ -68,60 +138,15 @@ FROM
 WHERE
   pid <> pg_backend_pid()
   AND backend_type = 'client backend'
-ORDER BY
-  EXTRACT(epoch FROM (NOW() - pg_stat_activity.query_start)) DESC
         """
 
-    backend_list = []
-    for row in conn.query(query):
-        try:
-            backend_list.append({
-                'pid': row['pid'],
-                'database': row['database'],
-                'client': row['client'],
-                'duration': row['duration'],
-                'wait': row['wait'],
-                'user': row['user'],
-                'state': row['state'],
-                'query': row['query'],
-                'process': Process(row['pid'], mem_total, page_size)})
-        except Exception:
-            pass
+    return filter_activity(conn, query, ACTIVITY_COLUMNS, **filters)
 
-    time.sleep(0.1)
-    final_backend_list = []
-    for row in backend_list:
-        try:
-            (read_s, write_s) = row['process'].io_usage()
-            if row['duration'] < 0:
-                row['duration'] = 0
-            final_backend_list.append({
-                'pid': row['pid'],
-                'database': row['database'],
-                'client': row['client'],
-                'duration': row['duration'],
-                'wait': row['wait'],
-                'user': row['user'],
-                'state': row['state'],
-                'query': row['query'],
-                'iow': row['process'].iow,
-                'read_s': read_s,
-                'write_s': write_s,
-                'cpu': row['process'].cpu_usage(),
-                'memory': row['process'].mem_usage()
-            })
-        except Exception:
-            pass
-    return {'rows': final_backend_list}
 
-
-def get_activity_waiting(conn):
+def get_activity_waiting(conn, **filters):
     """
     Returns the list of waiting (on lock) queries.
     """
-    mem_total = memory_total_size()
-    page_size = getpagesize()
-
     query = """
 SELECT
   pg_locks.pid AS pid,
@@ -140,61 +165,14 @@ FROM
 WHERE
   NOT pg_catalog.pg_locks.granted
   AND pg_catalog.pg_stat_activity.pid <> pg_backend_pid()
-ORDER BY
-  EXTRACT(epoch FROM (NOW() - pg_stat_activity.query_start)) DESC
     """
-    backend_list = []
-    for row in conn.query(query):
-        try:
-            backend_list.append({
-                'pid': row['pid'],
-                'database': row['database'],
-                'user': row['user'],
-                'mode': row['mode'],
-                'type': row['type'],
-                'relation': row['relation'],
-                'duration': row['duration'],
-                'state': row['state'],
-                'query': row['query'],
-                'process': Process(row['pid'], mem_total, page_size)})
-        except Exception:
-            pass
-
-    time.sleep(0.1)
-    final_backend_list = []
-    for row in backend_list:
-        try:
-            (read_s, write_s) = row['process'].io_usage()
-            if row['duration'] < 0:
-                row['duration'] = 0
-            final_backend_list.append({
-                'pid': row['pid'],
-                'database': row['database'],
-                'user': row['user'],
-                'mode': row['mode'],
-                'type': row['type'],
-                'relation': row['relation'],
-                'duration': row['duration'],
-                'state': row['state'],
-                'query': row['query'],
-                'iow': row['process'].iow,
-                'read_s': read_s,
-                'write_s': write_s,
-                'cpu': row['process'].cpu_usage(),
-                'memory': row['process'].mem_usage()
-            })
-        except Exception:
-            pass
-    return {'rows': final_backend_list}
+    return filter_activity(conn, query, LOCK_COLUMNS, **filters)
 
 
-def get_activity_blocking(conn):
+def get_activity_blocking(conn, **filters):
     """
     Returns the list of blocking (lock) queries.
     """
-    mem_total = memory_total_size()
-    page_size = getpagesize()
-
     query = """
 SELECT
   pid,
@@ -251,48 +229,5 @@ FROM (
 ) AS sq
 GROUP BY pid, query, mode, locktype, duration, datname, usename, relation,
   state
-ORDER BY duration DESC
     """
-    backend_list = []
-    for row in conn.query(query):
-        try:
-            backend_list.append({
-                'pid': row['pid'],
-                'database': row['database'],
-                'user': row['user'],
-                'mode': row['mode'],
-                'type': row['type'],
-                'relation': row['relation'],
-                'duration': row['duration'],
-                'state': row['state'],
-                'query': row['query'],
-                'process': Process(row['pid'], mem_total, page_size)})
-        except Exception:
-            pass
-
-    time.sleep(0.1)
-    final_backend_list = []
-    for row in backend_list:
-        try:
-            (read_s, write_s) = row['process'].io_usage()
-            if row['duration'] < 0:
-                row['duration'] = 0
-            final_backend_list.append({
-                'pid': row['pid'],
-                'database': row['database'],
-                'user': row['user'],
-                'mode': row['mode'],
-                'type': row['type'],
-                'relation': row['relation'],
-                'duration': row['duration'],
-                'state': row['state'],
-                'query': row['query'],
-                'iow': row['process'].iow,
-                'read_s': read_s,
-                'write_s': write_s,
-                'cpu': row['process'].cpu_usage(),
-                'memory': row['process'].mem_usage()
-            })
-        except Exception:
-            pass
-    return {'rows': final_backend_list}
+    return filter_activity(conn, query, LOCK_COLUMNS, **filters)
@@ -1,4 +1,8 @@
+import os
+import threading
 import time
+from collections import namedtuple
+from resource import getpagesize
 
 # Label returned when the data is not available
 NotAvailableLabel = 'N/A'
@@ -44,133 +48,175 @@ def memory_total_size():
     return
 
 
-class Process:
+def boot_time():
     """
-    Process class aimed to retreive process informations such CPU usage, memory
-    usage, waiting in uninterruptible disk sleep (IO wait), disk read and write
-    rates.
+    Get system boot time, in seconds since epoch, from /proc/stat.
+    """
+    try:
+        with open('/proc/stat') as fd:
+            for line in fd:
+                if line.startswith('btime '):
+                    return float(line.split()[1])
+    except Exception:
+        pass
+    return 0.
+
+
+# Counters of a process at a time. Counters are None if not available.
+Sample = namedtuple(
+    'Sample', ['time', 'iow', 'rss', 'cpu_time', 'read_bytes', 'write_bytes'])
+
+
+class ProcSampler:
+    """
+    Samples /proc counters of PostgreSQL backends in a background thread.
+
+    Keeps the last two samples of each watched PID, so that CPU usage and
+    disk read and write rates are computed without waiting. A newly watched
+    PID is compared with a zero sample at process start time.
+
+    PIDs are watched until not requested for idle_timeout seconds. Sampling
+    thread starts on first request and stops when no PIDs are watched. PIDs
+    gone or not watched anymore are evicted.
     """
 
-    def __init__(self, pid, mem_total, page_size):
+    def __init__(self, interval=1., idle_timeout=60.):
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        # pid -> (previous, last) samples.
+        self.samples = {}
+        # pid -> time of last request.
+        self.watched = {}
+        self.thread = None
+        self.mem_total = memory_total_size()
+        self.page_size = getpagesize()
+        self.clock_ticks = os.sysconf('SC_CLK_TCK')
+        self.boot_time = boot_time()
+
+    def stats(self, pids):
         """
-        Constructor.
+        Returns iow, cpu, memory, read_s and write_s of each PID. Values are
+        N/A if /proc/<pid> is not readable.
         """
-        self.pid = pid
-        self.iow = False
-        self.rss = 0
-        self.cpu_time = 0
-        self.cpu_time_capture = 0
-        self.page_size = page_size
-        self.mem_total = mem_total
-        self.read_bytes = 0
-        self.write_bytes = 0
-        self.io_capture = 0
-        if self.pid:
-            self.__init_stat()
-            self.__parse_proc_io()
-
-    def __parse_proc_stat(self,):
+        now = time.time()
+        with self.lock:
+            self.watched.update((pid, now) for pid in pids)
+            missing = [pid for pid in pids if pid not in self.samples]
+
+        new = {}
+        for pid in missing:
+            sample, start = self.sample(pid)
+            if sample:
+                new[pid] = (start, sample)
+
+        with self.lock:
+            self.samples.update(new)
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name='activity-sampler', daemon=True)
+                self.thread.start()
+            return dict(
+                (pid, self.compute(*self.samples[pid])
+                 if pid in self.samples else self.unavailable())
+                for pid in pids
+            )
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                oldest = time.time() - self.idle_timeout
+                for pid, requested in list(self.watched.items()):
+                    if requested < oldest:
+                        del self.watched[pid]
+                if not self.watched:
+                    self.samples.clear()
+                    self.thread = None
+                    return
+                pids = list(self.watched)
+
+            new = dict((pid, self.sample(pid)[0]) for pid in pids)
+
+            with self.lock:
+                for pid in list(self.samples):
+                    if pid not in self.watched or new.get(pid, True) is None:
+                        del self.samples[pid]
+                for pid, sample in new.items():
+                    if sample and pid in self.samples:
+                        self.samples[pid] = (self.samples[pid][1], sample)
+
+    def sample(self, pid):
         """
-        /proc/<pid>/stat parser for getting CPU times, RSS and IOW.
+        Returns current sample of PID and zero sample at process start time.
         """
-        iow = 'N'
-        cpu_time = 0
-        cpu_time_capture = 0
-        rss = 0
         try:
-            with open('/proc/%s/stat' % (self.pid)) as fd:
-                lines = fd.read()
-                infos = lines[:-1].split()
-                # IO wait
-                if infos[2] == 'D':
-                    iow = 'Y'
-                # RSS
-                rss = infos[23]
-                # CPU time
-                cpu_time = (float(infos[13]) + float(infos[14]) +
-                            float(infos[15]) + float(infos[16]))
-                cpu_time_capture = time.time()
-            return (iow, rss, cpu_time, cpu_time_capture)
+            with open('/proc/%s/stat' % pid) as fd:
+                content = fd.read()
+            now = time.time()
         except Exception:
-            # Case when /proc/<pid>/stat can be read/parsed
-            return (NotAvailableLabel, None, None, None)
+            # Process is gone.
+            return None, None
 
-    def __parse_proc_io(self,):
-        """
-        /proc/<pid>/io parser for getting read_bytes and write_bytes.
-        """
-        read_bytes = 0
-        write_bytes = 0
-        io_capture = 0
+        # Skip pid and comm, comm may contain spaces.
+        infos = content[content.rindex(')') + 2:].split()
+        # Fields are shifted by 2, see proc(5).
+        iow = 'Y' if infos[0] == 'D' else 'N'
+        cpu_time = (float(infos[11]) + float(infos[12]) +
+                    float(infos[13]) + float(infos[14]))
+        start_time = self.boot_time + float(infos[19]) / self.clock_ticks
+        rss = int(infos[21])
+
+        read_bytes = write_bytes = None
         try:
-            with open('/proc/%s/io' % (self.pid)) as fd:
-                io_capture = time.time()
-                for line in fd.readlines():
-                    infos = line.split()
-                    if infos[0][:-1] == 'read_bytes':
-                        read_bytes = int(infos[1])
-                    if infos[0][:-1] == 'write_bytes':
-                        write_bytes = int(infos[1])
-            return (read_bytes, write_bytes, io_capture)
+            with open('/proc/%s/io' % pid) as fd:
+                for line in fd:
+                    key, _, value = line.partition(':')
+                    if key == 'read_bytes':
+                        read_bytes = int(value)
+                    elif key == 'write_bytes':
+                        write_bytes = int(value)
         except Exception:
-            # Case when /proc/<pid>/io can be read/parsed
-            return (None, None, None)
+            # /proc/<pid>/io is readable only by process owner.
+            pass
 
-    def __init_stat(self, ):
-        (self.iow, self.rss, self.cpu_time,
-         self.cpu_time_capture) = self.__parse_proc_stat()
+        start = Sample(start_time, None, None, 0., 0, 0)
+        return Sample(now, iow, rss, cpu_time, read_bytes, write_bytes), start
 
-        (self.read_bytes, self.write_bytes,
-         self.io_capture) = self.__parse_proc_io()
+    def unavailable(self):
+        return dict(
+            iow=NotAvailableLabel,
+            cpu=NotAvailableLabel,
+            memory=NotAvailableLabel,
+            read_s=NotAvailableLabel,
+            write_s=NotAvailableLabel,
+        )
 
-    def cpu_usage(self, ):
-        """
-        Calculates and returns CPU usage based on CPU time
-        """
-        (_, _, new_cpu_time, new_cpu_time_capture) = self.__parse_proc_stat()
-        if new_cpu_time is not None and new_cpu_time_capture is not None:
-            cpu_usage = float("%.2f" % (round(
-                float(
-                    float(new_cpu_time - self.cpu_time) /
-                    float(new_cpu_time_capture - self.cpu_time_capture)), 2)))
-            self.cpu_time = new_cpu_time
-            self.cpu_time_capture = new_cpu_time_capture
-            return cpu_usage
+    def compute(self, previous, last):
+        elapsed = last.time - previous.time
+        if elapsed <= 0:
+            cpu = NotAvailableLabel
         else:
-            return NotAvailableLabel
+            cpu = round((last.cpu_time - previous.cpu_time) / elapsed, 2)
 
-    def mem_usage(self, new_capture=False):
-        """
-        Calculates and returns memory usage.
-        """
-        if new_capture is True:
-            self.__init_stat()
-        if self.rss is not None and self.mem_total is not None:
-            return float("%.2f" % (round(
-                float(float(self.rss) * self.page_size) /
-                float(self.mem_total) * 100, 2)))
+        if None in (last.read_bytes, last.write_bytes) or elapsed <= 0:
+            read_s = write_s = NotAvailableLabel
         else:
-            return NotAvailableLabel
+            read_s = bytes2human(round(
+                (last.read_bytes - previous.read_bytes) / elapsed, 2))
+            write_s = bytes2human(round(
+                (last.write_bytes - previous.write_bytes) / elapsed, 2))
 
-    def io_usage(self, ):
-        """
-        Calculates and returns I/O disk rates.
-        """
-        (new_read_bytes, new_write_bytes,
-         new_io_capture) = self.__parse_proc_io()
-        if new_read_bytes is not None and new_write_bytes is not None \
-           and new_io_capture is not None:
-            read_rate = float("%.2f" % (round(
-                float(
-                    float(new_read_bytes - self.read_bytes) /
-                    float(new_io_capture - self.io_capture)), 2)))
-            write_rate = float("%.2f" % (round(
-                float(
-                    float(new_write_bytes - self.write_bytes) /
-                    float(new_io_capture - self.io_capture)), 2)))
-            self.read_bytes = new_read_bytes
-            self.write_bytes = new_write_bytes
-            self.io_capture = new_io_capture
-            return (bytes2human(read_rate), bytes2human(write_rate))
+        if self.mem_total:
+            memory = round(
+                float(last.rss) * self.page_size / self.mem_total * 100, 2)
         else:
-            return (NotAvailableLabel, NotAvailableLabel)
+            memory = NotAvailableLabel
+
+        return dict(
+            iow=last.iow,
+            cpu=cpu,
+            memory=memory,
+            read_s=read_s,
+            write_s=write_s,
+        )
@@ -1,10 +1,12 @@
+import json
 import logging
 import time
 
-from bottle import Bottle, default_app
+from bottle import Bottle, HTTPError, HTTPResponse, default_app, request
 
 from ...toolkit import taskmanager
 from ...toolkit.configuration import OptionSpec
+from ...tools import JSONEncoder
 
 from . import db
 from . import metrics
@@ -17,7 +19,9 @@ workers = taskmanager.WorkerSet()
 
 @bottle.get('/')
 def dashboard():
-    return metrics.get_metrics_queue(default_app().temboard.config)
+    app = default_app().temboard
+    return metrics.get_metrics_queue(
+        app.config, app.plugins['dashboard'].history)
 
 
 @bottle.get('/config')
@@ -34,9 +38,49 @@ def dashboard_live():
     return metrics.get_metrics(default_app().temboard)
 
 
+@bottle.get('/next')
+def dashboard_next():
+    # Long-poll next snapshot. HTTP server is not threaded: waiting blocks
+    # every other API call. Wait at most a quarter of collector interval so
+    # that other clients are delayed by a fraction of a collector run.
+    # Clients sleep `next` seconds before polling again, so that waiting
+    # only absorbs collector jitter.
+    app = default_app().temboard
+    max_timeout = app.config.dashboard.scheduler_interval / 4.
+    try:
+        after = float(request.query.get('after', 0))
+        timeout = min(
+            max_timeout, float(request.query.get('timeout', max_timeout)))
+    except ValueError:
+        raise HTTPError(400, "Invalid after or timeout parameter.")
+
+    last = app.plugins['dashboard'].history.wait(after, timeout)
+    data = json.loads(last[1]) if last else {}
+    # Tell clients when to poll again instead of looping on this endpoint.
+    data['next'] = next_delay(
+        last[0] if last else None,
+        app.config.dashboard.scheduler_interval, time.time())
+    return HTTPResponse(
+        json.dumps(data, cls=JSONEncoder),
+        headers={'Content-Type': 'application/json'},
+    )
+
+
+def next_delay(last, interval, now):
+    # Seconds until collector appends the snapshot following last one. If
+    # collector is late, keep the phase of last snapshot.
+    if last is None:
+        return interval
+    return round((last + interval - now) % interval, 3)
+
+
 @bottle.get('/history')
 def dashboard_history():
-    return metrics.get_history_metrics_queue(default_app().temboard.config)
+    history = default_app().temboard.plugins['dashboard'].history
+    return HTTPResponse(
+        metrics.get_history_metrics_queue(history),
+        headers={'Content-Type': 'application/json'},
+    )
 
 
 @bottle.get('/buffers')
@@ -113,14 +157,19 @@ def dashboard_collector_worker(app):
     # We don't want to store notifications in the history.
     data.pop('notifications', None)
     logger.debug(data)
+    logger.debug("Dashboard metrics timings: %s.", data['timings'])
 
-    db.add_metric(
-        app.config.temboard.home,
-        'dashboard.db',
-        time.time(),
-        data,
-        app.config.dashboard.history_length
-    )
+    # /dashboard/next clients use snapshot timestamp as cursor.
+    now = data['timestamp']
+    history = app.plugins['dashboard'].history
+    history.append(now, json.dumps(data, cls=JSONEncoder).encode('utf-8'))
+
+    persist_interval = app.config.dashboard.persist_interval
+    if persist_interval and history.persisted + persist_interval <= now:
+        logger.debug("Persisting dashboard history.")
+        db.save_history(
+            app.config.temboard.home, 'dashboard.db', history.items())
+        history.persisted = now
 
     logger.debug("Done")
 
@@ -131,15 +180,30 @@ class DashboardPlugin:
     option_specs = [
         OptionSpec(s, 'scheduler_interval', default=2, validator=int),
         OptionSpec(s, 'history_length', default=150, validator=int),
+        OptionSpec(s, 'slow_metrics_interval', default=300, validator=int),
+        OptionSpec(s, 'persist_interval', default=0, validator=int),
     ]
     del s
 
     def __init__(self, app, **kw):
         self.app = app
         self.app.config.add_specs(self.option_specs)
+        self.history = None
 
     def bootstrap(self):
-        db.bootstrap(self.app.config.temboard.home, 'dashboard.db')
+        config = self.app.config.dashboard
+        home = self.app.config.temboard.home
+        # Allocate history before services fork, to share it with workers.
+        self.history = db.History(config.history_length)
+        db.bootstrap(
+            home, 'dashboard.db', keep_history=bool(config.persist_interval))
+        if config.persist_interval:
+            # Restore only history still within dashboard time range.
+            min_time = time.time() - (
+                config.history_length * config.scheduler_interval)
+            for time_, payload in db.load_history(
+                    home, 'dashboard.db', min_time):
+                self.history.append(time_, payload)
 
     def load(self):
         default_app().mount('/dashboard', bottle)
@@ -1,69 +1,179 @@
 import json
+import mmap
 import os
 import sqlite3
+import struct
+from multiprocessing import Condition
 from textwrap import dedent
+from time import time as now
 
 from ...tools import JSONEncoder
 
 
-def bootstrap(path, dbname):
-    """Create SQLite3 database model to history collected data for the
-    dashboard.
+class History:
+    """Fixed-size ring buffer of serialized dashboard snapshots.
+
+    Slots live in anonymous shared memory. Allocated before agent services
+    fork, the buffer is shared by collector worker and HTTP server
+    processes. Appending a snapshot overwrites the oldest one and wakes up
+    processes waiting for it.
+    """
+
+    # Count of appended snapshots, time of last persistence.
+    HEADER = struct.Struct('<Qd')
+    # Time and length of snapshot.
+    SLOT = struct.Struct('<dI')
+
+    def __init__(self, length, slot_size=16384):
+        self.length = length
+        self.slot_size = slot_size
+        self.cond = Condition()
+        self.mem = mmap.mmap(-1, self.HEADER.size + length * slot_size)
+
+    def __len__(self):
+        count, _ = self.HEADER.unpack_from(self.mem, 0)
+        return min(count, self.length)
+
+    def append(self, time, payload):
+        if len(payload) > self.slot_size - self.SLOT.size:
+            raise ValueError(
+                "Dashboard snapshot too large: %s bytes." % len(payload))
+
+        with self.cond:
+            count, persisted = self.HEADER.unpack_from(self.mem, 0)
+            offset = self.slot_offset(count % self.length)
+            self.SLOT.pack_into(self.mem, offset, time, len(payload))
+            offset += self.SLOT.size
+            self.mem[offset:offset + len(payload)] = payload
+            self.HEADER.pack_into(self.mem, 0, count + 1, persisted)
+            self.cond.notify_all()
+
+    def last(self):
+        # Returns (time, payload) of latest snapshot or None.
+        with self.cond:
+            return self._last()
+
+    def _last(self):
+        count, _ = self.HEADER.unpack_from(self.mem, 0)
+        if not count:
+            return None
+        return self.read((count - 1) % self.length)
+
+    def wait(self, after, timeout):
+        # Returns first snapshot newer than after, waiting at most timeout
+        # seconds for it. On timeout, returns latest snapshot or None.
+        deadline = now() + timeout
+        with self.cond:
+            while True:
+                last = self._last()
+                if last and last[0] > after:
+                    return last
+                remaining = deadline - now()
+                if remaining <= 0:
+                    return last
+                self.cond.wait(remaining)
+
+    def items(self):
+        # Returns (time, payload) of all snapshots, oldest first.
+        with self.cond:
+            count, _ = self.HEADER.unpack_from(self.mem, 0)
+            n = min(count, self.length)
+            return [
+                self.read(i % self.length) for i in range(count - n, count)]
+
+    def read(self, index):
+        offset = self.slot_offset(index)
+        time, size = self.SLOT.unpack_from(self.mem, offset)
+        offset += self.SLOT.size
+        return time, self.mem[offset:offset + size]
+
+    def slot_offset(self, index):
+        return self.HEADER.size + index * self.slot_size
+
+    @property
+    def persisted(self):
+        return self.HEADER.unpack_from(self.mem, 0)[1]
+
+    @persisted.setter
+    def persisted(self, value):
+        with self.cond:
+            count, _ = self.HEADER.unpack_from(self.mem, 0)
+            self.HEADER.pack_into(self.mem, 0, count, value)
 
-    To be representative of the very recent server activity, dashboard data
-    history should not contain old data, that's why the table is dropped and
-    recreated when the agent starts.
 
-    We do not need to keep in the history a lot of data (150 records by
-    default) and want it to act as a FIFO queue.
+def bootstrap(path, dbname, keep_history=False):
+    """Create SQLite3 database model to persist dashboard data.
+
+    Dashboard history is kept in memory, see History. To be representative of
+    the very recent server activity, dashboard data history should not
+    contain old data, that's why the table is dropped and recreated when the
+    agent starts, unless history persistence is enabled.
+
+    Slow metrics, like database sizes, are cached in cache table and
+    refreshed less often than dashboard history.
     """
 
     with sqlite3.connect(os.path.join(path, dbname)) as conn:
         c = conn.cursor()
-        c.execute("DROP TABLE IF EXISTS metrics")
+        if not keep_history:
+            c.execute("DROP TABLE IF EXISTS metrics")
         c.execute(
             dedent("""
-                CREATE TABLE metrics (
+                CREATE TABLE IF NOT EXISTS metrics (
                     time REAL PRIMARY KEY,
                     data TEXT
                 )
             """)
         )
+        c.execute("DROP TABLE IF EXISTS cache")
+        c.execute(
+            dedent("""
+                CREATE TABLE cache (
+                    key TEXT PRIMARY KEY,
+                    time REAL,
+                    data TEXT
+                )
+            """)
+        )
 
 
-def add_metric(path, dbname, time, data, keep_limit):
+def save_history(path, dbname, items):
+    # Replace persisted history with items of History.
     with sqlite3.connect(os.path.join(path, dbname)) as conn:
         c = conn.cursor()
-        c.execute(
+        c.execute("DELETE FROM metrics")
+        c.executemany(
             "INSERT INTO metrics VALUES(?, ?)",
-            (time, json.dumps(data, cls=JSONEncoder))
+            ((time, payload.decode('utf-8')) for time, payload in items)
         )
-        # Purge
+
+
+def load_history(path, dbname, min_time):
+    with sqlite3.connect(os.path.join(path, dbname)) as conn:
+        c = conn.cursor()
         c.execute(
-            dedent("""
-                DELETE FROM metrics
-                WHERE time NOT IN (
-                    SELECT time FROM metrics ORDER BY time DESC
-                    LIMIT ?
-                )
-            """),
-            (keep_limit,)
+            "SELECT time, data FROM metrics WHERE time >= ? ORDER BY time ASC",
+            (min_time,)
         )
+        return [(time, data.encode('utf-8')) for time, data in c.fetchall()]
 
 
-def get_last_metric(path, dbname):
+def get_cached(path, dbname, key, min_time):
+    # Returns cached data of key if stored after min_time, else None.
     with sqlite3.connect(os.path.join(path, dbname)) as conn:
         c = conn.cursor()
         c.execute(
-            "SELECT data FROM metrics ORDER BY time DESC LIMIT 1"
+            "SELECT data FROM cache WHERE key = ? AND time >= ?",
+            (key, min_time)
         )
-        return c.fetchone()
+        row = c.fetchone()
+    return json.loads(row[0]) if row else None
 
 
-def get_all_metrics(path, dbname):
+def set_cached(path, dbname, key, time, data):
     with sqlite3.connect(os.path.join(path, dbname)) as conn:
         c = conn.cursor()
         c.execute(
-            "SELECT data FROM metrics ORDER BY time ASC"
+            "INSERT OR REPLACE INTO cache VALUES(?, ?, ?)",
+            (key, time, json.dumps(data, cls=JSONEncoder))
         )
-        return c.fetchall()
@@ -2,6 +2,7 @@ import json
 import time
 import os
 import re
+from contextlib import contextmanager
 
 from . import db
 from ...notification import NotificationMgmt
@@ -10,33 +11,60 @@ from ...errors import UserError
 
 
 def get_metrics(app):
+    # Fast metrics are collected on each call. Slow metrics, database sizes
+    # and static instance and system informations, are cached for
+    # dashboard.slow_metrics_interval seconds. Instance informations are
+    # refreshed on PostgreSQL restart. Collection duration of each metric
+    # family is reported in timings.
     res = dict()
+    timings = dict()
     try:
         with app.postgres.connect() as conn:
             dm = DashboardMetrics(conn)
             pginfo = PgInfo(conn)
-            res.update(dict(
-                buffers=dm.get_buffers(),
-                hitratio=dm.get_hitratio(),
-                active_backends=dm.get_active_backends(),
-                max_connections=dm.get_max_connections(),
-                databases=dm.get_stat_db(),
-                pg_start_time=dm.get_pg_start_time(),
-                pg_version=pginfo.version()['full'],
-                pg_data=pginfo.setting('data_directory'),
-                pg_port=pginfo.setting('port'),
-            ))
+            with timing(timings, 'buffers'):
+                res['buffers'] = dm.get_buffers()
+            with timing(timings, 'hitratio'):
+                res['hitratio'] = dm.get_hitratio()
+            with timing(timings, 'active_backends'):
+                res['active_backends'] = dm.get_active_backends()
+            with timing(timings, 'databases'):
+                res['databases'] = dm.get_stat_db_counters()
+            with timing(timings, 'databases_size'):
+                res['databases']['total_size'] = cached(
+                    app, 'databases_size', dm.get_databases_size)
+            with timing(timings, 'instance'):
+                # Settings may change on reload.
+                res['max_connections'] = dm.get_max_connections()
+                res['pg_start_time'] = dm.get_pg_start_time()
+                res.update(cached(app, 'instance', lambda: dict(
+                    pg_version=pginfo.version()['full'],
+                    pg_data=pginfo.setting('data_directory'),
+                    pg_port=pginfo.setting('port'),
+                ), tag=str(res['pg_start_time'])))
     except UserError:
         pass
 
     dm = DashboardMetrics()
+    with timing(timings, 'cpu'):
+        res['cpu'] = dm.get_cpu_usage()
+    with timing(timings, 'loadaverage'):
+        res['loadaverage'] = dm.get_load_average()
+    with timing(timings, 'memory'):
+        res['memory'] = dm.get_memory_usage()
+    with timing(timings, 'notifications'):
+        res['notifications'] = dm.get_notifications(app.config)
+    with timing(timings, 'system'):
+        res.update(cached(app, 'system', lambda: get_system(app.config)))
+
     res.update(dict(
-        cpu=dm.get_cpu_usage(),
-        loadaverage=dm.get_load_average(),
-        memory=dm.get_memory_usage(),
-        notifications=dm.get_notifications(app.config),
+        timings=timings,
+        timestamp=time.time()
     ))
+    return res
 
+
+def get_system(config):
     sysinfo = SysInfo()
 
     cpu_models = [cpu['model_name'] for cpu in sysinfo.cpu_info()['cpus']]
@@ -44,40 +72,53 @@ def get_metrics(app):
     for elem in cpu_models:
         cpu_models_counter[elem] = cpu_models_counter.get(elem, 0) + 1
 
-    res.update(dict(
-        hostname=sysinfo.hostname(app.config.temboard.hostname),
+    return dict(
+        hostname=sysinfo.hostname(config.temboard.hostname),
         os_version=sysinfo.os_release,
         linux_distribution=sysinfo.linux_distribution(),
         cpu_models=cpu_models_counter,
         n_cpu=sysinfo.n_cpu(),
-        timestamp=time.time()
-    ))
-    return res
+    )
+
 
+def cached(app, key, func, tag=None):
+    # Returns value of func from dashboard cache, refreshing it if older
+    # than dashboard.slow_metrics_interval or if cached with another tag.
+    home = app.config.temboard.home
+    now = time.time()
+    data = db.get_cached(
+        home, 'dashboard.db', key,
+        now - app.config.dashboard.slow_metrics_interval)
+    if data is None or data[0] != tag:
+        data = [tag, func()]
+        db.set_cached(home, 'dashboard.db', key, now, data)
+    return data[1]
 
-def get_metrics_queue(config):
+
+@contextmanager
+def timing(timings, name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings[name] = round(time.time() - start, 6)
+
+
+def get_metrics_queue(config, history):
     dm = DashboardMetrics()
     msg = dict()
 
-    row = db.get_last_metric(
-        config.temboard.home,
-        'dashboard.db'
-    )
-    if row:
-        msg = json.loads(row[0])
+    last = history.last()
+    if last:
+        msg = json.loads(last[1].decode('utf-8'))
 
     msg['notifications'] = dm.get_notifications(config)
     return msg
 
 
-def get_history_metrics_queue(config):
-    return [
-        json.loads(d)
-        for d, in db.get_all_metrics(
-            config.temboard.home,
-            'dashboard.db'
-        )
-    ]
+def get_history_metrics_queue(history):
+    # Snapshots are stored serialized, join them as a JSON array.
+    return b'[' + b','.join(payload for _, payload in history.items()) + b']'
 
 
 def get_info(conn, config):
@@ -202,11 +243,14 @@ class DashboardMetrics:
             return self._get_memory_usage_linux()
 
     def get_stat_db(self,):
+        stats = self.get_stat_db_counters()
+        stats['total_size'] = self.get_databases_size()
+        return stats
+
+    def get_stat_db_counters(self,):
         row = self.conn.queryone("""\
         SELECT
             count(datid) as databases,
-            pg_size_pretty(sum(pg_database_size(
-                pg_database.datname))::bigint) as total_size,
             to_char(now(),'HH24:MI') as time,
             sum(xact_commit)::BIGINT as total_commit,
             sum(xact_rollback)::BIGINT as total_rollback
@@ -215,12 +259,19 @@ class DashboardMetrics:
         WHERE datistemplate = 'f'
         """)
         return {'databases': row['databases'],
-                'total_size': row['total_size'],
                 'time': row['time'],
                 'total_commit': row['total_commit'],
                 'total_rollback': row['total_rollback'],
                 'timestamp': time.time()}
 
+    def get_databases_size(self,):
+        # pg_database_size() stats every relation file, this is slow.
+        return self.conn.queryscalar("""\
+        SELECT pg_size_pretty(sum(pg_database_size(datname))::bigint)
+        FROM pg_database
+        WHERE datistemplate = 'f'
+        """)
+
     def get_pg_start_time(self):
         return self.conn.queryscalar("SELECT pg_postmaster_start_time();")
 
@@ -1,9 +1,12 @@
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import datetime
 import time
 import logging
-import json
 
-from bottle import Bottle, default_app, request, HTTPError
+from bottle import (
+    Bottle, HTTPResponse, default_app, request, response, HTTPError,
+)
 
 from ...toolkit import taskmanager
 from ...toolkit.configuration import OptionSpec
@@ -38,10 +41,16 @@ def get_monitoring():
     returned records to N, the query parameter 'limit' can be used and set to
     N. 'limit' default value is 50, meaning that the maximum number of record
     set this API returns by default is 50.
+
+    With query parameter 'format=ndjson', records are streamed as
+    newline-delimited JSON objects with keys 'cursor' and 'metric'. Passing
+    the cursor of the last processed record as query parameter 'cursor'
+    resumes reading exactly after this record. 'cursor' overrides 'start'.
     """
 
     # Default values
     start_timestamp = None
+    after = None
     limit = 50
 
     app = default_app().temboard
@@ -61,6 +70,12 @@ def get_monitoring():
         except ValueError:
             raise HTTPError(406, "Invalid timestamp")
 
+    if 'cursor' in request.query:
+        try:
+            after = decode_cursor(request.query['cursor'])
+        except ValueError:
+            raise HTTPError(406, "Invalid cursor")
+
     if 'limit' in request.query:
         # Validate limit parameter
         validate_parameters(request.query, [
@@ -68,14 +83,45 @@ def get_monitoring():
         ])
         limit = int(request.query['limit'])
 
-    return [
-        json.loads(metric[1]) for metric in db.get_metrics(
-            app.config.temboard.home,
-            'monitoring.db',
-            start_timestamp=start_timestamp,
-            limit=limit
-        )
-    ]
+    metrics = db.iter_metrics(
+        app.config.temboard.home,
+        'monitoring.db',
+        start_timestamp=start_timestamp,
+        after=after,
+        limit=limit
+    )
+
+    if 'ndjson' == request.query.get('format'):
+        response.content_type = 'application/x-ndjson'
+        return generate_ndjson_history(metrics)
+
+    # Build JSON array from stored JSON documents, without decoding them.
+    body = '[%s]' % ','.join(db.decompress_metric(m[1]) for m in metrics)
+    return HTTPResponse(body, headers={'Content-Type': 'application/json'})
+
+
+def generate_ndjson_history(metrics):
+    # Stream one line per record, wrapping stored JSON without decoding it.
+    for time_, data in metrics:
+        yield ('{"cursor": "%s", "metric": %s}\n' % (
+            encode_cursor(time_), db.decompress_metric(data),
+        )).encode('utf-8')
+
+
+def encode_cursor(time_):
+    # Cursor is opaque to clients. repr() round-trips float exactly.
+    return urlsafe_b64encode(('v1:%r' % time_).encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = urlsafe_b64decode(cursor.encode('ascii')).decode('ascii')
+    except (binascii.Error, UnicodeError):
+        raise ValueError("Invalid cursor %r" % cursor)
+    version, _, time_ = raw.partition(':')
+    if 'v1' != version:
+        raise ValueError("Unknown cursor version %r" % version)
+    return float(time_)
 
 
 @bottle.get('/config')
@@ -114,9 +160,17 @@ def monitoring_collector_worker(app):
         config.temboard.home
     )
 
-    with Postgres(**conninfo).dbpool() as pool:
+    last_measures = db.LastMeasuresStore(config.temboard.home, 'monitoring.db')
+    timings = {}
+    with Postgres(**conninfo).dbpool() as pool, last_measures:
         instance = instance_info(pool, conninfo, system_info['hostname'])
-        data = run_probes(probes, pool, [instance])
+        data = run_probes(
+            probes, pool, [instance],
+            last_measures=last_measures,
+            max_workers=config.monitoring.max_workers,
+            timeout=config.monitoring.probe_timeout,
+            timings=timings,
+        )
 
     # Prepare and send output
     output = dict(
@@ -125,6 +179,7 @@ def monitoring_collector_worker(app):
         instances=remove_passwords([instance]),
         data=data,
         version=__VERSION__,
+        timings=timings,
     )
     logger.info("Add data to metrics table.")
     db.add_metric(
@@ -139,6 +194,10 @@ def monitoring_collector_worker(app):
     try:
         logger.debug("temboard_agent_version=%s", __VERSION__)
         logger.debug("hostinfo=%s", system_info)
+        for probe, timing in sorted(timings.items()):
+            logger.debug(
+                "probe=%s duration=%.3f timeouts=%d",
+                probe, timing['duration'], timing['timeouts'])
         for record in iter_metrics_for_logfmt(data):
             # up=1 is a marker to grep logfmt lines
             logger.debug(
@@ -149,6 +208,15 @@ def monitoring_collector_worker(app):
         logger.exception("Failed to log metrics.")
 
 
+@workers.register(pool_size=1)
+def monitoring_purge_worker(app):
+    """
+    Delete queued metrics older than 6 hours.
+    """
+    count = db.purge_metrics(app.config.temboard.home, 'monitoring.db')
+    logger.debug("Purged %s queued metrics.", count)
+
+
 def iter_metrics_for_logfmt(data):
     # Generates a flat sequence of record dict containing key value for logfmt
     # printing. See dev/perfui/ in temboard project to analyze such data.
@@ -178,6 +246,8 @@ class MonitoringPlugin:
         OptionSpec(s, 'dbnames', default='*', validator=commalist),
         OptionSpec(s, 'scheduler_interval', default=60, validator=int),
         OptionSpec(s, 'probes', default='*', validator=commalist),
+        OptionSpec(s, 'max_workers', default=1, validator=int),
+        OptionSpec(s, 'probe_timeout', default=30, validator=int),
     ]
     del s
 
@@ -196,6 +266,10 @@ class MonitoringPlugin:
             id='monitoring_collector',
             redo_interval=self.app.config.monitoring.scheduler_interval,
         )(monitoring_collector_worker)
+        workers.schedule(
+            id='monitoring_purge',
+            redo_interval=5 * 60,
+        )(monitoring_purge_worker)
         self.app.scheduler.add(workers)
 
     def unload(self):
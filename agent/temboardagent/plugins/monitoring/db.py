@@ -1,6 +1,9 @@
 import json
 import os
 import sqlite3
+import threading
+import zlib
+from contextlib import closing
 from textwrap import dedent
 from time import time as current_time
 
@@ -16,7 +19,8 @@ def bootstrap(path, dbname):
     delta values with potentially old data resulting with outliers.
 
     metrics table is used to queued collected data before they are pushed to
-    temboard server.
+    temboard server. data is zlib compressed JSON. Rows queued by previous
+    versions are plain JSON text.
     """
 
     with sqlite3.connect(os.path.join(path, dbname)) as conn:
@@ -35,7 +39,7 @@ def bootstrap(path, dbname):
             dedent("""
                 CREATE TABLE IF NOT EXISTS metrics (
                     time REAL PRIMARY KEY,
-                    data TEXT
+                    data BLOB
                 )
             """)
         )
@@ -43,18 +47,34 @@ def bootstrap(path, dbname):
 
 def add_metric(path, dbname, time, data):
     with sqlite3.connect(os.path.join(path, dbname)) as conn:
-        c = conn.cursor()
-        c.execute(
+        conn.execute(
             "INSERT INTO metrics VALUES(?, ?)",
-            (time, json.dumps(data, cls=JSONEncoder))
+            (time, compress_metric(data))
         )
-        # When data are pulled from temboard server, we need to keep 6 hours of
-        # data history for recovery.
-        time_limit = current_time() - (60 * 60 * 6)
-        c.execute(
+
+
+def purge_metrics(path, dbname, max_age=60 * 60 * 6):
+    # When data are pulled from temboard server, we need to keep 6 hours of
+    # data history for recovery.
+    time_limit = current_time() - max_age
+    with sqlite3.connect(os.path.join(path, dbname)) as conn:
+        cur = conn.execute(
             "DELETE FROM metrics WHERE time < ?",
             (time_limit,)
         )
+        return cur.rowcount
+
+
+def compress_metric(data):
+    return zlib.compress(json.dumps(data, cls=JSONEncoder).encode('utf-8'))
+
+
+def decompress_metric(data):
+    # Returns JSON text of a queued metric.
+    if isinstance(data, str):
+        # Legacy uncompressed JSON.
+        return data
+    return zlib.decompress(data).decode('utf-8')
 
 
 def delete_metric(path, dbname, time):
@@ -67,9 +87,18 @@ def delete_metric(path, dbname, time):
 
 
 def get_metrics(path, dbname, limit=50, start_timestamp=None):
+    return list(iter_metrics(path, dbname, limit, start_timestamp))
+
+
+def iter_metrics(path, dbname, limit=50, start_timestamp=None, after=None):
+    # Generates (time, data) rows without loading them all in memory. after
+    # is an exclusive lower bound on time, used to resume a previous read.
     query = "SELECT time, data FROM metrics"
     args = ()
-    if start_timestamp:
+    if after is not None:
+        query += " WHERE time > ?"
+        args += (after,)
+    elif start_timestamp:
         query += " WHERE time >= ?"
         args += (start_timestamp,)
     else:
@@ -84,10 +113,9 @@ def get_metrics(path, dbname, limit=50, start_timestamp=None):
         query += " LIMIT ?"
         args += (limit,)
 
-    with sqlite3.connect(os.path.join(path, dbname)) as conn:
-        c = conn.cursor()
-        c.execute(query, args)
-        return c.fetchall()
+    with closing(sqlite3.connect(os.path.join(path, dbname))) as conn:
+        for row in conn.execute(query, args):
+            yield row
 
 
 def get_last_measure(path, dbname, key):
@@ -100,17 +128,93 @@ def get_last_measure(path, dbname, key):
         return c.fetchone()
 
 
+# UPSERT syntax is available since SQLite 3.24. On older SQLite, INSERT OR
+# REPLACE is equivalent since key is the whole identity of a last measure.
+if sqlite3.sqlite_version_info >= (3, 24, 0):
+    UPSERT_LAST_MEASURE_SQL = dedent("""\
+    INSERT INTO last_measures (time, key, data) VALUES (?, ?, ?)
+    ON CONFLICT (key) DO UPDATE SET time = excluded.time, data = excluded.data
+    """)
+else:  # pragma: nocover
+    UPSERT_LAST_MEASURE_SQL = dedent("""\
+    INSERT OR REPLACE INTO last_measures (time, key, data) VALUES (?, ?, ?)
+    """)
+
+
 def upsert_last_measure(path, dbname, time, key, data):
     with sqlite3.connect(os.path.join(path, dbname)) as conn:
-        c = conn.cursor()
+        conn.execute(
+            UPSERT_LAST_MEASURE_SQL,
+            (time, key, json.dumps(data, cls=JSONEncoder))
+        )
+
+
+class LastMeasuresStore:
+    """Batched access to last_measures for a whole collection run.
+
+    The store keeps a single SQLite connection open. Last measures of a probe
+    are loaded in one query on first access, and new measures are buffered
+    until flush() writes them in a single transaction.
+
+    The store is thread-safe, to be shared by probes running concurrently.
+    """
+
+    def __init__(self, path, dbname):
+        self.path = os.path.join(path, dbname)
+        self.conn = None
+        # Mapping of key -> dict(time, data).
+        self.measures = {}
+        # Probe names whose last measures are already loaded.
+        self.loaded = set()
+        # Mapping of key -> (time, data) to write on flush.
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
         try:
-            c.execute(
-                "INSERT INTO last_measures VALUES(?, ?, ?)",
+            if exc_type is None:
+                self.flush()
+        finally:
+            self.conn.close()
+            self.conn = None
+
+    def load(self, probe):
+        # Keys are prefixed by probe name, which is made of word characters
+        # only. GLOB is case sensitive and uses the primary key index.
+        cur = self.conn.execute(
+            "SELECT key, time, data FROM last_measures WHERE key GLOB ?",
+            (probe + '*',)
+        )
+        for key, time, data in cur:
+            self.measures[key] = dict(time=time, data=json.loads(data))
+        self.loaded.add(probe)
+
+    def get(self, probe, key):
+        with self.lock:
+            if probe not in self.loaded:
+                self.load(probe)
+            return self.measures.get(key)
+
+    def set(self, time, key, data):
+        with self.lock:
+            self.measures[key] = dict(time=time, data=data)
+            self.pending[key] = (time, data)
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+
+        with self.conn:
+            self.conn.executemany(UPSERT_LAST_MEASURE_SQL, [
                 (time, key, json.dumps(data, cls=JSONEncoder))
-            )
-        except sqlite3.IntegrityError:
-            c.execute(
-                "UPDATE last_measures SET time = ?, data = ? "
-                "WHERE key = ?",
-                (time, json.dumps(data, cls=JSONEncoder), key)
-            )
+                for key, (time, data) in self.pending.items()
+            ])
+        self.pending.clear()
@@ -3,7 +3,10 @@ import re
 import os
 import time
 import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
+from threading import Timer
 
 import psycopg2
 from psycopg2.extensions import parse_dsn
@@ -38,17 +41,27 @@ def load_probes(options, home):
     return probes
 
 
-def run_probes(probes, pool, instances, delta=True):
-    """Execute the probes."""
+def run_probes(probes, pool, instances, delta=True, last_measures=None,
+               max_workers=1, timeout=None, timings=None):
+    """Execute the probes.
+
+    last_measures is an optional db.LastMeasuresStore shared by all probes to
+    compute deltas with a single SQLite connection.
+
+    Probes are grouped by database. Each group runs in its own thread, up to
+    max_workers threads. An SQL probe running longer than timeout seconds on a
+    database is canceled. If timings is a dict, it is filled with duration
+    and timeouts of each probe.
+    """
 
     now = pool.getconn().queryscalar("SELECT NOW()")
     logger.info("Running probes at %s.", now.isoformat())
-    # Output is a mapping of probe names with lists. Each probe returns
-    # a list of dicts(metric -> value).
-    output = {}
 
+    # Jobs is a mapping of dbname to list of (probe, conninfo). Host probes
+    # are grouped under None.
+    jobs = OrderedDict()
     for p in probes:
-        out = []
+        p.last_measures = last_measures
         if delta is False:
             p.delta_key = None
             p.delta_columns = None
@@ -57,50 +70,136 @@ def run_probes(probes, pool, instances, delta=True):
         if p.level == 'host':
             if not p.check():
                 continue
-            logger.info("Running host probe %s.", p.get_name())
-            try:
-                out = p.run()
-            except Exception as e:
-                logger.error("Probe failure: %s", e)
-                continue
+            jobs.setdefault(None, []).append((p, None))
+            continue
 
-        else:
-            if p.level not in ('instance', 'database'):
-                raise Exception("Unknown probe level: %s", p.level)
+        if p.level not in ('instance', 'database'):
+            raise Exception("Unknown probe level: %s", p.level)
 
-            i, = instances  # We are now mono-instance
-            if not i['available']:
-                continue
+        i, = instances  # We are now mono-instance
+        if not i['available']:
+            continue
 
-            if not p.check(i['version_num']):
-                logger.warning(
-                    "Unsupported PostgreSQL version for probe %s.",
-                    p.get_name())
-                continue
+        if not p.check(i['version_num']):
+            logger.warning(
+                "Unsupported PostgreSQL version for probe %s.",
+                p.get_name())
+            continue
 
-            logger.info("Running %s probe %s.", p.level, p.get_name())
-            if p.level == 'instance':
-                dbnames = [i['database']]
-            else:
-                dbnames = [db['dbname'] for db in i['dbnames']]
+        if p.level == 'instance':
+            dbnames = [i['database']]
+        else:
+            dbnames = [db['dbname'] for db in i['dbnames']]
+
+        for dbname in dbnames:
+            jobs.setdefault(dbname, []).append((p, dict(i, dbname=dbname)))
+
+    if max_workers > 1 and len(jobs) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(run_probes_job, pool, dbname, job, timeout)
+                for dbname, job in jobs.items()
+            ]
+            results = [f.result() for f in futures]
+    else:
+        results = [
+            run_probes_job(pool, dbname, job, timeout)
+            for dbname, job in jobs.items()
+        ]
 
-            for dbname in dbnames:
-                conninfo = dict(i, dbname=dbname)
-                try:
-                    out += p.run(pool.getconn(dbname=dbname), conninfo)
-                except Exception as e:
-                    logger.error("Probe failure: %s", e)
-                    raise
-                    continue
+    if last_measures is not None:
+        # Save deltas of this run in a single transaction.
+        last_measures.flush()
 
-        for record in out:
-            record['datetime'] = now
-        output[p.get_name()] = out
+    # Output is a mapping of probe names with lists. Each probe returns
+    # a list of dicts(metric -> value).
+    output = {}
+    for result in results:
+        for p, out, duration, timedout in result:
+            if timings is not None:
+                timing = timings.setdefault(
+                    p.get_name(), dict(duration=0., timeouts=0))
+                timing['duration'] += duration
+                timing['timeouts'] += int(timedout)
+
+            if out is None:
+                continue
+
+            for record in out:
+                record['datetime'] = now
+            output.setdefault(p.get_name(), []).extend(out)
 
     logger.info("Finished probes run.")
     return output
 
 
+def run_probes_job(pool, dbname, job, timeout=None):
+    # Run probes of a single database or host probes if dbname is None.
+    # Returns a list of (probe, output, duration, timedout) tuples. output
+    # is None on host probe failure.
+    results = []
+    for p, conninfo in job:
+        start = time.time()
+        timedout = False
+        if dbname is None:
+            logger.info("Running host probe %s.", p.get_name())
+            try:
+                out = p.run()
+            except Exception as e:
+                logger.error("Probe failure: %s", e)
+                out = None
+        else:
+            logger.info(
+                "Running %s probe %s on %s.", p.level, p.get_name(), dbname)
+            conn = pool.getconn(dbname=dbname)
+            deadline = ProbeDeadline(conn, timeout)
+            try:
+                with deadline:
+                    out = p.run(conn, conninfo)
+            except Exception as e:
+                if not deadline.expired:
+                    logger.error("Probe failure: %s", e)
+                    raise
+                # Probe without error handling raised query cancelation.
+                out = []
+            timedout = deadline.expired
+            if timedout:
+                logger.error(
+                    "Probe %s on %s canceled after %ss.",
+                    p.get_name(), dbname, timeout)
+
+        results.append((p, out, time.time() - start, timedout))
+    return results
+
+
+class ProbeDeadline:
+    # Cancel running query on conn once timeout seconds are elapsed.
+
+    def __init__(self, conn, timeout=None):
+        self.conn = conn
+        self.timeout = timeout
+        self.timer = None
+        self.expired = False
+
+    def __enter__(self):
+        if self.timeout:
+            self.timer = Timer(self.timeout, self.cancel)
+            self.timer.daemon = True
+            self.timer.start()
+        return self
+
+    def __exit__(self, *_):
+        if self.timer:
+            self.timer.cancel()
+        if self.expired:
+            # Reset aborted transaction for next probes on this connection.
+            self.conn.rollback()
+
+    def cancel(self):
+        self.expired = True
+        self.conn.cancel()
+
+
 def parse_primary_conninfo(pci):
     # Parse primary_conninfo string picked up from recovery.conf file
     m = re.match(r'.*primary_conninfo\s*=\s*\'(.*)\'[^\']*$', pci)
@@ -194,6 +293,8 @@ class Probe:
     last_measure = {}
     last_measure_time = {}
     home = None
+    # Optionnal db.LastMeasuresStore set by run_probes()
+    last_measures = None
 
     def __init__(self, options):
         pass
@@ -224,6 +325,9 @@ class Probe:
         return None
 
     def get_last_measure(self, key):
+        if self.last_measures is not None:
+            return self.last_measures.get(self.get_name(), key)
+
         row = db.get_last_measure(
             self.home,
             'monitoring.db',
@@ -233,6 +337,9 @@ class Probe:
             return dict(time=row[0], data=json.loads(row[1]))
 
     def upsert_last_measure(self, time, key, data):
+        if self.last_measures is not None:
+            return self.last_measures.set(time, key, data)
+
         db.upsert_last_measure(
             self.home,
             'monitoring.db',
@@ -1,6 +1,9 @@
 import logging
+from collections import OrderedDict
+from itertools import count
+from time import time
 
-from bottle import Bottle, default_app, HTTPError
+from bottle import Bottle, default_app, HTTPError, request
 
 from ...tools import now
 from ...toolkit.configuration import OptionSpec
@@ -15,11 +18,71 @@ SELECT
   rolname,
   datname,
   pgss.*
-FROM pg_stat_statements pgss
+FROM pg_stat_statements(%(showtext)s) pgss
 JOIN pg_authid ON pgss.userid = pg_authid.oid
 JOIN pg_database ON pgss.dbid = pg_database.oid
 """
 
+query_texts = """\
+SELECT userid, dbid, queryid, query
+FROM pg_stat_statements(true)
+WHERE queryid = ANY(%(queryids)s)
+"""
+
+TEXT_COLUMNS = ('rolname', 'datname', 'query')
+
+
+class Snapshots:
+    # Counters of latest snapshots sent to clients, by snapshot token.
+    #
+    # Kept in memory of HTTP process. If agent restarts, client sends an
+    # unknown token and receives a full snapshot.
+
+    size = 4
+
+    def __init__(self):
+        self.snapshots = OrderedDict()
+        self.sequence = count()
+
+    def get(self, token):
+        return self.snapshots.get(token)
+
+    def add(self, counters):
+        token = '%x.%x' % (int(time()), next(self.sequence))
+        self.snapshots[token] = counters
+        while len(self.snapshots) > self.size:
+            self.snapshots.popitem(last=False)
+        return token
+
+
+snapshots = Snapshots()
+
+
+def statement_key(row):
+    return row['userid'], row['dbid'], row['queryid'], row.get('toplevel')
+
+
+def statement_counters(row):
+    return tuple(v for k, v in sorted(row.items()) if k not in TEXT_COLUMNS)
+
+
+def diff_statements(previous, rows):
+    # Returns statements changed since previous snapshot, statements new to
+    # client and keys of statements evicted from pg_stat_statements.
+    counters = dict()
+    changed = []
+    new = []
+    for row in rows:
+        key = statement_key(row)
+        counters[key] = statement_counters(row)
+        if key not in previous:
+            new.append(row)
+            changed.append(row)
+        elif previous[key] != counters[key]:
+            changed.append(row)
+    removed = [list(key) for key in previous if key not in counters]
+    return changed, new, removed, counters
+
 
 @bottle.get("/")
 def get_statements(pgpool):
@@ -29,15 +92,22 @@ def get_statements(pgpool):
     config = app.config
     dbname = config.statements.dbname
     snapshot_datetime = now()
+    # Clients supporting incremental snapshot send snapshot parameter, empty
+    # on first request.
+    delta = 'snapshot' in request.query
+    previous = snapshots.get(request.query.get('snapshot'))
     try:
         conn = pgpool.getconn(dbname)
-        data = list(conn.query(query))
+        data = list(conn.query(query, dict(showtext=previous is None)))
+        if previous is not None:
+            data, new, removed, counters = diff_statements(previous, data)
+            data = fetch_texts(conn, data, new, counters)
+        elif delta:
+            counters = dict(
+                (statement_key(r), statement_counters(r)) for r in data)
     except Exception as e:
         pg_version = app.postgres.fetch_version()
-        if (
-            pg_version < 90600 or
-            'relation "pg_stat_statements" does not exist' in str(e)
-        ):
+        if pg_version < 90600 or is_extension_missing(e):
             raise HTTPError(
                 404, "pg_stat_statements not enabled on database %s" % dbname
             )
@@ -48,7 +118,46 @@ def get_statements(pgpool):
         )
         raise HTTPError(500, e)
     else:
-        return {"snapshot_datetime": snapshot_datetime, "data": data}
+        response = {"snapshot_datetime": snapshot_datetime, "data": data}
+        if delta:
+            response['snapshot'] = snapshots.add(counters)
+        if previous is not None:
+            response['delta'] = True
+            response['removed'] = removed
+        return response
+
+
+def is_extension_missing(e):
+    # pg_stat_statements view or function is missing, depending on query.
+    msg = str(e)
+    return (
+        'relation "pg_stat_statements" does not exist' in msg or
+        ('function pg_stat_statements(' in msg and 'does not exist' in msg)
+    )
+
+
+def fetch_texts(conn, data, rows, counters):
+    # Fill query text of new rows, read without text. A statement evicted
+    # since counters were read has no text: skip it from data and counters,
+    # it will be sent as new if it comes back. Returns data.
+    if not rows:
+        return data
+    queryids = list(set(r['queryid'] for r in rows))
+    texts = dict(
+        ((r['userid'], r['dbid'], r['queryid']), r['query'])
+        for r in conn.query(query_texts, dict(queryids=queryids))
+    )
+    missing = set()
+    for row in rows:
+        row['query'] = texts.get((row['userid'], row['dbid'], row['queryid']))
+        if row['query'] is None:
+            key = statement_key(row)
+            missing.add(key)
+            counters.pop(key, None)
+    if missing:
+        logger.debug("Skipping %s statements without text.", len(missing))
+        data = [r for r in data if statement_key(r) not in missing]
+    return data
 
 
 class StatementsPlugin:
@@ -10,6 +10,7 @@
 import ctypes
 import logging
 import re
+import threading
 from contextlib import closing
 
 from psycopg2 import connect
@@ -109,25 +110,33 @@ class Postgres:
 class DBConnectionPool:
     # Pool one connection per database.
     #
-    # Not thread-safe.
+    # getconn() is thread-safe, but a connection must not be used by two
+    # threads at the same time.
 
     def __init__(self, postgres):
         self.postgres = postgres
         self.pool = dict()
+        self.lock = threading.Lock()
 
     def getconn(self, dbname=None):
         dbname = dbname or self.postgres.dbname
-        conn = self.pool.get(dbname)
-        if conn and conn.pqstatus() == conn.CONNECTION_BAD:
-            logger.debug("Recycling bad connection to db %s.", dbname)
-            conn.close()
-            del self.pool[dbname]
-            conn = None
+        with self.lock:
+            conn = self.pool.get(dbname)
+            if conn and conn.pqstatus() == conn.CONNECTION_BAD:
+                logger.debug("Recycling bad connection to db %s.", dbname)
+                conn.close()
+                del self.pool[dbname]
+                conn = None
 
         if not conn:
+            # Connect without lock to open connections concurrently.
             logger.debug("Opening connection to db %s.", dbname)
             pqvars = self.postgres.pqvars(dbname=dbname)
-            conn = self.pool.setdefault(dbname, connect(**pqvars))
+            new = connect(**pqvars)
+            with self.lock:
+                conn = self.pool.setdefault(dbname, new)
+            if conn is not new:
+                new.close()
 
         return conn
 
@@ -0,0 +1,60 @@
+def test_proc_sampler():
+    import os
+    from time import sleep
+    from temboardagent.plugins.activity.process import ProcSampler
+
+    sampler = ProcSampler(interval=.01, idle_timeout=.1)
+    pid = os.getpid()
+    # Unknown PID gets N/A values, new PID is compared to process start.
+    stats = sampler.stats([pid, 2 ** 30])
+    assert 'N/A' == stats[2 ** 30]['cpu']
+    assert isinstance(stats[pid]['cpu'], float)
+    assert stats[pid]['memory'] > 0
+    assert sampler.thread
+
+    sleep(.05)
+    previous, last = sampler.samples[pid]
+    assert previous.time > 0
+    assert last.time > previous.time
+    # Unreadable PID is not kept.
+    assert 2 ** 30 not in sampler.samples
+
+    # Sampling stops when idle.
+    sleep(.3)
+    assert sampler.thread is None
+    assert {} == sampler.samples
+
+
+def test_filter_activity(mocker):
+    from temboardagent.plugins.activity import functions
+
+    stats = dict(iow='N', cpu=1.5, memory=.1, read_s='0B', write_s='0B')
+    mocker.patch.object(functions.sampler, 'stats', return_value={1: stats})
+    conn = mocker.Mock(name='conn')
+    conn.query.return_value = iter([dict(pid=1, duration=-1.)])
+    conn.queryscalar.return_value = 3
+
+    data = functions.filter_activity(
+        conn, 'SELECT 1', ['pid', 'duration', 'query'],
+        state=['active'], min_duration=1., sort='pid', limit=1,
+        query_length=80,
+    )
+
+    assert 3 == data['total']
+    assert [dict(pid=1, duration=0, **stats)] == data['rows']
+    sql, params = conn.query.call_args[0]
+    assert 'left(query, %(query_length)s) AS query' in sql
+    assert 'state = ANY(%(state)s)' in sql
+    assert 'database =' not in sql
+    assert 'ORDER BY "pid" ASC' in sql
+    assert 1 == params['limit']
+    count, _ = conn.queryscalar.call_args[0]
+    assert 'count(*)' in count
+    assert 'LIMIT' not in count
+
+    # Page past the end still reports total.
+    conn.query.return_value = iter([])
+    data = functions.filter_activity(
+        conn, 'SELECT 1', ['pid', 'duration'], limit=1, offset=10)
+    assert 3 == data['total']
+    assert [] == data['rows']
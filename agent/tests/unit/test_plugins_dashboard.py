@@ -0,0 +1,121 @@
+def test_slow_metrics_cache(tmpdir, mocker):
+    from temboardagent.plugins.dashboard import db
+    from temboardagent.plugins.dashboard.metrics import cached
+
+    home = str(tmpdir)
+    db.bootstrap(home, 'dashboard.db')
+    app = mocker.Mock(name='app')
+    app.config.temboard.home = home
+    app.config.dashboard.slow_metrics_interval = 300
+
+    func = mocker.Mock(name='func', return_value='1 GB')
+    assert '1 GB' == cached(app, 'databases_size', func)
+    assert '1 GB' == cached(app, 'databases_size', func)
+    assert 1 == func.call_count
+
+    # Expired cache is refreshed.
+    app.config.dashboard.slow_metrics_interval = -1
+    func.return_value = '2 GB'
+    assert '2 GB' == cached(app, 'databases_size', func)
+    assert 2 == func.call_count
+
+    # Cache is refreshed when tag changes, e.g. on PostgreSQL restart.
+    app.config.dashboard.slow_metrics_interval = 300
+    assert '2 GB' == cached(app, 'databases_size', func)
+    assert 2 == func.call_count
+    func.return_value = '3 GB'
+    assert '3 GB' == cached(app, 'databases_size', func, tag='restarted')
+    assert 3 == func.call_count
+
+
+def test_timing():
+    from temboardagent.plugins.dashboard.metrics import timing
+
+    timings = {}
+    with timing(timings, 'buffers'):
+        pass
+    assert timings['buffers'] >= 0
+
+
+def test_history_ring_buffer():
+    from multiprocessing import Process
+    from temboardagent.plugins.dashboard.db import History
+
+    history = History(3, slot_size=64)
+    assert history.last() is None
+    assert [] == history.items()
+
+    for i in range(4):
+        history.append(float(i), b'{"i": %d}' % i)
+
+    assert 3 == len(history)
+    assert (3., b'{"i": 3}') == history.last()
+    assert [1., 2., 3.] == [t for t, _ in history.items()]
+
+    # Writes of forked processes are visible to parent.
+    p = Process(target=history.append, args=(4., b'{"i": 4}'))
+    p.start()
+    p.join()
+    assert (4., b'{"i": 4}') == history.last()
+
+    try:
+        history.append(5., b'x' * 64)
+        assert False, "Large snapshot accepted."
+    except ValueError:
+        pass
+
+
+def test_history_persistence(tmpdir):
+    from temboardagent.plugins.dashboard import db
+    from temboardagent.plugins.dashboard.metrics import (
+        get_history_metrics_queue,
+    )
+
+    home = str(tmpdir)
+    db.bootstrap(home, 'dashboard.db')
+    history = db.History(3)
+    for i in range(3):
+        history.append(float(i), b'{"i": %d}' % i)
+    assert b'[{"i": 0},{"i": 1},{"i": 2}]' == (
+        get_history_metrics_queue(history))
+
+    db.save_history(home, 'dashboard.db', history.items())
+    db.bootstrap(home, 'dashboard.db', keep_history=True)
+    assert history.items()[1:] == db.load_history(home, 'dashboard.db', 1.)
+
+    db.bootstrap(home, 'dashboard.db')
+    assert [] == db.load_history(home, 'dashboard.db', 0)
+
+
+def test_history_wait():
+    from multiprocessing import Process
+    from time import sleep
+    from temboardagent.plugins.dashboard.db import History
+
+    history = History(3, slot_size=64)
+    assert history.wait(0, timeout=0) is None
+
+    history.append(1., b'{"t": 1}')
+    assert (1., b'{"t": 1}') == history.wait(0, timeout=1)
+    # Timeout returns latest snapshot.
+    assert (1., b'{"t": 1}') == history.wait(1., timeout=.01)
+
+    def append_later():
+        sleep(.05)
+        history.append(2., b'{"t": 2}')
+
+    p = Process(target=append_later)
+    p.start()
+    assert (2., b'{"t": 2}') == history.wait(1., timeout=5)
+    p.join()
+
+
+def test_next_delay():
+    from temboardagent.plugins.dashboard import next_delay
+
+    # Empty history, wait one collector run.
+    assert 2 == next_delay(None, 2, 10.)
+    assert 1.5 == next_delay(10., 2, 10.5)
+    # Collector is late, keep phase of last snapshot.
+    assert 1.5 == next_delay(10., 2, 12.5)
+    assert 1.5 == next_delay(10., 2, 16.5)
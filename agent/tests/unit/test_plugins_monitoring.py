@@ -0,0 +1,184 @@
+def test_last_measures_store(tmpdir):
+    from temboardagent.plugins.monitoring import db
+    from temboardagent.plugins.monitoring.probes import Probe
+
+    db.bootstrap(str(tmpdir), 'monitoring.db')
+
+    class probe_dummy(Probe):
+        pass
+
+    probe = probe_dummy(options={})
+    probe.set_home(str(tmpdir))
+    # Without store, delta is stored immediately.
+    assert (None, None) == probe.delta('a', dict(value=1))
+    assert db.get_last_measure(str(tmpdir), 'monitoring.db', 'dummya')
+
+    with db.LastMeasuresStore(str(tmpdir), 'monitoring.db') as store:
+        probe.last_measures = store
+        interval, deltas = probe.delta('a', dict(value=3))
+        assert dict(value=2) == deltas
+        assert (None, None) == probe.delta('b', dict(value=1))
+        # Nothing is written before flush.
+        row = db.get_last_measure(str(tmpdir), 'monitoring.db', 'dummyb')
+        assert row is None
+
+    # Exiting context flushes pending measures.
+    _, data = db.get_last_measure(str(tmpdir), 'monitoring.db', 'dummya')
+    assert '{"value": 3}' == data
+    assert db.get_last_measure(str(tmpdir), 'monitoring.db', 'dummyb')
+
+
+def test_run_probes_concurrent(mocker):
+    from temboardagent.plugins.monitoring.probes import (
+        HostProbe, SqlProbe, run_probes,
+    )
+
+    class probe_host(HostProbe):
+        def run(self):
+            return [dict(value=1)]
+
+    class probe_db(SqlProbe):
+        level = 'database'
+
+        def run(self, conn, conninfo):
+            return [dict(dbname=conninfo['dbname'])]
+
+    pool = mocker.Mock(name='pool')
+    instance = dict(
+        available=True, version_num=140000, database='postgres',
+        dbnames=[dict(dbname='db0'), dict(dbname='db1'), dict(dbname='db2')],
+    )
+    timings = {}
+    output = run_probes(
+        [probe_host(options={}), probe_db(options={})], pool, [instance],
+        max_workers=4, timeout=10, timings=timings,
+    )
+
+    assert 1 == len(output['host'])
+    dbnames = [r['dbname'] for r in output['db']]
+    assert ['db0', 'db1', 'db2'] == dbnames
+    assert 0 == timings['db']['timeouts']
+    assert 'duration' in timings['host']
+
+
+def test_probe_deadline(mocker):
+    from time import sleep
+    from temboardagent.plugins.monitoring.probes import ProbeDeadline
+
+    conn = mocker.Mock(name='conn')
+    with ProbeDeadline(conn, timeout=.01) as deadline:
+        sleep(.1)
+
+    assert deadline.expired
+    assert conn.cancel.called
+    assert conn.rollback.called
+
+    conn = mocker.Mock(name='conn')
+    with ProbeDeadline(conn, timeout=1) as deadline:
+        pass
+
+    assert not deadline.expired
+    assert not conn.cancel.called
+
+
+def test_metrics_queue(tmpdir):
+    import json
+    import sqlite3
+    from time import time
+    from temboardagent.plugins.monitoring import db
+
+    home = str(tmpdir)
+    db.bootstrap(home, 'monitoring.db')
+    now = time()
+    db.add_metric(home, 'monitoring.db', now - 7 * 3600, dict(old=True))
+    db.add_metric(home, 'monitoring.db', now, dict(data=dict(cpu=[])))
+    # Legacy uncompressed row.
+    with sqlite3.connect(tmpdir.join('monitoring.db').strpath) as conn:
+        conn.execute(
+            "INSERT INTO metrics VALUES(?, ?)", (now + 1, '{"legacy": 1}'))
+
+    rows = db.get_metrics(home, 'monitoring.db', start_timestamp=1)
+    docs = [json.loads(db.decompress_metric(data)) for _, data in rows]
+    assert [dict(old=True), dict(data=dict(cpu=[])), dict(legacy=1)] == docs
+
+    assert 1 == db.purge_metrics(home, 'monitoring.db')
+    rows = db.get_metrics(home, 'monitoring.db', start_timestamp=1)
+    assert 2 == len(rows)
+
+
+def test_history_cursor():
+    import pytest
+    from temboardagent.plugins.monitoring import decode_cursor, encode_cursor
+
+    time_ = 1663077480.1234567
+    cursor = encode_cursor(time_)
+    assert time_ == decode_cursor(cursor)
+
+    with pytest.raises(ValueError):
+        decode_cursor('!!')
+
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(time_).replace('djE', 'djI'))
+
+
+def test_history_ndjson(tmpdir):
+    import json
+    from temboardagent.plugins.monitoring import (
+        db, decode_cursor, generate_ndjson_history,
+    )
+
+    home = str(tmpdir)
+    db.bootstrap(home, 'monitoring.db')
+    for t in 1., 2., 3.:
+        db.add_metric(home, 'monitoring.db', t, dict(t=t))
+
+    metrics = db.iter_metrics(home, 'monitoring.db', start_timestamp=.5)
+    lines = list(generate_ndjson_history(metrics))
+    items = [json.loads(line.decode('utf-8')) for line in lines]
+    assert [1., 2., 3.] == [i['metric']['t'] for i in items]
+
+    after = decode_cursor(items[1]['cursor'])
+    rows = list(db.iter_metrics(home, 'monitoring.db', after=after))
+    assert [3.] == [t for t, _ in rows]
+
+
+def test_run_probes_timeout(mocker):
+    from threading import Event
+    from temboardagent.plugins.monitoring.probes import SqlProbe, run_probes
+
+    class probe_slow(SqlProbe):
+        level = 'database'
+
+        def run(self, conn, conninfo):
+            if 'slow' == conninfo['dbname']:
+                # Block until canceled, like a slow query.
+                assert conn.canceled.wait(5)
+                raise Exception("canceling statement due to user request")
+            return [dict(dbname=conninfo['dbname'])]
+
+    conns = {}
+
+    def getconn(dbname=None):
+        if dbname not in conns:
+            conn = mocker.Mock(name='conn-%s' % dbname)
+            conn.canceled = Event()
+            conn.cancel.side_effect = conn.canceled.set
+            conns[dbname] = conn
+        return conns[dbname]
+
+    pool = mocker.Mock(name='pool')
+    pool.getconn.side_effect = getconn
+    instance = dict(
+        available=True, version_num=140000, database='postgres',
+        dbnames=[dict(dbname='slow'), dict(dbname='fast')],
+    )
+    timings = {}
+    output = run_probes(
+        [probe_slow(options={})], pool, [instance],
+        max_workers=2, timeout=.1, timings=timings,
+    )
+
+    assert [dict(dbname='fast')] == [
+        dict(dbname=r['dbname']) for r in output['slow']]
+    assert 1 == timings['slow']['timeouts']
+    assert conns['slow'].rollback.called
@@ -0,0 +1,77 @@
+def test_diff_statements():
+    from temboardagent.plugins.statements import (
+        diff_statements, statement_counters, statement_key,
+    )
+
+    def row(queryid, calls, query=None):
+        return dict(
+            userid=10, dbid=5, queryid=queryid, calls=calls,
+            rolname='postgres', datname='postgres', query=query,
+        )
+
+    previous = dict(
+        (statement_key(r), statement_counters(r))
+        for r in [row(1, 1, 'SELECT 1'), row(2, 1, 'SELECT 2'), row(3, 1)]
+    )
+    changed, new, removed, counters = diff_statements(
+        previous, [row(1, 1), row(2, 5), row(4, 1)])
+
+    assert [2, 4] == [r['queryid'] for r in changed]
+    assert [4] == [r['queryid'] for r in new]
+    assert [[10, 5, 3, None]] == removed
+    assert 3 == len(counters)
+
+
+def test_snapshots():
+    from temboardagent.plugins.statements import Snapshots
+
+    snapshots = Snapshots()
+    snapshots.size = 2
+    tokens = [snapshots.add({i: i}) for i in range(3)]
+    assert snapshots.get(tokens[0]) is None
+    assert {2: 2} == snapshots.get(tokens[2])
+    assert snapshots.get(None) is None
+
+
+def test_get_statements_extension_missing(mocker):
+    import pytest
+    from bottle import HTTPError
+    from temboardagent.plugins import statements
+
+    app = mocker.patch(
+        'temboardagent.plugins.statements.default_app').return_value
+    app.temboard.postgres.fetch_version.return_value = 140000
+    mocker.patch('temboardagent.plugins.statements.request', query={})
+    pgpool = mocker.Mock(name='pgpool')
+    conn = pgpool.getconn.return_value
+    conn.query.side_effect = Exception(
+        "function pg_stat_statements(boolean) does not exist")
+
+    with pytest.raises(HTTPError) as ei:
+        statements.get_statements(pgpool)
+    assert 404 == ei.value.status_code
+
+    conn.query.side_effect = Exception("permission denied")
+    with pytest.raises(HTTPError) as ei:
+        statements.get_statements(pgpool)
+    assert 500 == ei.value.status_code
+
+
+def test_fetch_texts(mocker):
+    from temboardagent.plugins.statements import fetch_texts, statement_key
+
+    def row(queryid, query=None):
+        return dict(userid=10, dbid=5, queryid=queryid, calls=1, query=query)
+
+    conn = mocker.Mock(name='conn')
+    conn.query.return_value = [row(1, 'SELECT 1')]
+    data = [row(1), row(2), row(3, 'SELECT 3')]
+    counters = dict((statement_key(r), r['calls']) for r in data)
+
+    # Statement 2 is evicted before its text is read.
+    data = fetch_texts(conn, data, data[:2], counters)
+
+    assert [1, 3] == [r['queryid'] for r in data]
+    assert 'SELECT 1' == data[0]['query']
+    assert statement_key(row(2)) not in counters
+    assert 2 == len(counters)
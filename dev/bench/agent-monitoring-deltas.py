@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# Benchmark delta computation of agent monitoring probes against the number
+# of rows returned by a probe, e.g. one row per table or per database.
+#
+# Compares one SQLite connection per row with a LastMeasuresStore shared by
+# the whole collection run. Each case runs two collections: the first one
+# populates last_measures, the second one computes deltas.
+#
+# usage: dev/bench/agent-monitoring-deltas.py [ROWS ...]
+#
+
+import logging
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from temboardagent.plugins.monitoring import db
+from temboardagent.plugins.monitoring.probes import Probe
+
+
+logger = logging.getLogger('bench')
+
+
+class probe_bench(Probe):
+    pass
+
+
+def collect(probe, rows, run):
+    for i in range(rows):
+        probe.delta('table%d' % i, dict(
+            n_tup_ins=run * i, n_tup_upd=run * i, n_tup_del=run * i,
+        ))
+
+
+def bench(rows, batched):
+    with TemporaryDirectory() as home:
+        db.bootstrap(home, 'monitoring.db')
+        probe = probe_bench(options={})
+        probe.set_home(home)
+        durations = []
+        for run in 1, 2:
+            start = perf_counter()
+            if batched:
+                with db.LastMeasuresStore(home, 'monitoring.db') as store:
+                    probe.last_measures = store
+                    collect(probe, rows, run)
+            else:
+                collect(probe, rows, run)
+            durations.append(perf_counter() - start)
+        return durations
+
+
+def main(argv=sys.argv[1:]):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    sizes = [int(a) for a in argv] or [10, 100, 1000, 5000]
+
+    logger.info(
+        "%8s %14s %14s %14s %14s",
+        "rows", "legacy first", "legacy delta", "store first", "store delta")
+    for rows in sizes:
+        legacy = bench(rows, batched=False)
+        batched = bench(rows, batched=True)
+        logger.info(
+            "%8d %13.3fs %13.3fs %13.3fs %13.3fs",
+            rows, legacy[0], legacy[1], batched[0], batched[1])
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#
+# Benchmark monitoring chart queries on a temBoard repository.
+#
+# Compares chart queries reading metrics through the former dynamic
+# expand_data_by_host_id() and expand_data_by_instance_id() functions with
+# the static expand_metric_*() functions, for 1 hour, 24 hours and 7 days
+# ranges ending now. Uses first monitored instance unless --instance-id is
+# given. Charts by cpu, database, mount point, etc. use the latest key
+# collected for the instance.
+#
+# usage: dev/bench/ui-monitoring-charts.py [--instance-id N] [--loops N]
+#            postgresql://temboard@localhost/temboard [METRIC ...]
+#
+
+import argparse
+import logging
+import re
+import sys
+from datetime import datetime, timedelta, timezone
+from statistics import median
+from time import perf_counter
+
+import psycopg2
+
+from temboardui.plugins.monitoring.chartdata import METRICS
+
+
+logger = logging.getLogger('bench')
+RANGES = [
+    ('1h', timedelta(hours=1)),
+    ('24h', timedelta(hours=24)),
+    ('7d', timedelta(days=7)),
+]
+
+
+def legacy_query(cur, sql):
+    # Rewrite chart query to read from expand_data_by_*() functions, as up to
+    # temBoard 7.
+    def replace(m):
+        name, id_ = m.group(1), m.group(2)
+        cur.execute("""\
+        SELECT string_agg(
+            quote_ident(attname) || ' ' || format_type(atttypid, atttypmod),
+            ', ' ORDER BY attnum)
+        FROM pg_catalog.pg_attribute
+        WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+        """, (name + '_current',))
+        columns, = cur.fetchone()
+        return (
+            "FROM expand_data_by_%s('%s', tstzrange(%%(start)s, %%(end)s), "
+            "%%(%s)s)\nAS (%s)\n" % (id_, name, id_, columns))
+
+    return re.sub(
+        r"FROM expand_(metric_\w+)\(tstzrange\(%\(start\)s, %\(end\)s\), "
+        r"%\((host_id|instance_id)\)s\)\n",
+        replace, sql)
+
+
+def latest_key(cur, sql, ids):
+    # Returns latest value of key column filtered by chart query, if any.
+    m = re.search(
+        r"FROM expand_(metric_\w+)\(tstzrange\(%\(start\)s, %\(end\)s\), "
+        r"%\((host_id|instance_id)\)s\)\nWHERE (\w+) = %\(key\)s", sql)
+    if not m:
+        return None
+    name, id_, key = m.groups()
+    cur.execute(
+        "SELECT %s FROM %s_current WHERE %s = %%s "
+        "ORDER BY datetime DESC LIMIT 1" % (key, name, id_),
+        (ids[id_],))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def run(cur, sql, args, loops):
+    durations = []
+    for _ in range(loops):
+        start = perf_counter()
+        cur.execute(sql, args)
+        cur.fetchall()
+        durations.append(perf_counter() - start)
+    return median(durations)
+
+
+def main(argv=sys.argv[1:]):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dsn', help="URL of temBoard repository.")
+    parser.add_argument('metrics', nargs='*', help="Charts to benchmark.")
+    parser.add_argument('--instance-id', type=int)
+    parser.add_argument('--loops', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("SET search_path TO monitoring")
+    cur.execute("""\
+    SELECT instance_id, host_id FROM instances
+    WHERE %(id)s IS NULL OR instance_id = %(id)s
+    ORDER BY instance_id LIMIT 1
+    """, dict(id=args.instance_id))
+    instance_id, host_id = cur.fetchone()
+    ids = dict(host_id=host_id, instance_id=instance_id)
+
+    logger.info(
+        "%-24s %5s %12s %12s %8s", 'chart', 'range', 'legacy', 'static',
+        'speedup')
+    totals = {}
+    for name in args.metrics or sorted(METRICS):
+        sql = METRICS[name]['sql_nozoom']
+        legacy = legacy_query(cur, sql)
+        key = latest_key(cur, sql, ids)
+        for label, delta in RANGES:
+            end = datetime.now(timezone.utc)
+            qargs = dict(start=end - delta, end=end, key=key, **ids)
+            before = run(cur, legacy, qargs, args.loops)
+            after = run(cur, sql, qargs, args.loops)
+            total = totals.setdefault(label, [0, 0])
+            total[0] += before
+            total[1] += after
+            logger.info(
+                "%-24s %5s %10.1fms %10.1fms %7.1fx",
+                name, label, before * 1000, after * 1000, before / after)
+
+    for label, _ in RANGES:
+        before, after = totals[label]
+        logger.info(
+            "%-24s %5s %10.1fms %10.1fms %7.1fx",
+            'total', label, before * 1000, after * 1000, before / after)
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+#
+# Benchmark insertion of monitoring metrics in temBoard repository.
+#
+# Replays agent payloads and compares inserting one record per statement and
+# transaction with inserting metrics grouped by table, as the collector does.
+#
+# Payloads are either recorded from an agent, as JSON array or NDJSON:
+#
+#   AGENT=https://agent:2345
+#   temboard query-agent \
+#       "$AGENT/monitoring/history?limit=1000&start=2022-01-01T00:00:00Z" \
+#       > payloads.json
+#
+# or generated with --databases N. Metrics are inserted twice in
+# monitoring.metric_*_current tables: use a disposable repository.
+#
+# usage: dev/bench/ui-monitoring-ingest.py [--databases N] [--points N]
+#            postgresql://temboard@localhost/temboard [payloads.json]
+#
+
+import argparse
+import json
+import logging
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from temboardui.plugins.monitoring.model import db
+from temboardui.plugins.monitoring.tools import (
+    get_instance_id,
+    group_metric_values,
+    insert_metrics,
+    merge_agent_info,
+)
+
+
+logger = logging.getLogger('bench')
+
+
+def load_payloads(path):
+    with open(path) as fo:
+        content = fo.read()
+    if content.lstrip().startswith('['):
+        return json.loads(content)
+    # NDJSON from /monitoring/history?format=ndjson
+    return [
+        json.loads(line)['metric'] for line in content.splitlines() if line
+    ]
+
+
+def generate_payloads(databases, points):
+    hostinfo = dict(
+        hostname='bench.temboard.local', os='Linux', os_version='5.10',
+        os_flavour='Bench', cpu_arch='x86_64', cpu_count=4,
+        memory_size=8 * 1024 ** 3, swap_size=0, virtual=False,
+    )
+    instance = dict(
+        hostname='bench.temboard.local', instance='bench', port=5432,
+        local_name='bench', version='14.0', version_num=140000,
+        data_directory='/var/lib/postgresql/14/bench', sysuser='postgres',
+        standby=False, available=True, max_connections=100,
+        dbnames=[
+            dict(dbname='db%d' % i, encoding='UTF8')
+            for i in range(databases)
+        ],
+        tablespaces=[],
+    )
+    keys = dict(
+        dbname=['db%d' % i for i in range(databases)],
+        spcname=['pg_default'],
+        mount_point=['/'],
+        cpu=['cpu%d' % i for i in range(4)],
+        upstream=['127.0.0.1:5433'],
+        none=[None],
+    )
+
+    start = datetime(2022, 1, 1)
+    for i in range(points):
+        dt = (start + timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:%S +0000")
+        data = dict()
+        for name, table in db.METRIC_TABLES.items():
+            records = []
+            for key in keys[table.key or 'none']:
+                record = dict(datetime=dt)
+                record.update((c, 0) for c in table.columns)
+                if 'measure_interval' in table.columns:
+                    record['measure_interval'] = 60.
+                if 'stats_reset' in table.columns:
+                    record['stats_reset'] = None
+                if 'device' in table.columns:
+                    record['device'] = '/dev/bench'
+                if 'current_location' in table.columns:
+                    record['current_location'] = '0/0'
+                if table.key:
+                    record[table.key] = key
+                records.append(record)
+            data[name] = records
+        yield dict(
+            datetime=dt, hostinfo=hostinfo, instances=[instance], data=data)
+
+
+def insert_per_record(session, host_id, instance_id, data):
+    for metric_name, values in group_metric_values(host_id, instance_id, data):
+        for value in values:
+            db.insert_metric_values(session, metric_name, [value])
+            session.commit()
+
+
+def insert_grouped(session, host_id, instance_id, data):
+    insert_metrics(session, host_id, instance_id, data)
+    session.commit()
+
+
+def main(argv=sys.argv[1:]):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dsn', help="SQLAlchemy URL of temBoard repository.")
+    parser.add_argument('payloads', nargs='?', help="Recorded agent history.")
+    parser.add_argument('--databases', type=int, default=100)
+    parser.add_argument('--points', type=int, default=60)
+    args = parser.parse_args(argv)
+
+    if args.payloads:
+        payloads = load_payloads(args.payloads)
+    else:
+        payloads = list(generate_payloads(args.databases, args.points))
+
+    session = sessionmaker(bind=create_engine(args.dsn))()
+    payload = payloads[0]
+    host = merge_agent_info(
+        session, payload['hostinfo'], payload['instances'][0])
+    session.commit()
+    host_id = host.host_id
+    instance_id = get_instance_id(
+        session, host_id, payload['instances'][0]['port'])
+
+    records = sum(
+        len(v or []) for p in payloads for v in p['data'].values())
+    logger.info("Replaying %s points, %s records.", len(payloads), records)
+
+    for name, insert in [
+            ('per record', insert_per_record), ('grouped', insert_grouped)]:
+        start = perf_counter()
+        for payload in payloads:
+            insert(session, host_id, instance_id, payload['data'])
+        duration = perf_counter() - start
+        logger.info(
+            "%-12s %8.3fs %10.0f records/s",
+            name, duration, records / duration)
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# Benchmark pivot of monitoring chart data, e.g. database size per database.
+#
+# Compares the former two-pass pivot based on csv.DictReader with
+# pivot_timeserie() on a generated CSV ordered by date, as returned by COPY.
+#
+# usage: dev/bench/ui-monitoring-pivot.py [--keys N] [ROWS ...]
+#
+
+import argparse
+import csv
+import logging
+import operator
+import sys
+from datetime import datetime, timedelta
+from io import StringIO
+from time import perf_counter
+
+from temboardui.plugins.monitoring.pivot import pivot_timeserie
+
+
+logger = logging.getLogger('bench')
+
+
+def legacy_pivot_timeserie(fd, index, key, value, output):
+    # Implementation of pivot_timeserie() up to temBoard 7.
+    fd.seek(0)
+    keys = {}
+    p = 1
+    for r in csv.DictReader(fd):
+        if r[key] not in keys:
+            keys[r[key]] = p
+            p += 1
+    sk = sorted(list(keys.items()), key=operator.itemgetter(1))
+    line = [index] + [x[0] for x in sk]
+    p_index = ''
+    fd.seek(0)
+    for r in csv.DictReader(fd):
+        if r[index] != p_index:
+            output.write(','.join(line)+'\n')
+            line = [''] * (len(keys)+1)
+            line[0] = r[index]
+        line[keys[r[key]]] = r[value]
+        p_index = r[index]
+    output.write(','.join(line)+'\n')
+
+
+def generate_csv(rows, keys):
+    fd = StringIO()
+    fd.write('date,dbname,size\n')
+    start = datetime(2022, 1, 1)
+    for i in range(rows):
+        date = start + timedelta(minutes=i // keys)
+        fd.write('%s+00,db%d,%d\n' % (date, i % keys, 8000000 + i))
+    return fd
+
+
+def bench(pivot, fd):
+    output = StringIO()
+    start = perf_counter()
+    pivot(fd, index='date', key='dbname', value='size', output=output)
+    return perf_counter() - start, output.getvalue()
+
+
+def main(argv=sys.argv[1:]):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=20)
+    parser.add_argument('rows', type=int, nargs='*')
+    args = parser.parse_args(argv)
+    sizes = args.rows or [1000, 100000, 1000000]
+
+    logger.info("%8s %10s %10s %8s", "rows", "legacy", "pivot", "speedup")
+    for rows in sizes:
+        fd = generate_csv(rows, args.keys)
+        legacy, expected = bench(legacy_pivot_timeserie, fd)
+        duration, output = bench(pivot_timeserie, fd)
+        assert expected == output, "Pivot output differs."
+        logger.info(
+            "%8d %9.3fs %9.3fs %7.1fx",
+            rows, legacy, duration, legacy / duration)
+
+
+if '__main__' == __name__:
+    main()
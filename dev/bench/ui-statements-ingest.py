@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#
+# Benchmark loading of a pg_stat_statements snapshot in temBoard repository.
+#
+# Replays a generated snapshot of N statements in statements_src_tmp, the
+# staging table of statements ingestion, comparing one INSERT per statement
+# with a single COPY as add_statement() does. Each load is rolled back,
+# process_statements() is not called.
+#
+# usage: dev/bench/ui-statements-ingest.py [--statements N]
+#            postgresql://temboard@localhost/temboard
+#
+
+import argparse
+import logging
+import sys
+from io import StringIO
+from time import perf_counter
+
+import psycopg2
+
+from temboardui.plugins.statements import (
+    format_copy_row,
+    statement_values,
+)
+
+
+logger = logging.getLogger('bench')
+
+
+class Instance(object):
+    agent_address = '192.0.2.1'
+    agent_port = 2345
+
+
+def generate_snapshot(statements):
+    data = []
+    for i in range(statements):
+        data.append(dict(
+            userid=10, rolname='postgres', dbid=5, datname='bench',
+            queryid=i, query="SELECT * FROM t%d WHERE id = $1" % i,
+            calls=i, total_exec_time=i * 1.5, rows=i,
+            shared_blks_hit=i, shared_blks_read=i, shared_blks_dirtied=i,
+            shared_blks_written=i, local_blks_hit=0, local_blks_read=0,
+            local_blks_dirtied=0, local_blks_written=0, temp_blks_read=0,
+            temp_blks_written=0, blk_read_time=0., blk_write_time=0.,
+            total_plan_time=0., wal_records=i, wal_fpi=0, wal_bytes=i * 100,
+            toplevel=True,
+        ))
+    return dict(snapshot_datetime='2022-01-01 00:00:00+00', data=data)
+
+
+def load_inserts(cur, snapshot):
+    for statement in snapshot['data']:
+        cur.execute(
+            "INSERT INTO statements_src_tmp VALUES (%s)" % (
+                ', '.join(['%s'] * 29)),
+            statement_values(
+                Instance, snapshot['snapshot_datetime'], statement),
+        )
+
+
+def load_copy(cur, snapshot):
+    buf = StringIO()
+    for statement in snapshot['data']:
+        buf.write(format_copy_row(statement_values(
+            Instance, snapshot['snapshot_datetime'], statement)))
+    buf.seek(0)
+    cur.copy_expert("COPY statements_src_tmp FROM STDIN", buf)
+
+
+def main(argv=sys.argv[1:]):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dsn', help="libpq URI of temBoard repository.")
+    parser.add_argument('--statements', type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    snapshot = generate_snapshot(args.statements)
+    rows = len(snapshot['data'])
+    conn = psycopg2.connect(args.dsn)
+    logger.info("Loading snapshot of %s statements.", rows)
+    for name, load in [('insert', load_inserts), ('copy', load_copy)]:
+        with conn.cursor() as cur:
+            cur.execute("SET search_path TO statements")
+            start = perf_counter()
+            load(cur, snapshot)
+            duration = perf_counter() - start
+        conn.rollback()
+        logger.info(
+            "%-8s %8.3fs %10.0f rows/s", name, duration, rows / duration)
+
+
+if '__main__' == __name__:
+    main()
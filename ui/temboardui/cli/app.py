@@ -211,6 +211,8 @@ def bootstrap_tornado_app(webapp, config):
         debug=config.logging.debug,
         template_path=base_path + "/templates",
         default_handler_class=Error404Handler,
+        # gzip CSV and JSON, chart data compresses very well.
+        compress_response=True,
     )
 
     return webapp
@@ -56,11 +56,12 @@ def check_connectivity(engine):
             sleep(i)
 
 
-def worker_engine(dbconf):
+def worker_engine(dbconf, **kw):
     """Create a new stand-alone SQLAlchemy engine to be instantiated in worker
-    context.
+    context. Keyword arguments are passed to create_engine(), e.g. to size
+    connection pool.
     """
-    return create_engine(format_dsn(dbconf))
+    return create_engine(format_dsn(dbconf), **kw)
 
 
 def check_schema():
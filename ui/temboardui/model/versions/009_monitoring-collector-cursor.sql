@@ -0,0 +1,2 @@
+-- Opaque cursor of the last metrics inserted from agent history stream.
+ALTER TABLE monitoring.collector_status ADD COLUMN last_cursor TEXT;
@@ -0,0 +1,13 @@
+-- Cache of agent /discover response, to pull metrics with a single request
+-- per agent.
+CREATE TABLE monitoring.discover_cache (
+  agent_address TEXT NOT NULL,
+  agent_port INTEGER NOT NULL,
+  host_id INTEGER NOT NULL REFERENCES monitoring.hosts(host_id) ON DELETE CASCADE,
+  instance_id INTEGER NOT NULL REFERENCES monitoring.instances(instance_id) ON DELETE CASCADE,
+  discover JSONB NOT NULL,
+  cdate TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (agent_address, agent_port)
+);
+
+GRANT ALL ON monitoring.discover_cache TO temboard;
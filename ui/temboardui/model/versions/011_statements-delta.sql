@@ -0,0 +1,202 @@
+-- Incremental snapshots of pg_stat_statements.
+--
+-- Agent returns only statements changed since the snapshot token stored in
+-- metas, without query text of statements already known. statements_last
+-- keeps the latest counters of each statement, to compute per-database
+-- records from a partial snapshot.
+--
+-- History stores only changed statements. A statement changed after some
+-- idle snapshots is also stored with its previous counters, dated with the
+-- previous snapshot, so that diffs of first and last records in a range are
+-- the same as with full snapshots.
+--
+-- On PostgreSQL 14+, pg_stat_statements tracks apart toplevel and nested
+-- executions of a statement. Statements history is keyed by queryid, dbid
+-- and userid, thus history records sum toplevel and nested counters.
+SET LOCAL search_path TO statements, public;
+
+ALTER TABLE metas ADD COLUMN snapshot TEXT;
+-- Timestamp of latest snapshot ingested.
+ALTER TABLE metas ADD COLUMN snapshot_ts TIMESTAMPTZ;
+
+ALTER TABLE statements_src_tmp ALTER COLUMN query DROP NOT NULL;
+ALTER TABLE statements_src_tmp ADD COLUMN toplevel BOOLEAN NOT NULL DEFAULT TRUE;
+
+CREATE TABLE statements_last (
+  agent_address TEXT NOT NULL,
+  agent_port INTEGER NOT NULL,
+  queryid BIGINT NOT NULL,
+  dbid OID NOT NULL,
+  userid OID NOT NULL,
+  toplevel BOOLEAN NOT NULL,
+  datname TEXT NOT NULL,
+  record statements_history_record NOT NULL,
+  FOREIGN KEY (agent_address, agent_port) REFERENCES application.instances (agent_address, agent_port) ON DELETE CASCADE ON UPDATE CASCADE,
+  PRIMARY KEY (agent_address, agent_port, queryid, dbid, userid, toplevel)
+);
+
+CREATE OR REPLACE FUNCTION statements_record_add(a statements_history_record, b statements_history_record)
+RETURNS statements_history_record AS $$
+  SELECT ROW(
+    greatest(a.ts, b.ts), a.calls + b.calls, a.total_exec_time + b.total_exec_time,
+    a.rows + b.rows, a.shared_blks_hit + b.shared_blks_hit,
+    a.shared_blks_read + b.shared_blks_read, a.shared_blks_dirtied + b.shared_blks_dirtied,
+    a.shared_blks_written + b.shared_blks_written, a.local_blks_hit + b.local_blks_hit,
+    a.local_blks_read + b.local_blks_read, a.local_blks_dirtied + b.local_blks_dirtied,
+    a.local_blks_written + b.local_blks_written, a.temp_blks_read + b.temp_blks_read,
+    a.temp_blks_written + b.temp_blks_written, a.blk_read_time + b.blk_read_time,
+    a.blk_write_time + b.blk_write_time, a.total_plan_time + b.total_plan_time,
+    a.wal_records + b.wal_records, a.wal_fpi + b.wal_fpi, a.wal_bytes + b.wal_bytes
+  )::statements_history_record;
+$$ LANGUAGE SQL IMMUTABLE STRICT;
+
+-- Sum of counters, dated with the latest timestamp.
+CREATE AGGREGATE statements_sum(statements_history_record) (
+  SFUNC = statements_record_add,
+  STYPE = statements_history_record
+);
+
+CREATE OR REPLACE FUNCTION statements_record_at(r statements_history_record, _ts timestamptz)
+RETURNS statements_history_record AS $$
+BEGIN
+  r.ts := _ts;
+  RETURN r;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+DROP FUNCTION process_statements(text, integer);
+
+CREATE OR REPLACE FUNCTION process_statements(_address text, _port integer, _delta boolean DEFAULT FALSE, _ts timestamptz DEFAULT NULL) RETURNS void AS $PROC$
+DECLARE
+    v_rowcount    bigint;
+    v_coalesce    integer := 100;
+    v_ts          timestamptz;
+    v_prev        timestamptz;
+    agg_seq  bigint;
+BEGIN
+    -- In this function, we process statements that have just been rerieved
+    -- from agent, and also aggregate counters by database. With _delta,
+    -- statements_src_tmp holds only statements changed since previous
+    -- snapshot. _ts is the timestamp of snapshot, even without changes.
+
+    -- Create new meta for agent if doesn't already exist
+    INSERT INTO metas (agent_address, agent_port) VALUES (_address, _port)
+    ON CONFLICT DO NOTHING;
+
+    PERFORM prevent_concurrent_snapshot(_address, _port);
+
+    v_ts := coalesce(_ts, (
+        SELECT ts
+        FROM statements_src_tmp
+        WHERE agent_address = _address AND agent_port = _port
+        LIMIT 1
+    ));
+
+    SELECT snapshot_ts INTO v_prev
+    FROM metas
+    WHERE agent_address = _address AND agent_port = _port;
+
+    -- Update meta with info from the current proccess (snapshot)
+    UPDATE metas
+    SET coalesce_seq = coalesce_seq + 1,
+        snapts = now(),
+        snapshot_ts = coalesce(v_ts, snapshot_ts),
+        error = NULL
+    WHERE agent_address = _address AND agent_port = _port
+    RETURNING coalesce_seq INTO agg_seq;
+
+    -- Only changed statements are stored in history. Store counters of
+    -- statements unchanged at previous snapshot as of previous snapshot, so
+    -- that diffs of a range starting before their change account for it,
+    -- as with full snapshots.
+    INSERT INTO statements_history_current
+        SELECT _address, _port, queryid, dbid, userid,
+        statements_record_at(statements_sum(record), v_prev)
+        FROM statements_last
+        WHERE agent_address = _address AND agent_port = _port
+        AND (queryid, dbid, userid) IN (
+            SELECT queryid, dbid, userid
+            FROM statements_src_tmp
+            WHERE agent_address = _address AND agent_port = _port
+        )
+        GROUP BY queryid, dbid, userid
+        HAVING max((record).ts) < v_prev;
+
+    IF NOT _delta THEN
+        DELETE FROM statements_last
+        WHERE agent_address = _address AND agent_port = _port;
+    END IF;
+
+    INSERT INTO statements_last
+        SELECT _address, _port, queryid, dbid, userid, toplevel, datname,
+        ROW(
+            ts, calls, total_exec_time, rows, shared_blks_hit, shared_blks_read,
+            shared_blks_dirtied, shared_blks_written, local_blks_hit, local_blks_read,
+            local_blks_dirtied, local_blks_written, temp_blks_read, temp_blks_written,
+            blk_read_time, blk_write_time, total_plan_time, wal_records, wal_fpi, wal_bytes
+        )::statements_history_record
+        FROM statements_src_tmp
+        WHERE agent_address = _address AND agent_port = _port
+    ON CONFLICT (agent_address, agent_port, queryid, dbid, userid, toplevel)
+    DO UPDATE SET datname = EXCLUDED.datname, record = EXCLUDED.record;
+
+    WITH capture AS(
+        SELECT *
+        FROM statements_src_tmp
+        WHERE agent_address = _address AND agent_port = _port
+    ),
+
+    missing_statements AS (
+        INSERT INTO statements (agent_address, agent_port, queryid, query, dbid, datname, userid, rolname)
+            SELECT _address, _port, queryid, query, dbid, datname, userid, rolname
+            FROM capture
+            WHERE query IS NOT NULL
+            ON CONFLICT DO NOTHING
+    ),
+
+    -- Sum toplevel and nested counters of changed statements.
+    by_query AS (
+        INSERT INTO statements_history_current
+            SELECT _address, _port, queryid, dbid, userid,
+            statements_sum(record)
+            FROM statements_last
+            WHERE agent_address = _address AND agent_port = _port
+            AND (queryid, dbid, userid) IN (
+                SELECT queryid, dbid, userid FROM capture
+            )
+            GROUP BY queryid, dbid, userid
+    ),
+
+    -- Sum latest counters of all statements of databases having changes.
+    by_database AS (
+        INSERT INTO statements_history_current_db
+            SELECT _address, _port, dbid, datname,
+            ROW(
+                ts, sum((record).calls), sum((record).total_exec_time), sum((record).rows),
+                sum((record).shared_blks_hit), sum((record).shared_blks_read),
+                sum((record).shared_blks_dirtied), sum((record).shared_blks_written),
+                sum((record).local_blks_hit), sum((record).local_blks_read),
+                sum((record).local_blks_dirtied), sum((record).local_blks_written),
+                sum((record).temp_blks_read), sum((record).temp_blks_written),
+                sum((record).blk_read_time), sum((record).blk_write_time),
+                sum((record).total_plan_time), sum((record).wal_records),
+                sum((record).wal_fpi), sum((record).wal_bytes)
+            )::statements_history_record
+            FROM statements_last
+            JOIN (SELECT DISTINCT dbid, ts FROM capture) AS changed USING (dbid)
+            WHERE agent_address = _address AND agent_port = _port
+            GROUP BY dbid, datname, ts
+    )
+
+    SELECT count(*) INTO v_rowcount
+    FROM capture;
+
+    -- Coalesce datas if needed
+    IF ( (agg_seq % v_coalesce ) = 0 )
+    THEN
+      EXECUTE format('SELECT statements_aggregate(''%s'', %s)', _address, _port);
+    END IF;
+
+    DELETE FROM statements_src_tmp WHERE agent_address = _address AND agent_port = _port;
+END;
+$PROC$ language plpgsql; /* end of process_statements */
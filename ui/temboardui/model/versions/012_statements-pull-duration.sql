@@ -0,0 +1,2 @@
+-- Duration in seconds of latest statements pull from agent.
+ALTER TABLE statements.metas ADD COLUMN pull_duration DOUBLE PRECISION;
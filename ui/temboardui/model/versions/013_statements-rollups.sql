@@ -0,0 +1,300 @@
+-- Time-bucketed rollups of statements counters.
+--
+-- Counters are cumulative, thus the latest record of a bucket summarizes it.
+-- Rollup tables keep the latest record of each 5 minutes and 1 hour bucket,
+-- by instance, database and query. Charts over long ranges read rollups
+-- instead of unnesting every record of statements history. Like history,
+-- rollups sum toplevel and nested counters of a statement.
+--
+-- Per-database records are now computed for every database at each snapshot,
+-- so that instance totals by timestamp stay exact with incremental snapshots.
+SET LOCAL search_path TO statements, public;
+
+CREATE TABLE statements_rollup (
+  agent_address TEXT NOT NULL,
+  agent_port INTEGER NOT NULL,
+  width INTEGER NOT NULL,
+  queryid BIGINT NOT NULL,
+  dbid OID NOT NULL,
+  userid OID NOT NULL,
+  bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+  record statements_history_record NOT NULL,
+  FOREIGN KEY (agent_address, agent_port, queryid, dbid, userid) REFERENCES statements ON DELETE CASCADE ON UPDATE CASCADE,
+  PRIMARY KEY (agent_address, agent_port, width, dbid, queryid, userid, bucket)
+);
+
+CREATE TABLE statements_rollup_db (
+  agent_address TEXT NOT NULL,
+  agent_port INTEGER NOT NULL,
+  width INTEGER NOT NULL,
+  dbid OID NOT NULL,
+  datname TEXT NOT NULL,
+  bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+  record statements_history_record NOT NULL,
+  FOREIGN KEY (agent_address, agent_port) REFERENCES application.instances (agent_address, agent_port) ON DELETE CASCADE ON UPDATE CASCADE,
+  PRIMARY KEY (agent_address, agent_port, width, dbid, bucket)
+);
+
+CREATE TABLE statements_rollup_instance (
+  agent_address TEXT NOT NULL,
+  agent_port INTEGER NOT NULL,
+  width INTEGER NOT NULL,
+  bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+  record statements_history_record NOT NULL,
+  FOREIGN KEY (agent_address, agent_port) REFERENCES application.instances (agent_address, agent_port) ON DELETE CASCADE ON UPDATE CASCADE,
+  PRIMARY KEY (agent_address, agent_port, width, bucket)
+);
+
+CREATE OR REPLACE FUNCTION statements_bucket(_ts timestamptz, _width integer)
+RETURNS timestamptz AS $$
+  SELECT to_timestamp(floor(extract(epoch FROM _ts) / _width) * _width);
+$$ LANGUAGE SQL IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION statements_rollup(_address text, _port integer, _ts timestamptz, _prev timestamptz)
+RETURNS void AS $PROC$
+BEGIN
+    -- Upsert latest record of buckets containing snapshot _ts. Statements
+    -- history stores only changed statements at _ts, and their counters as
+    -- of previous snapshot _prev if unchanged then.
+
+    INSERT INTO statements_rollup
+        SELECT DISTINCT ON (width, queryid, dbid, userid, bucket)
+            _address, _port, width, queryid, dbid, userid, bucket, record
+        FROM (
+            SELECT width, queryid, dbid, userid,
+                statements_bucket((record).ts, width) AS bucket, record
+            FROM statements_history_current
+            CROSS JOIN unnest(ARRAY[300, 3600]) AS width
+            WHERE agent_address = _address AND agent_port = _port
+            AND ((record).ts = _ts OR (
+                (record).ts = _prev
+                AND (queryid, dbid, userid) IN (
+                    SELECT queryid, dbid, userid
+                    FROM statements_history_current
+                    WHERE agent_address = _address AND agent_port = _port
+                    AND (record).ts = _ts
+                )
+            ))
+        ) AS changed
+        ORDER BY width, queryid, dbid, userid, bucket, (record).ts DESC
+    ON CONFLICT (agent_address, agent_port, width, dbid, queryid, userid, bucket)
+    DO UPDATE SET record = EXCLUDED.record
+    WHERE (statements_rollup.record).ts <= (EXCLUDED.record).ts;
+
+    INSERT INTO statements_rollup_db
+        SELECT _address, _port, width, dbid, datname,
+            statements_bucket(_ts, width), record
+        FROM statements_history_current_db
+        CROSS JOIN unnest(ARRAY[300, 3600]) AS width
+        WHERE agent_address = _address AND agent_port = _port
+        AND (record).ts = _ts
+    ON CONFLICT (agent_address, agent_port, width, dbid, bucket)
+    DO UPDATE SET datname = EXCLUDED.datname, record = EXCLUDED.record;
+
+    INSERT INTO statements_rollup_instance
+        SELECT _address, _port, width, statements_bucket(_ts, width),
+            statements_sum(record)
+        FROM statements_history_current_db
+        CROSS JOIN unnest(ARRAY[300, 3600]) AS width
+        WHERE agent_address = _address AND agent_port = _port
+        AND (record).ts = _ts
+        GROUP BY width
+    ON CONFLICT (agent_address, agent_port, width, bucket)
+    DO UPDATE SET record = EXCLUDED.record;
+END;
+$PROC$ LANGUAGE plpgsql; /* end of statements_rollup */
+
+CREATE OR REPLACE FUNCTION process_statements(_address text, _port integer, _delta boolean DEFAULT FALSE, _ts timestamptz DEFAULT NULL) RETURNS void AS $PROC$
+DECLARE
+    v_rowcount    bigint;
+    v_coalesce    integer := 100;
+    v_ts          timestamptz;
+    v_prev        timestamptz;
+    agg_seq  bigint;
+BEGIN
+    -- In this function, we process statements that have just been rerieved
+    -- from agent, and also aggregate counters by database. With _delta,
+    -- statements_src_tmp holds only statements changed since previous
+    -- snapshot. _ts is the timestamp of snapshot, even without changes.
+
+    -- Create new meta for agent if doesn't already exist
+    INSERT INTO metas (agent_address, agent_port) VALUES (_address, _port)
+    ON CONFLICT DO NOTHING;
+
+    PERFORM prevent_concurrent_snapshot(_address, _port);
+
+    v_ts := coalesce(_ts, (
+        SELECT ts
+        FROM statements_src_tmp
+        WHERE agent_address = _address AND agent_port = _port
+        LIMIT 1
+    ));
+
+    SELECT snapshot_ts INTO v_prev
+    FROM metas
+    WHERE agent_address = _address AND agent_port = _port;
+
+    -- Update meta with info from the current proccess (snapshot)
+    UPDATE metas
+    SET coalesce_seq = coalesce_seq + 1,
+        snapts = now(),
+        snapshot_ts = coalesce(v_ts, snapshot_ts),
+        error = NULL
+    WHERE agent_address = _address AND agent_port = _port
+    RETURNING coalesce_seq INTO agg_seq;
+
+    -- Only changed statements are stored in history. Store counters of
+    -- statements unchanged at previous snapshot as of previous snapshot, so
+    -- that diffs of a range starting before their change account for it,
+    -- as with full snapshots.
+    INSERT INTO statements_history_current
+        SELECT _address, _port, queryid, dbid, userid,
+        statements_record_at(statements_sum(record), v_prev)
+        FROM statements_last
+        WHERE agent_address = _address AND agent_port = _port
+        AND (queryid, dbid, userid) IN (
+            SELECT queryid, dbid, userid
+            FROM statements_src_tmp
+            WHERE agent_address = _address AND agent_port = _port
+        )
+        GROUP BY queryid, dbid, userid
+        HAVING max((record).ts) < v_prev;
+
+    IF NOT _delta THEN
+        DELETE FROM statements_last
+        WHERE agent_address = _address AND agent_port = _port;
+    END IF;
+
+    INSERT INTO statements_last
+        SELECT _address, _port, queryid, dbid, userid, toplevel, datname,
+        ROW(
+            ts, calls, total_exec_time, rows, shared_blks_hit, shared_blks_read,
+            shared_blks_dirtied, shared_blks_written, local_blks_hit, local_blks_read,
+            local_blks_dirtied, local_blks_written, temp_blks_read, temp_blks_written,
+            blk_read_time, blk_write_time, total_plan_time, wal_records, wal_fpi, wal_bytes
+        )::statements_history_record
+        FROM statements_src_tmp
+        WHERE agent_address = _address AND agent_port = _port
+    ON CONFLICT (agent_address, agent_port, queryid, dbid, userid, toplevel)
+    DO UPDATE SET datname = EXCLUDED.datname, record = EXCLUDED.record;
+
+    WITH capture AS(
+        SELECT *
+        FROM statements_src_tmp
+        WHERE agent_address = _address AND agent_port = _port
+    ),
+
+    missing_statements AS (
+        INSERT INTO statements (agent_address, agent_port, queryid, query, dbid, datname, userid, rolname)
+            SELECT _address, _port, queryid, query, dbid, datname, userid, rolname
+            FROM capture
+            WHERE query IS NOT NULL
+            ON CONFLICT DO NOTHING
+    ),
+
+    -- Sum toplevel and nested counters of changed statements.
+    by_query AS (
+        INSERT INTO statements_history_current
+            SELECT _address, _port, queryid, dbid, userid,
+            statements_sum(record)
+            FROM statements_last
+            WHERE agent_address = _address AND agent_port = _port
+            AND (queryid, dbid, userid) IN (
+                SELECT queryid, dbid, userid FROM capture
+            )
+            GROUP BY queryid, dbid, userid
+    ),
+
+    -- Sum latest counters of all statements, by database.
+    by_database AS (
+        INSERT INTO statements_history_current_db
+            SELECT _address, _port, dbid, datname,
+            statements_record_at(statements_sum(record), v_ts)
+            FROM statements_last
+            WHERE agent_address = _address AND agent_port = _port
+            AND v_ts IS NOT NULL
+            GROUP BY dbid, datname
+    )
+
+    SELECT count(*) INTO v_rowcount
+    FROM capture;
+
+    IF v_ts IS NOT NULL THEN
+        PERFORM statements_rollup(_address, _port, v_ts, v_prev);
+    END IF;
+
+    -- Coalesce datas if needed
+    IF ( (agg_seq % v_coalesce ) = 0 )
+    THEN
+      EXECUTE format('SELECT statements_aggregate(''%s'', %s)', _address, _port);
+    END IF;
+
+    DELETE FROM statements_src_tmp WHERE agent_address = _address AND agent_port = _port;
+END;
+$PROC$ language plpgsql; /* end of process_statements */
+
+CREATE OR REPLACE FUNCTION statements_purge(_ndays integer)
+RETURNS void AS $PROC$
+DECLARE
+    v_retention   interval := (_ndays || ' days')::interval;
+BEGIN
+    -- Delete obsolete datas.
+    DELETE FROM statements_history
+    WHERE upper(coalesce_range)< (now() - v_retention);
+
+    DELETE FROM statements_history_db
+    WHERE upper(coalesce_range)< (now() - v_retention);
+
+    DELETE FROM statements_rollup
+    WHERE bucket < (now() - v_retention);
+
+    DELETE FROM statements_rollup_db
+    WHERE bucket < (now() - v_retention);
+
+    DELETE FROM statements_rollup_instance
+    WHERE bucket < (now() - v_retention);
+END;
+$PROC$ LANGUAGE plpgsql; /* end of statements_purge */
+
+-- Backfill rollups from existing history.
+WITH records AS (
+    SELECT agent_address, agent_port, queryid, dbid, userid, record
+    FROM statements_history, unnest(records) AS record
+    UNION ALL
+    SELECT agent_address, agent_port, queryid, dbid, userid, record
+    FROM statements_history_current
+),
+-- Sum toplevel and nested records of a statement.
+by_ts AS (
+    SELECT agent_address, agent_port, queryid, dbid, userid,
+        statements_sum(record) AS record
+    FROM records
+    GROUP BY agent_address, agent_port, queryid, dbid, userid, (record).ts
+)
+INSERT INTO statements_rollup
+    SELECT DISTINCT ON (agent_address, agent_port, width, dbid, queryid, userid, bucket)
+        agent_address, agent_port, width, queryid, dbid, userid,
+        statements_bucket((record).ts, width) AS bucket, record
+    FROM by_ts
+    CROSS JOIN unnest(ARRAY[300, 3600]) AS width
+    ORDER BY agent_address, agent_port, width, dbid, queryid, userid, bucket, (record).ts DESC;
+
+WITH records AS (
+    SELECT agent_address, agent_port, dbid, datname, record
+    FROM statements_history_db, unnest(records) AS record
+    UNION ALL
+    SELECT agent_address, agent_port, dbid, datname, record
+    FROM statements_history_current_db
+)
+INSERT INTO statements_rollup_db
+    SELECT DISTINCT ON (agent_address, agent_port, width, dbid, bucket)
+        agent_address, agent_port, width, dbid, datname,
+        statements_bucket((record).ts, width) AS bucket, record
+    FROM records
+    CROSS JOIN unnest(ARRAY[300, 3600]) AS width
+    ORDER BY agent_address, agent_port, width, dbid, bucket, (record).ts DESC;
+
+INSERT INTO statements_rollup_instance
+    SELECT agent_address, agent_port, width, bucket, statements_sum(record)
+    FROM statements_rollup_db
+    GROUP BY agent_address, agent_port, width, bucket;
@@ -0,0 +1,2 @@
+-- Scan statements rollups of a database by time range, for top-N.
+CREATE INDEX ON statements.statements_rollup (agent_address, agent_port, width, dbid, bucket);
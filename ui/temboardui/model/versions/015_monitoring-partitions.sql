@@ -0,0 +1,320 @@
+-- Time-partitioned monitoring tables.
+--
+-- Metric history and aggregate tables, state_changes and check_changes are
+-- partitioned by month. Existing data is kept as-is in a _legacy partition
+-- covering everything up to next month. Rows of months without partition
+-- go to a _default partition. Purge worker drops partitions older than
+-- purge_after instead of deleting rows.
+--
+-- _current metric tables are not partitioned: archiving truncates them.
+--
+-- Declarative partitioning with indexes requires PostgreSQL 11. On older
+-- repositories, tables are kept and purge still deletes rows.
+SET LOCAL search_path TO monitoring, public;
+
+-- List partitions of i_table with their bounds. lower_bound is NULL for
+-- _legacy partition, both bounds are NULL for _default partition.
+CREATE OR REPLACE FUNCTION partitions(i_table TEXT)
+RETURNS TABLE(partname TEXT, lower_bound TIMESTAMPTZ, upper_bound TIMESTAMPTZ, is_default BOOLEAN)
+LANGUAGE plpgsql
+SET search_path TO monitoring, public
+SET TimeZone TO 'UTC'
+AS $$
+BEGIN
+  RETURN QUERY
+  SELECT c.relname::TEXT,
+         substring(pg_get_expr(c.relpartbound, c.oid) FROM 'FROM \(''([^'']+)''\)')::TIMESTAMPTZ,
+         substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \(''([^'']+)''\)')::TIMESTAMPTZ,
+         pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT'
+  FROM pg_catalog.pg_inherits AS i
+  JOIN pg_catalog.pg_class AS c ON c.oid = i.inhrelid
+  WHERE i.inhparent = i_table::regclass
+  ORDER BY 2 NULLS FIRST;
+END;
+$$;
+
+
+-- Create partition of i_table for month of i_month, moving matching rows
+-- from _default partition. Returns partition name or NULL if month is
+-- already covered.
+CREATE OR REPLACE FUNCTION create_partition(i_table TEXT, i_month TIMESTAMPTZ) RETURNS TEXT
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO monitoring, public
+SET TimeZone TO 'UTC'
+AS $$
+DECLARE
+  v_start TIMESTAMPTZ := date_trunc('month', i_month);
+  v_end TIMESTAMPTZ := date_trunc('month', i_month) + INTERVAL '1 month';
+  v_name TEXT := i_table || '_' || to_char(i_month, 'YYYYMM');
+  v_key TEXT;
+BEGIN
+  PERFORM 1 FROM partitions(i_table)
+  WHERE NOT is_default
+    AND coalesce(lower_bound, '-infinity') < v_end AND upper_bound > v_start;
+  IF FOUND THEN
+    RETURN NULL;
+  END IF;
+
+  SELECT substring(pg_get_partkeydef(i_table::regclass) FROM '^RANGE \((.*)\)$') INTO v_key;
+  EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', v_name, i_table);
+  IF to_regclass(i_table || '_default') IS NOT NULL THEN
+    EXECUTE format(
+      'WITH moved AS (DELETE FROM %I WHERE %s >= %L AND %s < %L RETURNING *) INSERT INTO %I SELECT * FROM moved',
+      i_table || '_default', v_key, v_start, v_key, v_end, v_name
+    );
+  END IF;
+  EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', i_table, v_name, v_start, v_end);
+  RETURN v_name;
+END;
+$$;
+
+
+-- Create partitions of every partitioned monitoring table, from current
+-- month up to i_ahead.
+CREATE OR REPLACE FUNCTION create_partitions(i_ahead INTERVAL DEFAULT '1 month') RETURNS TABLE(tblname TEXT)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO monitoring, public
+SET TimeZone TO 'UTC'
+AS $$
+DECLARE
+  v_table TEXT;
+  v_month TIMESTAMPTZ;
+  v_name TEXT;
+BEGIN
+  FOR v_table IN
+    SELECT relname FROM pg_catalog.pg_class
+    WHERE relkind = 'p' AND relnamespace = 'monitoring'::regnamespace
+    ORDER BY 1
+  LOOP
+    v_month := date_trunc('month', NOW());
+    WHILE v_month <= NOW() + i_ahead LOOP
+      v_name := create_partition(v_table, v_month);
+      IF v_name IS NOT NULL THEN
+        RETURN QUERY SELECT v_name;
+      END IF;
+      v_month := v_month + INTERVAL '1 month';
+    END LOOP;
+  END LOOP;
+END;
+$$;
+
+
+-- Drop partitions of i_table entirely before i_before. Rows of _legacy and
+-- _default partitions before i_before are deleted. Returns partitions
+-- dropped, with NULL nb_rows, and partitions purged.
+CREATE OR REPLACE FUNCTION drop_partitions(i_table TEXT, i_before TIMESTAMPTZ) RETURNS TABLE(tblname TEXT, nb_rows BIGINT)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO monitoring, public
+SET TimeZone TO 'UTC'
+AS $$
+DECLARE
+  r RECORD;
+  v_key TEXT;
+  i BIGINT;
+BEGIN
+  SELECT substring(pg_get_partkeydef(i_table::regclass) FROM '^RANGE \((.*)\)$') INTO v_key;
+  FOR r IN SELECT * FROM partitions(i_table) LOOP
+    IF NOT r.is_default AND r.upper_bound <= i_before THEN
+      EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', i_table, r.partname);
+      EXECUTE format('DROP TABLE %I', r.partname);
+      RETURN QUERY SELECT r.partname, NULL::BIGINT;
+    ELSIF r.is_default OR r.lower_bound IS NULL THEN
+      EXECUTE format('DELETE FROM %I WHERE %s < %L', r.partname, v_key, i_before);
+      GET DIAGNOSTICS i = ROW_COUNT;
+      RETURN QUERY SELECT r.partname, i;
+    END IF;
+  END LOOP;
+END;
+$$;
+
+
+-- Convert i_table to a table partitioned by month on i_key. Current table
+-- becomes _legacy partition, up to next month, without copying rows.
+-- Indexes, unique and foreign keys are recreated on partitioned table.
+CREATE OR REPLACE FUNCTION partition_table(i_table TEXT, i_key TEXT) RETURNS VOID
+LANGUAGE plpgsql
+SET search_path TO monitoring, public
+SET TimeZone TO 'UTC'
+AS $$
+DECLARE
+  v_legacy TEXT := i_table || '_legacy';
+  v_bound TIMESTAMPTZ;
+  v_indexes TEXT[];
+  v_constraints TEXT[];
+  v_def TEXT;
+  r RECORD;
+BEGIN
+  EXECUTE format(
+    'SELECT date_trunc(''month'', greatest(NOW(), max(%s))) + INTERVAL ''1 month'' FROM %I',
+    i_key, i_table
+  ) INTO v_bound;
+
+  -- Save definitions before renaming legacy table and indexes.
+  SELECT array_agg(pg_get_indexdef(i.indexrelid)) INTO v_indexes
+  FROM pg_catalog.pg_index AS i
+  WHERE i.indrelid = i_table::regclass
+    AND NOT EXISTS (SELECT 1 FROM pg_catalog.pg_constraint AS c WHERE c.conindid = i.indexrelid);
+  SELECT array_agg(pg_get_constraintdef(c.oid)) INTO v_constraints
+  FROM pg_catalog.pg_constraint AS c
+  WHERE c.conrelid = i_table::regclass AND c.contype IN ('u', 'f');
+
+  FOR r IN SELECT indexrelid::regclass::TEXT AS name, indexrelid AS oid FROM pg_catalog.pg_index WHERE indrelid = i_table::regclass LOOP
+    EXECUTE format('ALTER INDEX %s RENAME TO %I', r.name, 'legacy_' || r.oid);
+  END LOOP;
+  EXECUTE format('ALTER TABLE %I RENAME TO %I', i_table, v_legacy);
+
+  EXECUTE format(
+    'CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (%s)',
+    i_table, v_legacy, i_key
+  );
+  FOREACH v_def IN ARRAY coalesce(v_constraints, '{}') LOOP
+    EXECUTE format('ALTER TABLE %I ADD %s', i_table, v_def);
+  END LOOP;
+  FOREACH v_def IN ARRAY coalesce(v_indexes, '{}') LOOP
+    EXECUTE v_def;
+  END LOOP;
+
+  EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', i_table || '_default', i_table);
+  -- Rows without partition key can only live in default partition.
+  EXECUTE format(
+    'WITH moved AS (DELETE FROM %I WHERE %s IS NULL RETURNING *) INSERT INTO %I SELECT * FROM moved',
+    v_legacy, i_key, i_table
+  );
+  EXECUTE format(
+    'ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (MINVALUE) TO (%L)',
+    i_table, v_legacy, v_bound
+  );
+END;
+$$;
+
+
+-- Partition every metric history and aggregate tables, state_changes and
+-- check_changes not yet partitioned. Returns tables partitioned.
+CREATE OR REPLACE FUNCTION partition_tables() RETURNS TABLE(tblname TEXT)
+LANGUAGE plpgsql
+SET search_path TO monitoring, public
+AS $$
+DECLARE
+  v_table TEXT;
+  v_key TEXT;
+BEGIN
+  IF current_setting('server_version_num')::INTEGER < 110000 THEN
+    RAISE NOTICE 'Monitoring tables partitioning requires PostgreSQL 11.';
+    RETURN;
+  END IF;
+
+  FOR v_table, v_key IN
+    SELECT prefix || suffix, key
+    FROM json_object_keys(metric_tables_config()) AS prefix,
+    (VALUES ('_history', 'lower(history_range)'), ('_30m_current', 'datetime'), ('_6h_current', 'datetime')) AS t(suffix, key)
+    UNION ALL
+    VALUES ('state_changes', 'datetime'), ('check_changes', 'datetime')
+  LOOP
+    PERFORM 1 FROM pg_catalog.pg_class
+    WHERE relname = v_table AND relnamespace = 'monitoring'::regnamespace AND relkind = 'r';
+    IF FOUND THEN
+      PERFORM partition_table(v_table, v_key);
+      RETURN QUERY SELECT v_table;
+    END IF;
+  END LOOP;
+END;
+$$;
+
+
+-- Return type of these functions reference legacy tables once partitioned.
+-- Recreate them with partitioned table row type.
+DROP FUNCTION get_state_changes(INTEGER, INTEGER, VARCHAR(64), VARCHAR(64), TIMESTAMPTZ, TIMESTAMPTZ);
+DROP FUNCTION get_check_changes(INTEGER, INTEGER, VARCHAR(64), TIMESTAMPTZ, TIMESTAMPTZ);
+
+SELECT * FROM partition_tables();
+SELECT * FROM create_partitions();
+
+CREATE OR REPLACE FUNCTION get_state_changes(i_host_id INTEGER, i_instance_id INTEGER, i_check_name VARCHAR(64), i_key VARCHAR(64), i_start_dt TIMESTAMPTZ, i_end_dt TIMESTAMPTZ) RETURNS SETOF state_changes
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_check_id INTEGER;
+  r RECORD;
+BEGIN
+  -- Find check_id using check's name, host_id and instance_id
+  SELECT check_id INTO v_check_id
+  FROM monitoring.checks
+  WHERE host_id = i_host_id AND instance_id = i_instance_id AND name = i_check_name;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Check % not found for this host', i_check_name;
+  END IF;
+  IF i_key IS NULL THEN
+    FOR r IN
+      SELECT * FROM monitoring.state_changes
+      WHERE check_id = v_check_id AND datetime <@ tstzrange(i_start_dt, i_end_dt)
+      ORDER BY datetime DESC
+    LOOP
+      RETURN NEXT r;
+    END LOOP;
+  ELSE
+    FOR r IN
+      SELECT * FROM monitoring.state_changes
+      WHERE check_id = v_check_id AND key = i_key AND datetime <@ tstzrange(i_start_dt, i_end_dt)
+      ORDER BY datetime DESC
+    LOOP
+      RETURN NEXT r;
+    END LOOP;
+  END IF;
+  RETURN;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION get_check_changes(i_host_id INTEGER, i_instance_id INTEGER, i_check_name VARCHAR(64), i_start_dt TIMESTAMPTZ, i_end_dt TIMESTAMPTZ) RETURNS SETOF check_changes
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_check_id INTEGER;
+  r RECORD;
+BEGIN
+  -- Find check_id using check's name, host_id and instance_id
+  SELECT check_id INTO v_check_id
+  FROM monitoring.checks
+  WHERE host_id = i_host_id AND instance_id = i_instance_id AND name = i_check_name;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Check % not found for this host', i_check_name;
+  END IF;
+
+
+  FOR r IN
+    -- get the most recent state before range start
+    (
+      SELECT i_start_dt as datetime, check_id, enabled, warning, critical, description
+      FROM monitoring.check_changes cc
+      WHERE cc.check_id = v_check_id AND cc.datetime <= i_start_dt
+      ORDER BY cc.datetime DESC
+      LIMIT 1
+    )
+    UNION
+    (
+      SELECT datetime, check_id, enabled, warning, critical, description
+      FROM monitoring.check_changes
+      WHERE check_id = v_check_id AND datetime <@ tstzrange(i_start_dt, i_end_dt)
+    )
+    UNION
+    -- get the most recent state before range stop
+    (
+      SELECT i_end_dt as datetime, check_id, enabled, warning, critical, description
+      FROM monitoring.check_changes cc
+      WHERE cc.check_id = v_check_id AND cc.datetime <= i_end_dt
+      ORDER BY cc.datetime DESC
+      LIMIT 1
+    )
+    ORDER BY datetime DESC
+  LOOP
+    RETURN NEXT r;
+  END LOOP;
+  RETURN;
+END;
+$$;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
+GRANT ALL ON ALL TABLES IN SCHEMA monitoring TO temboard;
@@ -0,0 +1,33 @@
+-- Archive metrics without blocking collector.
+--
+-- Instead of locking _current table in SHARE mode and truncating it, move
+-- closed hours of metrics to _history with DELETE ... RETURNING. DELETE only
+-- takes ROW EXCLUSIVE lock, which does not conflict with collector inserts.
+-- Rows inserted meanwhile are not visible to DELETE and are archived on next
+-- run.
+SET LOCAL search_path TO monitoring, public;
+
+CREATE OR REPLACE FUNCTION archive_current_metrics(table_name TEXT, record_type TEXT, query TEXT) RETURNS TABLE(tblname TEXT, nb_rows INTEGER)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_table_current TEXT;
+  v_table_history TEXT;
+  v_query TEXT;
+  i INTEGER;
+BEGIN
+  v_table_current := table_name || '_current';
+  v_table_history := table_name || '_history';
+  v_query := replace(query, '#history_table#', v_table_history);
+  v_query := replace(v_query, '#current_table#', 'moved');
+  v_query := replace(v_query, '#record_type#', record_type);
+  -- Move data of closed hours into _history table
+  EXECUTE format(
+    'WITH moved AS (DELETE FROM %I WHERE datetime < date_trunc(''hour'', NOW()) RETURNING *) %s',
+    v_table_current, rtrim(v_query, ';')
+  );
+  GET DIAGNOSTICS i = ROW_COUNT;
+  -- Return each history table name and the number of rows inserted
+  RETURN QUERY SELECT v_table_history, i;
+END;
+$$;
@@ -0,0 +1,122 @@
+-- Incremental aggregation of metrics.
+--
+-- Aggregate templates used to expand up to 100000 rows from both _current and
+-- _history tables, starting from the last aggregated bucket. With many
+-- agents, aggregation fell behind silently.
+--
+-- aggregate_watermarks tracks, for each metric and period, the end of last
+-- aggregated bucket. Each call of aggregate_data_single() aggregates a batch
+-- of complete buckets after watermark, read from _current table only, and
+-- returns lag behind last complete bucket. Archiving keeps rows not yet
+-- aggregated in _current table.
+SET LOCAL search_path TO monitoring, public;
+
+CREATE TABLE aggregate_watermarks (
+  metric TEXT NOT NULL,
+  period TEXT NOT NULL,
+  watermark TIMESTAMPTZ NOT NULL,
+  PRIMARY KEY (metric, period)
+);
+
+DROP FUNCTION aggregate_data_single(TEXT, TEXT, TEXT);
+
+CREATE OR REPLACE FUNCTION aggregate_data_single(table_name TEXT, record_type TEXT, query TEXT, i_batch INTEGER DEFAULT 12)
+RETURNS TABLE(tblname TEXT, nb_rows INTEGER, watermark TIMESTAMPTZ, lag INTERVAL)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_agg_periods TEXT[] := array['30m', '6h'];
+  v_agg_table TEXT;
+  i_period TEXT;
+  v_query TEXT;
+  v_source TEXT;
+  v_columns TEXT;
+  v_closed TIMESTAMPTZ;
+  v_start TIMESTAMPTZ;
+  v_end TIMESTAMPTZ;
+  i INTEGER;
+BEGIN
+  SELECT string_agg(c->>'name', ', ') INTO v_columns
+  FROM json_array_elements(metric_tables_config()->table_name->'columns') AS c;
+
+  FOREACH i_period IN ARRAY v_agg_periods LOOP
+    v_agg_table := table_name || '_' || i_period || '_current';
+    v_closed := truncate_time(NOW(), i_period::INTERVAL);
+
+    SELECT w.watermark INTO v_start
+    FROM aggregate_watermarks AS w
+    WHERE w.metric = table_name AND w.period = i_period
+    FOR UPDATE;
+    IF NOT FOUND THEN
+      -- Resume from last aggregated bucket, or first bucket in _current.
+      EXECUTE format('SELECT MAX(datetime) FROM %I', v_agg_table) INTO v_start;
+      IF v_start IS NULL THEN
+        EXECUTE format('SELECT truncate_time(MIN(datetime), %L) FROM %I', i_period, table_name || '_current') INTO v_start;
+      END IF;
+      v_start := least(coalesce(v_start, v_closed), v_closed);
+      INSERT INTO aggregate_watermarks VALUES (table_name, i_period, v_start);
+    END IF;
+
+    v_end := least(v_closed, v_start + i_batch * i_period::INTERVAL);
+
+    -- Read buckets of batch from _current table instead of expanding both
+    -- _current and _history.
+    v_source := format(
+      '(SELECT datetime, %s, record AS r FROM %I WHERE datetime >= %L AND datetime < %L) AS expanded',
+      v_columns, table_name || '_current', v_start, v_end
+    );
+    v_query := regexp_replace(
+      query,
+      'expand_data_limit\(''#name#'', \(SELECT tstzrange\(MAX\(datetime\), NOW\(\)\) FROM #agg_table#\), 100000\)\s+AS\s+\([^)]*\)',
+      v_source
+    );
+    v_query := replace(v_query, '#agg_table#', v_agg_table);
+    v_query := replace(v_query, '#interval#', i_period);
+    v_query := replace(v_query, '#record_type#', record_type);
+    v_query := replace(v_query, '#name#', table_name);
+    i := 0;
+    IF v_start < v_end THEN
+      EXECUTE v_query;
+      GET DIAGNOSTICS i = ROW_COUNT;
+    END IF;
+
+    UPDATE aggregate_watermarks AS w SET watermark = v_end
+    WHERE w.metric = table_name AND w.period = i_period;
+    RETURN QUERY SELECT v_agg_table, i, v_end, v_closed - v_end;
+  END LOOP;
+END;
+$$;
+
+
+-- Archive only rows before closed hour and already aggregated.
+CREATE OR REPLACE FUNCTION archive_current_metrics(table_name TEXT, record_type TEXT, query TEXT) RETURNS TABLE(tblname TEXT, nb_rows INTEGER)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_table_current TEXT;
+  v_table_history TEXT;
+  v_query TEXT;
+  v_limit TIMESTAMPTZ;
+  i INTEGER;
+BEGIN
+  v_table_current := table_name || '_current';
+  v_table_history := table_name || '_history';
+  SELECT least(date_trunc('hour', NOW()), MIN(w.watermark)) INTO v_limit
+  FROM aggregate_watermarks AS w
+  WHERE w.metric = table_name;
+  v_query := replace(query, '#history_table#', v_table_history);
+  v_query := replace(v_query, '#current_table#', 'moved');
+  v_query := replace(v_query, '#record_type#', record_type);
+  -- Move data of closed hours into _history table
+  EXECUTE format(
+    'WITH moved AS (DELETE FROM %I WHERE datetime < %L RETURNING *) %s',
+    v_table_current, v_limit, rtrim(v_query, ';')
+  );
+  GET DIAGNOSTICS i = ROW_COUNT;
+  -- Return each history table name and the number of rows inserted
+  RETURN QUERY SELECT v_table_history, i;
+END;
+$$;
+
+GRANT ALL ON aggregate_watermarks TO temboard;
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
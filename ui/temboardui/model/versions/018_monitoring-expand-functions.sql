@@ -0,0 +1,66 @@
+-- Static read path of metrics.
+--
+-- expand_data_by_host_id() and expand_data_by_instance_id() build the JSON
+-- of metric_tables_config() and run a query with inlined literals on each
+-- call: plan is never cached and history index is not used.
+--
+-- Generate once an expand_<metric>(range, id) SQL function per metric,
+-- filtering on host_id or instance_id. Being STABLE SQL functions with a
+-- single SELECT, PostgreSQL inlines them in chart queries, with parameters
+-- and proper index scans.
+SET LOCAL search_path TO monitoring, public;
+
+DO $do$
+DECLARE
+  v_name TEXT;
+  v_id TEXT;
+  v_columns TEXT;
+  v_types TEXT;
+BEGIN
+  FOR v_name IN SELECT json_object_keys(metric_tables_config()) ORDER BY 1 LOOP
+    -- Key columns of metric, in table order: host_id or instance_id first.
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum),
+           string_agg(quote_ident(attname) || ' ' || format_type(atttypid, atttypmod), ', ' ORDER BY attnum)
+    INTO v_columns, v_types
+    FROM pg_catalog.pg_attribute
+    WHERE attrelid = (v_name || '_current')::regclass
+      AND attnum > 0 AND NOT attisdropped
+      AND attname NOT IN ('datetime', 'record');
+    v_id := split_part(v_columns, ', ', 1);
+
+    EXECUTE format('CREATE INDEX %I ON %I (%s, datetime)', 'idx_' || v_name || '_current_' || v_id, v_name || '_current', v_id);
+    EXECUTE format('CREATE INDEX %I ON %I (%s, upper(history_range))', 'idx_' || v_name || '_history_upper', v_name || '_history', v_id);
+
+    EXECUTE format($f$
+CREATE FUNCTION %1$I(i_range TSTZRANGE, i_id INTEGER)
+RETURNS TABLE(datetime TIMESTAMPTZ, %2$s, record %3$s)
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT datetime, %4$s, record
+  FROM monitoring.%5$I
+  WHERE %6$s = i_id
+    AND datetime >= coalesce(lower(i_range), '-infinity')
+    AND datetime <= coalesce(upper(i_range), 'infinity')
+    AND datetime <@ i_range
+  UNION
+  SELECT (record).datetime, %4$s, record
+  FROM (
+    SELECT %4$s, unnest(records) AS record
+    FROM monitoring.%7$I
+    WHERE %6$s = i_id
+      AND upper(history_range) >= coalesce(lower(i_range), '-infinity')
+      AND history_range && i_range
+  ) AS history
+  WHERE (record).datetime <@ i_range
+  ORDER BY 1
+$$;
+$f$,
+      'expand_' || v_name, v_types, metric_tables_config()->v_name->>'record_type',
+      v_columns, v_name || '_current', v_id, v_name || '_history'
+    );
+  END LOOP;
+END;
+$do$;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
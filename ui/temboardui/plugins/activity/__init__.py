@@ -10,6 +10,11 @@ from ...web.tornado import (
 
 blueprint = Blueprint()
 blueprint.generic_proxy(r'/activity/kill', methods=['POST'])
+# Filters forwarded to agent activity listings.
+FILTERS = [
+    'state', 'database', 'user', 'min_duration', 'sort', 'limit', 'offset',
+    'query_length',
+]
 plugin_path = path.dirname(path.realpath(__file__))
 render_template = TemplateRenderer(plugin_path + '/templates')
 
@@ -47,11 +52,25 @@ def activity(request, mode):
     )
 
 
-@blueprint.instance_proxy(r'/activity(?:/blocking|/waiting)?')
-def activity_proxy(request):
+@blueprint.instance_proxy(r'/activity(/blocking|/waiting)?')
+def activity_proxy(request, mode):
+    # Forward filters to displayed listing. Other listings are fetched only
+    # for their total, for badges.
     request.instance.check_active_plugin('activity')
-    return dict(
-        blocking=request.instance.get('/activity/blocking'),
-        running=request.instance.get('/activity'),
-        waiting=request.instance.get('/activity/waiting'),
-    )
+    filters = dict()
+    for name in FILTERS:
+        value = request.handler.get_argument(name, default=None)
+        if value is not None:
+            filters[name] = value
+    count_only = dict(limit=1, query_length=0)
+
+    mode = mode or ''
+    data = dict()
+    listings = [
+        ('blocking', '/blocking'), ('running', ''), ('waiting', '/waiting'),
+    ]
+    for name, suffix in listings:
+        data[name] = request.instance.get(
+            '/activity' + suffix,
+            query=filters if suffix == mode else count_only)
+    return data
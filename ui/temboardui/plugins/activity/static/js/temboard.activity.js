@@ -3,6 +3,8 @@ $(function() {
 
   var request = null;
   var intervalDuration = 2;
+  var queryLength = 4096;
+  var stateFilters = $('#state-filter input[type=checkbox]');
   var loading = false;
   var loadTimeout;
 
@@ -151,8 +153,14 @@ $(function() {
   function load() {
     var lastLoad = new Date();
     var url_end = activityMode != 'running' ?  '/' + activityMode : '';
+    // Let agent filter states and truncate queries.
+    var filters = {query_length: queryLength};
+    var states = getCheckedStateFilters();
+    if (states.length != stateFilters.length) {
+      filters.state = states.join(',');
+    }
     request = $.ajax({
-      url: '/proxy/'+agent_address+'/'+agent_port+'/activity'+url_end,
+      url: '/proxy/'+agent_address+'/'+agent_port+'/activity'+url_end+'?'+$.param(filters),
       type: 'GET',
       beforeSend: function(xhr) {
         $('#loadingIndicator').removeClass('invisible');
@@ -205,12 +213,19 @@ $(function() {
       template: '<div class="popover sql" role="tooltip"><div class="arrow"></div><h3 class="popover-header"></h3><div class="popover-body"></div></div>'
     });
 
-    $('#waiting-count').html(data['waiting'].rows.length || '&nbsp;')
-      .toggleClass('badge-warning', data['waiting'].rows.length > 0)
-      .toggleClass('badge-light', !data['waiting'].rows.length > 0);
-    $('#blocking-count').html(data['blocking'].rows.length || '&nbsp;')
-      .toggleClass('badge-warning', data['blocking'].rows.length > 0)
-      .toggleClass('badge-light', !data['blocking'].rows.length > 0);
+    // Agent returns only one row of other listings, with total.
+    var waiting = total(data['waiting']);
+    var blocking = total(data['blocking']);
+    $('#waiting-count').html(waiting || '&nbsp;')
+      .toggleClass('badge-warning', waiting > 0)
+      .toggleClass('badge-light', !waiting > 0);
+    $('#blocking-count').html(blocking || '&nbsp;')
+      .toggleClass('badge-warning', blocking > 0)
+      .toggleClass('badge-light', !blocking > 0);
+  }
+
+  function total(listing) {
+    return listing.total !== undefined ? listing.total : listing.rows.length;
   }
 
   function html_error_modal(code, error) {
@@ -334,8 +349,6 @@ $(function() {
     });
   });
 
-  var stateFilters = $('#state-filter input[type=checkbox]');
-
   function getCheckedStateFilters() {
     var states = [];
     stateFilters.each(function(index, el) {
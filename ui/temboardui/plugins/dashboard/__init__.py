@@ -1,4 +1,6 @@
 import logging
+import threading
+import time
 from os.path import realpath
 
 import tornado.web
@@ -7,7 +9,9 @@ from tornado.escape import json_encode
 from ...agentclient import TemboardAgentClient
 from ...web.tornado import (
     Blueprint,
+    HTTPError,
     TemplateRenderer,
+    jsonify,
 )
 
 
@@ -31,6 +35,89 @@ class DashboardPlugin(object):
         ])
 
 
+class LiveHub(object):
+    # Shares agent long-polls of /dashboard/next between browser tabs
+    # watching the same instance. One request thread polls the agent while
+    # others wait for its result. Each waiting tab holds a thread of the
+    # request executor, so keep polls short. Browsers sleep until next
+    # snapshot is due before polling again.
+
+    hubs = {}
+    hubs_lock = threading.Lock()
+
+    # Maximum seconds agent waits for next snapshot.
+    poll_timeout = 1
+    # Maximum seconds to wait for polling thread.
+    timeout = 2 * poll_timeout
+
+    @classmethod
+    def get(cls, agent_id):
+        with cls.hubs_lock:
+            return cls.hubs.setdefault(agent_id, cls())
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.last = None
+        self.received = None
+        self.polling = False
+
+    def next(self, after, fetch):
+        # Returns first snapshot newer than after, or latest one on timeout.
+        with self.cond:
+            if self.is_newer(after):
+                return self.snapshot()
+            if self.polling:
+                self.cond.wait(self.timeout)
+                return self.snapshot()
+            self.polling = True
+            if self.last:
+                after = max(after, self.last['timestamp'])
+
+        data = None
+        try:
+            data = fetch(after)
+        finally:
+            with self.cond:
+                self.polling = False
+                if data and 'timestamp' in data and not self.is_newer(
+                        data['timestamp']):
+                    self.last = data
+                    self.received = time.time()
+                self.cond.notify_all()
+        if data and 'timestamp' not in data:
+            # Empty agent history.
+            return data
+        with self.cond:
+            return self.snapshot()
+
+    def is_newer(self, after):
+        return bool(self.last) and self.last['timestamp'] > after
+
+    def snapshot(self):
+        # Latest snapshot, with delay before next one counted from now.
+        if not self.last:
+            return {}
+        data = dict(self.last)
+        if 'next' in data:
+            elapsed = time.time() - self.received
+            data['next'] = max(0, round(data['next'] - elapsed, 3))
+        return data
+
+
+@blueprint.instance_proxy(r"/dashboard/next")
+def dashboard_next(request):
+    request.instance.check_active_plugin('dashboard')
+    try:
+        after = float(request.handler.get_argument('after', default=0))
+    except ValueError:
+        raise HTTPError(406, "Invalid after parameter.")
+
+    hub = LiveHub.get(request.instance.agent_id)
+    return jsonify(hub.next(after, lambda after: request.instance.get(
+        '/dashboard/next',
+        query=dict(after=after, timeout=LiveHub.poll_timeout))))
+
+
 @blueprint.instance_route(r"/dashboard")
 def dashboard(request):
     request.instance.check_active_plugin('dashboard')
@@ -12,30 +12,60 @@ $(function() {
   }
 
   /*
-   * Call the agent's dashboard API and update the view through
-   * updateDashboard() callback.
+   * Long-poll the next dashboard snapshot and update the view through
+   * updateDashboard() callback. Agent tells when next snapshot is due, poll
+   * again at that time. Falls back to polling the agent's dashboard API on a
+   * timer if agent does not support /dashboard/next.
    */
+  var lastTimestamp = 0;
+  var longPoll = true;
+
   function refreshDashboard() {
     var start_time = $('#pg_start_time time').attr("datetime");
     $('#pg_start_time time').text((moment(start_time).fromNow()));
     $('#pg_start_time time').attr("title", (moment(start_time).format("LLLL")));
 
+    var url = '/proxy/'+agent_address+'/'+agent_port+'/dashboard';
+    if (longPoll) {
+      url += '/next?after=' + lastTimestamp;
+    }
+
     $.ajax({
-      url: '/proxy/'+agent_address+'/'+agent_port+'/dashboard',
+      url: url,
       type: 'GET',
       async: true,
       contentType: "application/json",
       success: function (data) {
         $('#divError').html('');
-        updateDashboard(data, true);
-        updateTps([data]);
-        updateLoadaverage([data]);
+        if (data.timestamp > lastTimestamp) {
+          lastTimestamp = data.timestamp;
+          updateDashboard(data, true);
+          updateTps([data]);
+          updateLoadaverage([data]);
+        }
+        if (longPoll) {
+          // Sleep until agent expects next snapshot. Back off on empty
+          // response.
+          var delay = refreshInterval;
+          if (data.next !== undefined) {
+            delay = data.next * 1000;
+          }
+          window.setTimeout(refreshDashboard, delay);
+        }
       },
       error: function(xhr) {
         if (xhr.status == 401 || xhr.status == 302) {
           // force a reload of the page, should lead to the server login page
           location.href = location.href;
         }
+        if (longPoll) {
+          if (xhr.status == 404) {
+            longPoll = false;
+            window.setInterval(refreshDashboard, refreshInterval);
+          } else {
+            window.setTimeout(refreshDashboard, refreshInterval);
+          }
+        }
         var code = xhr.status;
         var error = 'Internal error.';
         if (code > 0) {
@@ -421,7 +451,9 @@ $(function() {
   updateLoadaverage(jdata_history);
 
   var refreshInterval = config.scheduler_interval * 1000;
-  window.setInterval(refreshDashboard, refreshInterval);
+  if (jdata_history.length) {
+    lastTimestamp = jdata_history[jdata_history.length - 1].timestamp;
+  }
   refreshDashboard();
 
   if ($('#divAlerts')) { // monitoring plugin enabled
@@ -12,15 +12,19 @@
 #
 # - schedule_collector(): schedule a collector task for each agent in
 #   inventory.
+# - collector_batch(batch) pulls agents of a batch concurrently and inserts
+#   metrics history of each agent as soon as it is received.
 # - collector(host, port, key) inserts metrics history in metric_*_current
 #   table.
 # - history_tables_worker() move data from metric_*_current to
-#   metric_*_history, grouped by time range. metric table is truncated
-# - aggregate_data_worker() aggregates data in metric_*_30m_current and
-#   metric_*_6h_current.
+#   metric_*_history, grouped by time range. Only closed hours already
+#   aggregated are moved, without blocking collector inserts.
+# - aggregate_data_worker() aggregates new complete buckets of
+#   metric_*_current in metric_*_30m_current and metric_*_6h_current.
 #
 
 from builtins import str
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import logging
 import os
@@ -57,7 +61,12 @@ from .model.orm import (
 )
 from ...toolkit.errors import UserError
 from ...toolkit.configuration import OptionSpec
-from .model.db import insert_availability
+from .model.db import (
+    delete_discover_cache,
+    get_discover_cache,
+    insert_availability,
+    upsert_discover_cache,
+)
 from .alerting import (
     check_specs,
 )
@@ -68,7 +77,9 @@ from .tools import (
     get_instance_checks,
     get_instance_id,
     insert_metrics,
+    iter_history,
     merge_agent_info,
+    spool_history,
     populate_host_checks,
     preprocess_data,
     update_collector_status,
@@ -77,12 +88,16 @@ from .tools import (
 
 logger = logging.getLogger(__name__)
 workers = taskmanager.WorkerSet()
+# Maximum number of aggregation batches per metric in a worker run.
+AGGREGATE_MAX_BATCHES = 48
 
 
 class MonitoringPlugin(object):
     s = 'monitoring'
     options_specs = [
         OptionSpec(s, 'collect_max_duration', default=30, validator=int),
+        OptionSpec(s, 'collect_timeout', default=30, validator=int),
+        OptionSpec(s, 'discover_ttl', default=3600, validator=int),
     ]
 
     def __init__(self, app):
@@ -105,6 +120,10 @@ class MonitoringPlugin(object):
 @workers.register(pool_size=1)
 def aggregate_data_worker(app):
     # Worker in charge of aggregate data
+    #
+    # Each call of aggregate_data_single() aggregates a bounded batch of
+    # complete buckets after the watermark of each period. Loop until
+    # aggregation caught up, each batch in its own transaction.
     stopwatch = Stopwatch()
     engine = worker_engine(app.config.repository)
     with engine.connect() as conn:
@@ -114,21 +133,34 @@ def aggregate_data_worker(app):
         for config in tables_config.values():
             logger.info("Aggregating data for metric %s.", config['name'])
             try:
-                with conn.begin(), stopwatch:
-                    res = conn.execute(
-                        "SELECT * FROM aggregate_data_single(%s, %s, %s)", (
-                            config['name'], config['record_type'],
-                            config['aggregate'],
+                for _ in range(AGGREGATE_MAX_BATCHES):
+                    with conn.begin(), stopwatch:
+                        res = conn.execute(
+                            "SELECT * FROM aggregate_data_single(%s, %s, %s)",
+                            (
+                                config['name'], config['record_type'],
+                                config['aggregate'],
+                            )
                         )
-                    )
-                    # Call here pg_sleep() using conn.execute() to fake slow
-                    # aggregation.
-                    table_name, nb_rows = res.fetchone()
-                logger.debug(
-                    "table=%s insert=%s timedelta=%s",
-                    table_name, nb_rows, stopwatch.last_delta)
+                        # Call here pg_sleep() using conn.execute() to fake
+                        # slow aggregation.
+                        rows = res.fetchall()
+                    for table_name, nb_rows, watermark, lag in rows:
+                        logger.debug(
+                            "table=%s insert=%s watermark=%s lag=%s "
+                            "timedelta=%s",
+                            table_name, nb_rows, watermark, lag,
+                            stopwatch.last_delta)
+                    if not any(row['lag'] for row in rows):
+                        break
+                else:
+                    for row in rows:
+                        if row['lag']:
+                            logger.warning(
+                                "Aggregation of %s lags by %s.",
+                                row['tblname'], row['lag'])
             except Exception as e:
-                logger.error("Failed to archive data: %s.", e)
+                logger.error("Failed to aggregate data: %s.", e)
                 # search_path is lost on exception. Define it again.
                 conn.execute("SET search_path TO monitoring")
 
@@ -140,8 +172,9 @@ def aggregate_data_worker(app):
 def history_tables_worker(app):
     # Archive monitoring metric tables.
     #
-    # Copy contents of every metric_*_current tables into corresponding
-    # metric_*_history, aggregated. Then truncate _current tables.
+    # Move contents of every metric_*_current tables before current hour
+    # into corresponding metric_*_history, aggregated. Rows are deleted
+    # rather than truncated so that collector can insert concurrently.
     #
     # This task is triggered every 3 hours by monitoring_boostrap() below.
     #
@@ -202,18 +235,28 @@ def purge_data_worker(app):
     is based on purge_after parameter from monitoring section. purger_after
     defines the number of day of data to keep, from now. Default value means
     there is no purge policy.
+
+    On partitioned tables, worker creates partitions of next month and drops
+    whole monthly partitions older than purge_after, instead of deleting
+    rows.
     """
 
     logger.setLevel(app.config.logging.level)
     logger.info("Starting monitoring data purge worker.")
 
-    if not app.config.monitoring.purge_after:
-        logger.info("No purge policy, end.")
-        return
-
     engine = worker_engine(app.config.repository)
 
     with engine.connect() as conn:
+        conn.execute("SET search_path TO monitoring")
+        with conn.begin():
+            res = conn.execute("SELECT * FROM create_partitions();")
+            for row in res.fetchall():
+                logger.info("Created partition %s.", row['tblname'])
+
+        if not app.config.monitoring.purge_after:
+            logger.info("No purge policy, end.")
+            return
+
         # Get tablename list to purge from metric_tables_config()
         res = conn.execute(
             dedent("""
@@ -240,27 +283,48 @@ def purge_data_worker(app):
         tablenames = [r['tablename'] for r in res.fetchall()]
         tablenames.extend(['state_changes', 'check_changes'])
 
+        res = conn.execute(dedent("""
+            SELECT relname
+            FROM pg_catalog.pg_class
+            WHERE relkind = 'p'
+              AND relnamespace = 'monitoring'::regnamespace;
+        """))
+        partitioned = set(r['relname'] for r in res.fetchall())
+
         purge_query_base = "DELETE FROM :tablename WHERE "
 
         for tablename in tablenames:
-
+            if tablename in partitioned:
+                # History range overlapping purge limit are kept by DELETE,
+                # keep one more day of partition key.
+                query = (
+                    "SELECT * FROM monitoring.drop_partitions("
+                    ":tablename, NOW() - ':nday days'::INTERVAL")
+                if tablename.endswith("_history"):
+                    query += " - '1 day'::INTERVAL"
+                query += ");"
+                tablename_param = tablename
             # With history tables, we have to deal with tstzrange
-            if tablename.endswith("_history"):
+            elif tablename.endswith("_history"):
                 query = purge_query_base + \
                         "NOT (history_range && tstzrange(NOW() " + \
                         "- ':nday days'::INTERVAL, NOW()))"
+                tablename_param = AsIs("monitoring.%s" % tablename)
             else:
                 query = purge_query_base + \
                         "datetime < (NOW() - ':nday days'::INTERVAL)"
+                tablename_param = AsIs("monitoring.%s" % tablename)
 
             logger.debug("Purging table %s", tablename)
             t = conn.begin()
             try:
                 res_delete = conn.execute(
                     text(query),
-                    tablename=AsIs("monitoring.%s" % tablename),
+                    tablename=tablename_param,
                     nday=app.config.monitoring.purge_after,
                 )
+                if tablename in partitioned:
+                    dropped = res_delete.fetchall()
                 t.commit()
             except (ProgrammingError, IntegrityError) as e:
                 logger.exception(e)
@@ -268,7 +332,14 @@ def purge_data_worker(app):
                 t.rollback()
                 continue
 
-            if res_delete.rowcount > 0:
+            if tablename in partitioned:
+                for row in dropped:
+                    if row['nb_rows'] is None:
+                        logger.info("Partition %s dropped.", row['tblname'])
+                    elif row['nb_rows'] > 0:
+                        logger.info("Table %s purged, %s rows deleted",
+                                    row['tblname'], row['nb_rows'])
+            elif res_delete.rowcount > 0:
                 logger.info("Table %s purged, %s rows deleted",
                             tablename, res_delete.rowcount)
 
@@ -411,57 +482,138 @@ def schedule_collector(app):
 
 @workers.register(pool_size=20)
 def collector_batch(app, batch):
+    # Pull agents of the batch concurrently. Ingest each agent as soon as its
+    # history is received, thus a slow or dead agent does not delay others.
+    #
+    # Each fetch thread opens its own session. Size pool for all fetch
+    # threads plus ingestion in main thread.
+    engine = worker_engine(
+        app.config.repository, pool_size=len(batch) + 1, max_overflow=0)
+    Session = sessionmaker(bind=engine)
+    executor = ThreadPoolExecutor(max_workers=len(batch))
+    futures = dict()
     for address, port, key in batch:
-        try:
-            collector(app, address, port, key)
-        except UserError:
-            raise
-        except Exception as e:
-            logger.error("Failed to collect %s:%s: %s", address, port, e)
+        future = executor.submit(
+            fetch_history, app, Session, address, port, key)
+        futures[future] = "%s:%s" % (address, port)
+
+    try:
+        for future in as_completed(futures):
+            agent_id = futures[future]
+            pull = None
+            session = Session()
+            try:
+                pull = future.result()
+                if pull:
+                    ingest_history(app, session, pull)
+            except UserError:
+                raise
+            except Exception as e:
+                logger.error("Failed to collect %s: %s", agent_id, e)
+                invalidate_discover_cache(session, pull)
+            finally:
+                session.close()
+    finally:
+        executor.shutdown(wait=False)
 
 
 @workers.register(pool_size=20)
 def collector(app, address, port, key=None):
+    engine = worker_engine(app.config.repository)
+    Session = sessionmaker(bind=engine)
+    pull = fetch_history(app, Session, address, port, key)
+    session = Session()
+    try:
+        if pull:
+            ingest_history(app, session, pull)
+    except Exception:
+        invalidate_discover_cache(session, pull)
+        raise
+    finally:
+        session.close()
+
+
+def invalidate_discover_cache(session, pull):
+    if not pull:
+        return
+    try:
+        session.rollback()
+        delete_discover_cache(session, pull.address, pull.port)
+        session.commit()
+    except Exception as e:
+        logger.error(
+            "Failed to invalidate discover cache of %s: %s", pull.agent_id, e)
+
+
+class HistoryPull(object):
+    # Result of fetch_history(), consumed by ingest_history().
+
+    def __init__(self, agent_id, discover_data, response):
+        self.agent_id = agent_id
+        self.discover_data = discover_data
+        self.response = response
+        self.instance_id = None
+        self.address = None
+        self.port = None
+
+
+def fetch_history(app, Session, address, port, key=None):
+    # Call agent discover and monitoring history API. Returns a HistoryPull
+    # or None if agent is unreachable. Safe to run in a thread: opens and
+    # closes its own session from Session factory.
     agent_id = "%s:%s" % (address, port)
     logger.info("Starting collector for %s.", agent_id)
 
-    # First, we need to call discover API because we want to know the hostname
-    logger.info("Discovering hostname from agent %s.", agent_id)
     client = TemboardAgentClient.factory(app.config, address, port, key)
-    try:
-        response = client.get('/discover')
-        response.raise_for_status()
-    except (client.ConnectionError, client.Error) as e:
-        logger.error("Could not discover %s: %s", agent_id, e)
-        logger.error("Agent or host may be down or misconfigured.")
-        return
+    client.timeout = app.config.monitoring.collect_timeout
+    worker_session = Session()
+    pull = HistoryPull(agent_id, None, None)
+    pull.address, pull.port = address, port
+    cached = get_discover_cache(
+        worker_session, address, port, app.config.monitoring.discover_ttl)
 
-    discover_data = response.json()
+    if cached:
+        host_id, pull.instance_id, pull.discover_data = cached
+        logger.debug(
+            "Using cached discover data of agent %s: host #%s, instance #%s.",
+            agent_id, host_id, pull.instance_id)
+    else:
+        # We need to call discover API because we want to know the hostname
+        logger.info("Discovering hostname from agent %s.", agent_id)
+        try:
+            response = client.get('/discover')
+            response.raise_for_status()
+        except (client.ConnectionError, client.Error) as e:
+            logger.error("Could not discover %s: %s", agent_id, e)
+            logger.error("Agent or host may be down or misconfigured.")
+            worker_session.close()
+            return
+        pull.discover_data = response.json()
+
+    discover_data = pull.discover_data
     logger.debug("Discover data: %s", discover_data)
 
-    # Start new ORM DB session
-    engine = worker_engine(app.config.repository)
-    session_factory = sessionmaker(bind=engine)
-    Session = scoped_session(session_factory)
-    worker_session = Session()
-
-    host_id = instance_id = None
-    # Agent monitoring API endpoint
-    history_url = '/monitoring/history?limit=100'
+    # Agent monitoring API endpoint. History is streamed as NDJSON, thus
+    # catching up a large backlog does not load it all in memory.
+    history_url = '/monitoring/history?format=ndjson&limit=1000'
     try:
         # Trying to find host_id, instance_id and the datetime of the latest
         # inserted record.
-
-        # Find host_id and instance_id by hostname and PG port
-        host_id = get_host_id(worker_session, discover_data['hostname'])
-        instance_id = get_instance_id(
-            worker_session,
-            host_id,
-            discover_data['pg_port']
-        )
-        logger.info(
-            "Found host #%s and instance #%s for agent %s, hostname %s.",
-            host_id, instance_id, agent_id, discover_data['hostname'])
+        if not cached:
+            # Find host_id and instance_id by hostname and PG port
+            host_id = get_host_id(worker_session, discover_data['hostname'])
+            pull.instance_id = get_instance_id(
+                worker_session,
+                host_id,
+                discover_data['pg_port']
+            )
+            logger.info(
+                "Found host #%s and instance #%s for agent %s, hostname %s.",
+                host_id, pull.instance_id, agent_id, discover_data['hostname'])
+            upsert_discover_cache(
+                worker_session, address, port, host_id, pull.instance_id,
+                discover_data)
+            worker_session.commit()
     except Exception:
         # This case happens on the very first pull when no data have been
         # previously added.
@@ -469,44 +621,61 @@ def collector(app, address, port, key=None):
             "Could not find host or instance records in monitoring inventory "
             "tables for agent %s.", agent_id,
         )
+        worker_session.rollback()
     else:
         # Get last inserted data timestamp from collector status
         collector_status = worker_session.query(CollectorStatus).filter(
-            CollectorStatus.instance_id == instance_id
+            CollectorStatus.instance_id == pull.instance_id
         ).first()
 
-        if collector_status and collector_status.last_insert:
+        if collector_status and collector_status.last_cursor:
+            # Resume exactly after the last inserted record.
+            history_url += "&cursor=%s" % collector_status.last_cursor
+        elif collector_status and collector_status.last_insert:
             start = (
                 collector_status.last_insert + timedelta(seconds=1)
             ).strftime("%Y-%m-%dT%H:%M:%SZ")
             history_url += "&start=%s" % start
 
+    # Release repository connection while waiting for agent.
+    worker_session.close()
+
     # Finally, let's call /monitoring/history agent API for getting metrics
     # history.
     try:
         logger.info("Querying monitoring history from agent %s.", agent_id)
         response = client.get(history_url)
         response.raise_for_status()
+        # Read whole stream now to release agent as soon as possible.
+        pull.response = spool_history(response)
     except (client.ConnectionError, client.Error) as e:
         logger.error("Failed to query history: %s", e)
+        # Agent may have changed, discover it again on next pull.
+        delete_discover_cache(worker_session, address, port)
+        worker_session.commit()
         # Update collector status only if instance_id is known
-        if instance_id:
+        if pull.instance_id:
             update_collector_status(
                 worker_session,
-                instance_id,
+                pull.instance_id,
                 u'FAIL',
                 last_pull=datetime.utcnow(),
             )
             worker_session.commit()
         worker_session.close()
         return
-    else:
-        response = response.json()
 
-    if not response:
-        logger.info("Agent %s returned no monitoring data.", agent_id)
+    worker_session.close()
+    return pull
+
 
-    for row in response:
+def ingest_history(app, worker_session, pull):
+    # Insert monitoring history fetched by fetch_history().
+    agent_id = pull.agent_id
+    instance_id = pull.instance_id
+    count = 0
+    for cursor, row in iter_history(pull.response):
+        count += 1
         logger.info("Got points for %s at %s.", agent_id, row['datetime'])
         hostinfo = row['hostinfo']
         data = row['data']
@@ -567,6 +736,7 @@ def collector(app, address, port, key=None):
                     u'FAIL',
                     last_pull=datetime.utcnow(),
                     last_insert=last_insert,
+                    last_cursor=cursor,
                 )
                 worker_session.commit()
             logger.info("Continue with the next row.")
@@ -582,7 +752,14 @@ def collector(app, address, port, key=None):
             last_insert=datetime.strptime(
                 row['datetime'], "%Y-%m-%d %H:%M:%S +0000"
             ),
+            last_cursor=cursor,
         )
+        if instance_id != pull.instance_id:
+            # First pull or instance moved, refresh discover cache.
+            upsert_discover_cache(
+                worker_session, pull.address, pull.port,
+                host.host_id, instance_id, pull.discover_data)
+            pull.instance_id = instance_id
         worker_session.commit()
         logger.info("Populate checks for %s.", host)
         # ALERTING PART
@@ -615,6 +792,10 @@ def collector(app, address, port, key=None):
         logger.debug("Row with datetime=%s inserted", row['datetime'])
         worker_session.commit()
 
+    pull.response.close()
+    if not count:
+        logger.info("Agent %s returned no monitoring data.", agent_id)
+
     worker_session.close()
     logger.info("End of collector for agent %s.", agent_id)
 
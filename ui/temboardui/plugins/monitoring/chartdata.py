@@ -4,11 +4,14 @@ try:
 except Exception:
     # python3
     from io import StringIO
+import csv
 import datetime
+from calendar import timegm
 from textwrap import dedent
 
 from psycopg2.extensions import AsIs
 
+from .downsample import downsample_timeserie
 from .pivot import pivot_timeserie
 
 
@@ -19,8 +22,7 @@ SELECT
     datetime AS date,
     ROUND(SUM((record).blks_read)/(extract('epoch' from MIN((record).measure_interval)))) AS blks_read_s,
     ROUND(SUM((record).blks_hit)/(extract('epoch' from MIN((record).measure_interval)))) AS blks_hit_s
-FROM expand_data_by_instance_id('metric_blocks', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_blocks_record)
+FROM expand_metric_blocks(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
         sql_zoom="""
@@ -42,8 +44,7 @@ SELECT
     (record).checkpoints_req AS req,
     ROUND(((record).checkpoint_write_time/1000)::numeric, 1) AS write_time,
     ROUND(((record).checkpoint_sync_time/1000)::numeric,1) AS sync_time
-FROM expand_data_by_instance_id('metric_bgwriter', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, record metric_bgwriter_record)
+FROM expand_metric_bgwriter(tstzrange(%(start)s, %(end)s), %(instance_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -66,8 +67,7 @@ SELECT
     round((SUM((record).time_system)/(SUM((record).time_user)+SUM((record).time_system)+SUM((record).time_idle)+SUM((record).time_iowait)+SUM((record).time_steal))::float*100)::numeric, 1) AS system,
     round((SUM((record).time_iowait)/(SUM((record).time_user)+SUM((record).time_system)+SUM((record).time_idle)+SUM((record).time_iowait)+SUM((record).time_steal))::float*100)::numeric, 1) AS iowait,
     round((SUM((record).time_steal)/(SUM((record).time_user)+SUM((record).time_system)+SUM((record).time_idle)+SUM((record).time_iowait)+SUM((record).time_steal))::float*100)::numeric, 1) AS steal
-FROM expand_data_by_host_id('metric_cpu', tstzrange(%(start)s, %(end)s), %(host_id)s)
-AS (datetime timestamp with time zone, host_id integer, cpu text, record metric_cpu_record)
+FROM expand_metric_cpu(tstzrange(%(start)s, %(end)s), %(host_id)s)
 GROUP BY datetime, host_id ORDER BY datetime
         """,  # noqa
         sql_zoom="""
@@ -91,8 +91,7 @@ SELECT
     round(((record).time_system/((record).time_user+(record).time_system+(record).time_idle+(record).time_iowait+(record).time_steal)::float*100)::numeric, 1) AS system,
     round(((record).time_iowait/((record).time_user+(record).time_system+(record).time_idle+(record).time_iowait+(record).time_steal)::float*100)::numeric, 1) AS iowait,
     round(((record).time_steal/((record).time_user+(record).time_system+(record).time_idle+(record).time_iowait+(record).time_steal)::float*100)::numeric, 1) AS steal
-FROM expand_data_by_host_id('metric_cpu', tstzrange(%(start)s, %(end)s), %(host_id)s)
-AS (datetime timestamp with time zone, host_id integer, cpu text, record metric_cpu_record)
+FROM expand_metric_cpu(tstzrange(%(start)s, %(end)s), %(host_id)s)
 WHERE cpu = %(key)s
 ORDER BY datetime
         """,  # noqa
@@ -115,8 +114,7 @@ SELECT
     datetime AS date,
     round(SUM((record).context_switches)/(extract('epoch' from MIN((record).measure_interval)))) AS context_switches_s,
     round(SUM((record).forks)/(extract('epoch' from MIN((record).measure_interval)))) AS forks_s
-FROM expand_data_by_host_id('metric_process', tstzrange(%(start)s, %(end)s), %(host_id)s)
-AS (datetime timestamp with time zone, host_id integer, record metric_process_record)
+FROM expand_metric_process(tstzrange(%(start)s, %(end)s), %(host_id)s)
 GROUP BY datetime ORDER BY datetime
         """,  # noqa
         sql_zoom="""
@@ -136,8 +134,7 @@ SELECT
     datetime AS date,
     dbname,
     (record).size
-FROM expand_data_by_instance_id('metric_db_size', tstzrange(%(start)s, %(end)s), %(instance_id))
-AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_db_size_record)
+FROM expand_metric_db_size(tstzrange(%(start)s, %(end)s), %(instance_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -161,8 +158,7 @@ SELECT
     datetime AS date,
     mount_point,
     (record).used AS size
-FROM expand_data_by_host_id('metric_filesystems_size', tstzrange(%(start)s, %(end)s), %(host_id)s)
-AS (datetime timestamp with time zone, host_id integer, mount_point text, record metric_filesystems_size_record)
+FROM expand_metric_filesystems_size(tstzrange(%(start)s, %(end)s), %(host_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -186,8 +182,7 @@ SELECT
     datetime AS date,
     mount_point,
     round((((record).used::FLOAT/(record).total::FLOAT)*100)::numeric, 1) AS usage
-FROM expand_data_by_host_id('metric_filesystems_size', tstzrange(%(start)s, %(end)s), %(host_id)s)
-AS (datetime timestamp with time zone, host_id integer, mount_point text, record metric_filesystems_size_record)
+FROM expand_metric_filesystems_size(tstzrange(%(start)s, %(end)s), %(host_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -210,8 +205,7 @@ ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     round((((record).used::FLOAT/(record).total::FLOAT)*100)::numeric, 1) AS usage
-FROM expand_data_by_host_id('metric_filesystems_size', tstzrange(%(start)s, %(end)s), %(host_id)s)
-AS (datetime timestamp with time zone, host_id integer, mount_point text, record metric_filesystems_size_record)
+FROM expand_metric_filesystems_size(tstzrange(%(start)s, %(end)s), %(host_id)s)
 WHERE mount_point = %(key)s
         """,  # noqa
         sql_zoom="""
@@ -231,8 +225,7 @@ SELECT
     CASE WHEN (SUM((record).blks_hit) + SUM((record).blks_read)) > 0
     THEN ROUND((SUM((record).blks_hit)::FLOAT/(SUM((record).blks_hit) + SUM((record).blks_read)::FLOAT) * 100)::numeric, 2)
     ELSE 100 END AS hit_read_ratio
-FROM expand_data_by_instance_id('metric_blocks', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_blocks_record)
+FROM expand_metric_blocks(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
         sql_zoom="""
@@ -254,8 +247,7 @@ SELECT
     CASE WHEN ((record).blks_hit + (record).blks_read) > 0
     THEN ROUND((((record).blks_hit::FLOAT/((record).blks_hit + (record).blks_read)::FLOAT) * 100)::numeric, 2)
     ELSE 100 END AS hit_read_ratio
-FROM expand_data_by_instance_id('metric_blocks', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_blocks_record)
+FROM expand_metric_blocks(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 WHERE dbname = %(key)s
 ORDER BY datetime
         """,  # noqa
@@ -276,8 +268,7 @@ ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     SUM((record).size) AS size
-FROM expand_data_by_instance_id('metric_db_size', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_db_size_record)
+FROM expand_metric_db_size(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
         sql_zoom="""
@@ -297,8 +288,7 @@ SELECT
     (record).load1,
     (record).load5,
     (record).load15
-FROM expand_data_by_host_id( 'metric_loadavg', tstzrange(%(start)s, %(end)s), %(host_id)s)
-AS (datetime timestamp with time zone, host_id integer, record metric_loadavg_record)
+FROM expand_metric_loadavg(tstzrange(%(start)s, %(end)s), %(host_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -316,8 +306,7 @@ ORDER BY datetime ASC
 SELECT
     datetime AS date,
     (record).load1
-FROM expand_data_by_host_id( 'metric_loadavg', tstzrange(%(start)s, %(end)s), %(host_id)s)
-AS (datetime timestamp with time zone, host_id integer, record metric_loadavg_record)
+FROM expand_metric_loadavg(tstzrange(%(start)s, %(end)s), %(host_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -341,8 +330,7 @@ SELECT
     SUM((record).exclusive) AS exclusive,
     SUM((record).access_exclusive) AS access_exclusive,
     SUM((record).siread) AS siread
-FROM expand_data_by_instance_id('metric_locks', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_locks_record)
+FROM expand_metric_locks(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
         sql_zoom="""
@@ -370,8 +358,7 @@ SELECT
     (record).mem_cached AS cached,
     (record).mem_buffers AS buffers,
     ((record).mem_used - (record).mem_cached - (record).mem_buffers) AS other
-FROM expand_data_by_host_id('metric_memory', tstzrange(%(start)s, %(end)s), %(host_id)s)
-AS (datetime timestamp with time zone, host_id integer, record metric_memory_record)
+FROM expand_metric_memory(tstzrange(%(start)s, %(end)s), %(host_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -391,8 +378,7 @@ ORDER BY datetime
 SELECT
     datetime AS date,
     round(((((record).mem_total - (record).mem_free - (record).mem_cached)::FLOAT/(record).mem_total::FLOAT)*100)::numeric, 1) AS usage
-FROM expand_data_by_host_id('metric_memory', tstzrange(%(start)s, %(end)s), %(host_id)s)
-AS (datetime timestamp with time zone, host_id integer, record metric_memory_record)
+FROM expand_metric_memory(tstzrange(%(start)s, %(end)s), %(host_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -409,8 +395,7 @@ ORDER BY datetime
 SELECT
     datetime AS date,
     SUM((record).n_rollback) AS rollback
-FROM expand_data_by_instance_id('metric_xacts', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_xacts_record)
+FROM expand_metric_xacts(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 WHERE dbname = %(key)s
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
@@ -435,8 +420,7 @@ SELECT
     SUM((record).idle_in_xact_aborted) AS idle_in_xact_aborted,
     SUM((record).fastpath) AS fastpath,
     SUM((record).disabled) AS disabled
-FROM expand_data_by_instance_id('metric_sessions', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_sessions_record)
+FROM expand_metric_sessions(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
         sql_zoom="""
@@ -460,8 +444,7 @@ GROUP BY datetime, instance_id ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     round(((SUM((record).active + (record).waiting + (record).idle + (record).idle_in_xact + (record).idle_in_xact_aborted + (record).fastpath + (record).disabled)::FLOAT/(SELECT setting FROM pg_settings WHERE name = 'max_connections')::FLOAT)*100)::numeric, 1) AS session_usage
-FROM expand_data_by_instance_id('metric_sessions', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_sessions_record)
+FROM expand_metric_sessions(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
         sql_zoom="""
@@ -479,8 +462,7 @@ GROUP BY datetime, instance_id ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     (record).swap_used AS used
-FROM expand_data_by_host_id('metric_memory', tstzrange(%(start)s, %(end)s), %(host_id)s)
-AS (datetime timestamp with time zone, host_id integer, record metric_memory_record)
+FROM expand_metric_memory(tstzrange(%(start)s, %(end)s), %(host_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -497,8 +479,7 @@ ORDER BY datetime
 SELECT
     datetime AS date,
     round((((record).swap_used::FLOAT/(record).swap_total::FLOAT)*100)::numeric, 1) AS usage
-FROM expand_data_by_host_id('metric_memory', tstzrange(%(start)s, %(end)s), %(host_id)s)
-AS (datetime timestamp with time zone, host_id integer, record metric_memory_record)
+FROM expand_metric_memory(tstzrange(%(start)s, %(end)s), %(host_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -516,8 +497,7 @@ SELECT
     datetime AS date,
     spcname,
     (record).size
-FROM expand_data_by_instance_id('metric_tblspc_size', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, spcname text, record metric_tblspc_size_record)
+FROM expand_metric_tblspc_size(tstzrange(%(start)s, %(end)s), %(instance_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -541,8 +521,7 @@ SELECT
     datetime AS date,
     round(SUM((record).n_commit)/(extract('epoch' from MIN((record).measure_interval)))) AS commit,
     round(SUM((record).n_rollback)/(extract('epoch' from MIN((record).measure_interval)))) AS rollback
-FROM expand_data_by_instance_id('metric_xacts', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_xacts_record)
+FROM expand_metric_xacts(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
         sql_zoom="""
@@ -568,8 +547,7 @@ SELECT
     SUM((record).waiting_share_row_exclusive) AS share_row_exclusive,
     SUM((record).waiting_exclusive) AS exclusive,
     SUM((record).waiting_access_exclusive) AS access_exclusive
-FROM expand_data_by_instance_id('metric_locks', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_locks_record)
+FROM expand_metric_locks(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
         sql_zoom="""
@@ -594,8 +572,7 @@ GROUP BY datetime, instance_id ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     (record).waiting
-FROM expand_data_by_instance_id('metric_sessions', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_sessions_record)
+FROM expand_metric_sessions(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 WHERE dbname = %(key)s
 ORDER BY datetime
         """,  # noqa
@@ -615,8 +592,7 @@ SELECT
     datetime AS date,
     (record).written_size,
     (record).total_size
-FROM expand_data_by_instance_id('metric_wal_files', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, record metric_wal_files_record)
+FROM expand_metric_wal_files(tstzrange(%(start)s, %(end)s), %(instance_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -634,8 +610,7 @@ ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     (record).archive_ready
-FROM expand_data_by_instance_id('metric_wal_files', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, record metric_wal_files_record)
+FROM expand_metric_wal_files(tstzrange(%(start)s, %(end)s), %(instance_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -653,8 +628,7 @@ SELECT
     datetime AS date,
     (record).archive_ready,
     (record).total
-FROM expand_data_by_instance_id('metric_wal_files', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, record metric_wal_files_record)
+FROM expand_metric_wal_files(tstzrange(%(start)s, %(end)s), %(instance_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -672,8 +646,7 @@ ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     round(SUM((record).written_size)/(extract('epoch' from MIN((record).measure_interval)))) AS written_size_s
-FROM expand_data_by_instance_id('metric_wal_files', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, record metric_wal_files_record)
+FROM expand_metric_wal_files(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
         sql_zoom="""
@@ -691,8 +664,7 @@ GROUP BY datetime, instance_id ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     (record).total
-FROM expand_data_by_instance_id('metric_wal_files', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, record metric_wal_files_record)
+FROM expand_metric_wal_files(tstzrange(%(start)s, %(end)s), %(instance_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -711,8 +683,7 @@ SELECT
     (record).buffers_checkpoint AS checkpoint,
     (record).buffers_clean AS clean,
     (record).buffers_backend AS backend
-FROM expand_data_by_instance_id('metric_bgwriter', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, record metric_bgwriter_record)
+FROM expand_metric_bgwriter(tstzrange(%(start)s, %(end)s), %(instance_id)s)
         """,  # noqa
         sql_zoom="""
 SELECT
@@ -731,8 +702,7 @@ ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     (record).lag AS lag
-FROM expand_data_by_instance_id('metric_replication_lag', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, record metric_replication_lag_record)
+FROM expand_metric_replication_lag(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 ORDER BY 1
         """,  # noqa
         sql_zoom="""
@@ -750,8 +720,7 @@ ORDER BY 1
 SELECT
     datetime AS date,
     (record).connected AS connected
-FROM expand_data_by_instance_id('metric_replication_connection', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, upstream text, record metric_replication_connection_record)
+FROM expand_metric_replication_connection(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 WHERE upstream = %(key)s
 ORDER BY 1
         """,  # noqa
@@ -770,8 +739,7 @@ ORDER BY 1
 SELECT
     datetime AS date,
     (record).size
-FROM expand_data_by_instance_id('metric_temp_files_size_delta', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_temp_files_size_delta_record)
+FROM expand_metric_temp_files_size_delta(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 WHERE dbname = %(key)s
 ORDER BY 1
         """,  # noqa
@@ -790,8 +758,7 @@ ORDER BY 1
 SELECT
     datetime AS date,
     (record).ratio
-FROM expand_data_by_instance_id('metric_heap_bloat', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_bloat_ratio_record)
+FROM expand_metric_heap_bloat(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 WHERE dbname = %(key)s
 ORDER BY 1
         """,  # noqa
@@ -810,8 +777,7 @@ ORDER BY 1
 SELECT
     datetime AS date,
     (record).ratio
-FROM expand_data_by_instance_id('metric_btree_bloat', tstzrange(%(start)s, %(end)s), %(instance_id)s)
-AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_bloat_ratio_record)
+FROM expand_metric_btree_bloat(tstzrange(%(start)s, %(end)s), %(instance_id)s)
 WHERE dbname = %(key)s
 ORDER BY 1
         """,  # noqa
@@ -855,7 +821,7 @@ def get_tablename(probename, zoom):
 
 
 def get_metric_data_csv(session, metric_name, start, end, host_id=None,
-                        instance_id=None, key=None):
+                        instance_id=None, key=None, points=None):
     if metric_name not in METRICS:
         raise IndexError("Metric '%s' not found" % metric_name)
 
@@ -895,16 +861,72 @@ def get_metric_data_csv(session, metric_name, start, end, host_id=None,
             value=metric.get('pivot').get('value'),
             output=data_pivot
         )
-
-        data = data_pivot.getvalue()
         data_buffer.close()
-        data_pivot.close()
-    else:
-        data = data_buffer.getvalue()
+        data_buffer = data_pivot
+
+    if points:
+        # Bound the number of points per serie, whatever the time range.
+        data_sampled = StringIO()
+        downsample_timeserie(data_buffer, points, data_sampled)
         data_buffer.close()
+        data_buffer = data_sampled
+
+    data = data_buffer.getvalue()
+    data_buffer.close()
     return data
 
 
+def get_metric_data_columns(session, metric_name, start, end, host_id=None,
+                            instance_id=None, key=None, points=None):
+    data = get_metric_data_csv(
+        session, metric_name, start, end, host_id=host_id,
+        instance_id=instance_id, key=key, points=points)
+    return csv_to_columns(StringIO(data))
+
+
+def csv_to_columns(fd):
+    # Transpose chart CSV to columnar arrays, ready for JSON.
+    #
+    # First column is the date, converted to epoch in milliseconds. Other
+    # columns are numbers, empty values are None.
+    reader = csv.reader(fd)
+    labels = next(reader, None) or []
+    columns = [[] for _ in labels]
+    if not columns:
+        return dict(labels=labels, columns=columns)
+
+    dates = columns[0]
+    series = list(enumerate(columns[1:], 1))
+    for row in reader:
+        dates.append(parse_timestamp(row[0]))
+        for i, column in series:
+            try:
+                column.append(float(row[i]))
+            except (IndexError, ValueError):
+                column.append(None)
+    return dict(labels=labels, columns=columns)
+
+
+def parse_timestamp(value):
+    # Fast parser of PostgreSQL timestamptz ISO output, like
+    # 2022-01-01 12:30:00.123+02, returning epoch in milliseconds.
+    date, time = value.split(' ')
+    offset = 0
+    pos = max(time.rfind('+'), time.rfind('-'))
+    if pos > 0:
+        sign = -1 if time[pos] == '-' else 1
+        tz = time[pos + 1:].split(':')
+        offset = sign * (int(tz[0]) * 3600 + sum(
+            int(v) * 60 ** (1 - i) for i, v in enumerate(tz[1:])))
+        time = time[:pos]
+    year, month, day = date.split('-')
+    hour, minute, second = time.split(':')
+    epoch = timegm((
+        int(year), int(month), int(day), int(hour), int(minute), 0,
+    )) + float(second) - offset
+    return int(round(epoch * 1000))
+
+
 def get_unavailability_csv(session, start, end, host_id, instance_id):
 
     # Tell when the instance was not available
@@ -0,0 +1,57 @@
+import csv
+
+
+def downsample_timeserie(fd, points, output):
+    # Min/max per bucket downsampling of a CSV time serie.
+    #
+    # First column is the index, e.g. date, other columns are series. Rows are
+    # split in buckets of consecutive rows. For each bucket and each serie, the
+    # rows holding the minimum and the maximum value are kept, preserving peaks
+    # and the shape of curves. First and last rows are always kept. Empty or
+    # non-numeric values, like holes from pivot, are ignored.
+    #
+    # Extrema of a serie may fall on rows kept for other series, thus
+    # buckets are sized by serie count to keep at most `points` rows, unless
+    # series are too many for a single bucket.
+    fd.seek(0)
+    header = fd.readline()
+    lines = fd.readlines()
+    output.write(header)
+    if len(lines) <= points:
+        output.writelines(lines)
+        return
+
+    rows = list(csv.reader(lines))
+    series = max(1, len(next(csv.reader([header]))) - 1)
+    kept = set([0, len(rows) - 1])
+    buckets = max(1, (points - 2) // (2 * series))
+    size = len(rows) - 2
+    for b in range(buckets):
+        start = 1 + b * size // buckets
+        end = 1 + (b + 1) * size // buckets
+        kept.update(bucket_extrema(rows, start, end))
+
+    output.writelines(lines[i] for i in sorted(kept))
+
+
+def bucket_extrema(rows, start, end):
+    # Returns indexes of rows holding min and max of each serie in
+    # rows[start:end].
+    lows = {}
+    highs = {}
+    for i in range(start, end):
+        for j, v in enumerate(rows[i]):
+            if not j:
+                continue
+            try:
+                v = float(v)
+            except ValueError:
+                continue
+            if j not in lows or v < lows[j][0]:
+                lows[j] = v, i
+            if j not in highs or v > highs[j][0]:
+                highs[j] = v, i
+    for _, i in lows.values():
+        yield i
+    for _, i in highs.values():
+        yield i
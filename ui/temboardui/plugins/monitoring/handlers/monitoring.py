@@ -3,11 +3,13 @@ import logging
 from temboardui.web.tornado import (
     HTTPError,
     csvify,
+    jsonify,
 )
 
 from . import blueprint, render_template
 from ..chartdata import (
     get_unavailability_csv,
+    get_metric_data_columns,
     get_metric_data_csv,
 )
 from ..tools import (
@@ -54,22 +56,42 @@ def unavailability(request):
 @blueprint.instance_route(r'/monitoring/data/([a-z\-_.0-9]{1,64})$')
 def data_metric(request, metric_name):
     key = request.handler.get_argument('key', default=None)
+    format_ = request.handler.get_argument('format', default='csv')
+    if format_ not in ('csv', 'columns'):
+        raise HTTPError(406, 'Unknown format.')
+    points = request.handler.get_argument('points', default=None)
+    if points:
+        try:
+            points = int(points)
+            if points < 2:
+                raise ValueError()
+        except ValueError:
+            raise HTTPError(406, 'Points must be an integer above 1.')
     try:
         host_id, instance_id = get_request_ids(request)
     except NameError as e:
         logger.info("%s. No data.", e)
+        if 'columns' == format_:
+            return jsonify(dict(labels=[], columns=[]))
         return csvify(data=[])
 
     start, end = parse_start_end(request)
+    get_data = dict(
+        columns=get_metric_data_columns,
+        csv=get_metric_data_csv,
+    )[format_]
     try:
-        data = get_metric_data_csv(
+        data = get_data(
             request.db_session, metric_name,
             start, end,
             host_id=host_id,
             instance_id=instance_id,
             key=key,
+            points=points,
         )
     except IndexError:
         raise HTTPError(404, 'Unknown metric.')
 
+    if 'columns' == format_:
+        return jsonify(data)
     return csvify(data=data)
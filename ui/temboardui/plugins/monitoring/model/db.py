@@ -1,7 +1,10 @@
 # coding: utf-8
 from builtins import str
+import json
 from textwrap import dedent
 
+from psycopg2.extras import execute_values
+
 
 def insert_availability(session, dt, instance_id, available):
     session.execute(
@@ -16,431 +19,173 @@ def insert_availability(session, dt, instance_id, available):
     )
 
 
-def insert_metric_sessions(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_sessions_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric['datetime'],
-            instance_id=instance_id,
-            dbname=metric['dbname'],
-            row=(
-                None,
-                metric['active'],
-                metric['waiting'],
-                metric['idle'],
-                metric['idle_in_xact'],
-                metric['idle_in_xact_aborted'],
-                metric['fastpath'],
-                metric['disabled'],
-                metric['no_priv']
-            )
-        )
-    )
-
-
-def insert_metric_xacts(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_xacts_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric['datetime'],
-            instance_id=instance_id,
-            dbname=metric['dbname'],
-            row=(
-                None,
-                str(metric['measure_interval']),
-                metric['n_commit'],
-                metric['n_rollback']
-            )
-        )
-    )
-
-
-def insert_metric_locks(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_locks_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric['datetime'],
-            instance_id=instance_id,
-            dbname=metric['dbname'],
-            row=(
-                None,
-                metric['access_share'],
-                metric['row_share'],
-                metric['row_exclusive'],
-                metric['share_update_exclusive'],
-                metric['share'],
-                metric['share_row_exclusive'],
-                metric['exclusive'],
-                metric['access_exclusive'],
-                metric['siread'],
-                metric['waiting_access_share'],
-                metric['waiting_row_share'],
-                metric['waiting_row_exclusive'],
-                metric['waiting_share_update_exclusive'],
-                metric['waiting_share'],
-                metric['waiting_share_row_exclusive'],
-                metric['waiting_exclusive'],
-                metric['waiting_access_exclusive']
-            )
-        )
-    )
-
-
-def insert_metric_blocks(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_blocks_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric['datetime'],
-            instance_id=instance_id,
-            dbname=metric['dbname'],
-            row=(
-                None,
-                str(metric['measure_interval']),
-                metric['blks_read'],
-                metric['blks_hit'],
-                metric['hitmiss_ratio']
-            )
-        )
-    )
-
-
-def insert_metric_bgwriter(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_bgwriter_current
-            VALUES (:dt, :instance_id, :row)
-        """),
-        dict(
-            dt=metric['datetime'],
-            instance_id=instance_id,
-            row=(
-                None,
-                str(metric['measure_interval']),
-                metric['checkpoints_timed'],
-                metric['checkpoints_req'],
-                metric['checkpoint_write_time'],
-                metric['checkpoint_sync_time'],
-                metric['buffers_checkpoint'],
-                metric['buffers_clean'],
-                metric['maxwritten_clean'],
-                metric['buffers_backend'],
-                metric['buffers_backend_fsync'],
-                metric['buffers_alloc'],
-                metric['stats_reset']
-            )
-        )
-    )
-
-
-def insert_metric_db_size(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_db_size_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric['datetime'],
-            instance_id=instance_id,
-            dbname=metric['dbname'],
-            row=(
-                None,
-                metric['size']
-            )
-        )
-    )
-
-
-def insert_metric_tblspc_size(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_tblspc_size_current
-            VALUES (:dt, :instance_id, :spcname, :row)
-        """),
-        dict(
-            dt=metric['datetime'],
-            instance_id=instance_id,
-            spcname=metric['spcname'],
-            row=(
-                None,
-                metric['size']
-            )
-        )
-    )
+class MetricTable(object):
+    # Describe how to insert records of a probe in metric_*_current table.
 
+    def __init__(self, level, key, columns):
+        # level is either host or instance, for host_id or instance_id.
+        self.level = level
+        # key is the column identifying the object within host or instance,
+        # like dbname or mount_point. None for single object metrics.
+        self.key = key
+        # columns of the record type, after the leading NULL datetime.
+        self.columns = columns
 
-def insert_metric_fs_size(session, host_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_filesystems_size_current
-            VALUES (:dt, :host_id, :mount_point, :row)
-        """),
-        dict(
-            dt=metric['datetime'],
-            host_id=host_id,
-            mount_point=metric['mount_point'],
-            row=(
-                None,
-                metric['used'],
-                metric['total'],
-                metric['device']
-            )
+    def values(self, host_id, instance_id, metric):
+        # Returns a tuple matching the columns of metric_*_current table.
+        row = (None,) + tuple(
+            str(metric[c]) if 'measure_interval' == c else metric[c]
+            for c in self.columns
         )
-    )
-
-
-def insert_metric_temp_files_size_delta(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_temp_files_size_delta_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric['datetime'],
-            instance_id=instance_id,
-            dbname=metric['dbname'],
-            row=(
-                None,
-                str(metric['measure_interval']),
-                metric['size']
-            )
-        )
-    )
-
-
-def insert_metric_wal_files(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_wal_files_current
-            VALUES (:dt, :instance_id, :row)
-        """),
-        dict(
-            dt=metric['datetime'],
-            instance_id=instance_id,
-            row=(
-                None,
-                str(metric['measure_interval']),
-                metric['written_size'],
-                metric['current_location'],
-                metric['total'],
-                metric['archive_ready'],
-                metric['total_size']
-            )
-        )
-    )
-
-
-def insert_metric_cpu(session, host_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_cpu_current
-            VALUES (:dt, :host_id, :cpu, :row)
-        """),
-        dict(
-            dt=metric['datetime'],
-            host_id=host_id,
-            cpu=metric['cpu'],
-            row=(
-                None,
-                str(metric['measure_interval']),
-                metric['time_user'],
-                metric['time_system'],
-                metric['time_idle'],
-                metric['time_iowait'],
-                metric['time_steal']
-            )
+        values = (
+            metric['datetime'],
+            host_id if 'host' == self.level else instance_id,
         )
+        if self.key:
+            values += (metric[self.key],)
+        return values + (row,)
+
+
+METRIC_TABLES = dict(
+    sessions=MetricTable('instance', 'dbname', [
+        'active', 'waiting', 'idle', 'idle_in_xact', 'idle_in_xact_aborted',
+        'fastpath', 'disabled', 'no_priv',
+    ]),
+    xacts=MetricTable('instance', 'dbname', [
+        'measure_interval', 'n_commit', 'n_rollback',
+    ]),
+    locks=MetricTable('instance', 'dbname', [
+        'access_share', 'row_share', 'row_exclusive',
+        'share_update_exclusive', 'share', 'share_row_exclusive',
+        'exclusive', 'access_exclusive', 'siread', 'waiting_access_share',
+        'waiting_row_share', 'waiting_row_exclusive',
+        'waiting_share_update_exclusive', 'waiting_share',
+        'waiting_share_row_exclusive', 'waiting_exclusive',
+        'waiting_access_exclusive',
+    ]),
+    blocks=MetricTable('instance', 'dbname', [
+        'measure_interval', 'blks_read', 'blks_hit', 'hitmiss_ratio',
+    ]),
+    bgwriter=MetricTable('instance', None, [
+        'measure_interval', 'checkpoints_timed', 'checkpoints_req',
+        'checkpoint_write_time', 'checkpoint_sync_time', 'buffers_checkpoint',
+        'buffers_clean', 'maxwritten_clean', 'buffers_backend',
+        'buffers_backend_fsync', 'buffers_alloc', 'stats_reset',
+    ]),
+    db_size=MetricTable('instance', 'dbname', ['size']),
+    tblspc_size=MetricTable('instance', 'spcname', ['size']),
+    filesystems_size=MetricTable('host', 'mount_point', [
+        'used', 'total', 'device',
+    ]),
+    temp_files_size_delta=MetricTable('instance', 'dbname', [
+        'measure_interval', 'size',
+    ]),
+    wal_files=MetricTable('instance', None, [
+        'measure_interval', 'written_size', 'current_location', 'total',
+        'archive_ready', 'total_size',
+    ]),
+    cpu=MetricTable('host', 'cpu', [
+        'measure_interval', 'time_user', 'time_system', 'time_idle',
+        'time_iowait', 'time_steal',
+    ]),
+    process=MetricTable('host', None, [
+        'measure_interval', 'context_switches', 'forks', 'procs_running',
+        'procs_blocked', 'procs_total',
+    ]),
+    memory=MetricTable('host', None, [
+        'mem_total', 'mem_used', 'mem_free', 'mem_buffers', 'mem_cached',
+        'swap_total', 'swap_used',
+    ]),
+    loadavg=MetricTable('host', None, ['load1', 'load5', 'load15']),
+    vacuum_analyze=MetricTable('instance', 'dbname', [
+        'measure_interval', 'n_vacuum', 'n_analyze', 'n_autovacuum',
+        'n_autoanalyze',
+    ]),
+    replication_lag=MetricTable('instance', None, ['lag']),
+    replication_connection=MetricTable('instance', 'upstream', ['connected']),
+    heap_bloat=MetricTable('instance', 'dbname', ['ratio']),
+    btree_bloat=MetricTable('instance', 'dbname', ['ratio']),
+)
+
+
+def insert_metric_values(session, metric_name, values, page_size=1000):
+    # Insert many records in metric_*_current table with multi-row INSERT
+    # statements. values are generated by MetricTable.values().
+    cur = session.connection().connection.cursor()
+    execute_values(
+        cur,
+        "INSERT INTO monitoring.metric_%s_current VALUES %%s" % metric_name,
+        values,
+        page_size=page_size,
     )
 
 
-def insert_metric_process(session, host_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_process_current
-            VALUES (:dt, :host_id, :row)
-        """),
-        dict(
-            dt=metric['datetime'],
-            host_id=host_id,
-            row=(
-                None,
-                str(metric['measure_interval']),
-                metric['context_switches'],
-                metric['forks'],
-                metric['procs_running'],
-                metric['procs_blocked'],
-                metric['procs_total']
-            )
-        )
-    )
-
-
-def insert_metric_memory(session, host_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_memory_current
-            VALUES (:dt, :host_id, :row)
-        """),
-        dict(
-            dt=metric['datetime'],
-            host_id=host_id,
-            row=(
-                None,
-                metric['mem_total'],
-                metric['mem_used'],
-                metric['mem_free'],
-                metric['mem_buffers'],
-                metric['mem_cached'],
-                metric['swap_total'],
-                metric['swap_used']
-            )
-        )
-    )
-
-
-def insert_metric_loadavg(session, host_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_loadavg_current
-            VALUES (:dt, :host_id, :row)
-        """),
-        dict(
-            dt=metric['datetime'],
-            host_id=host_id,
-            row=(
-                None,
-                metric['load1'],
-                metric['load5'],
-                metric['load15']
-            )
-        )
-    )
-
-
-def insert_metric_vacuum_analyze(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_vacuum_analyze_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric['datetime'],
-            instance_id=instance_id,
-            dbname=metric['dbname'],
-            row=(
-                None,
-                str(metric['measure_interval']),
-                metric['n_vacuum'],
-                metric['n_analyze'],
-                metric['n_autovacuum'],
-                metric['n_autoanalyze']
-            )
-        )
-    )
+def get_host_id(session, hostname):
+    row = session.execute(
+        "SELECT host_id FROM monitoring.hosts WHERE hostname = :hostname",
+        dict(hostname=hostname)
+    ).fetchone()
+    return row[0] if row else None
 
 
-def insert_metric_replication_lag(session, instance_id, metric):
-    session.execute(
+def get_instance_id(session, host_id, port):
+    row = session.execute(
         dedent("""
-            INSERT INTO monitoring.metric_replication_lag_current
-            VALUES (:dt, :instance_id, :row)
+            SELECT instance_id
+            FROM monitoring.instances
+            WHERE host_id = :host_id AND port = :port
         """),
-        dict(
-            dt=metric['datetime'],
-            instance_id=instance_id,
-            row=(
-                None,
-                metric['lag']
-            )
-        )
-    )
+        dict(host_id=host_id, port=port)
+    ).fetchone()
+    return row[0] if row else None
 
 
-def insert_metric_replication_connection(session, instance_id, metric):
-    session.execute(
+def get_discover_cache(session, address, port, ttl):
+    # Returns (host_id, instance_id, discover) of agent, if cached for less
+    # than ttl seconds.
+    row = session.execute(
         dedent("""
-            INSERT INTO monitoring.metric_replication_connection_current
-            VALUES (:dt, :instance_id, :upstream, :row)
+            SELECT host_id, instance_id, discover
+            FROM monitoring.discover_cache
+            WHERE agent_address = :address AND agent_port = :port
+            AND cdate > NOW() - :ttl * INTERVAL '1 second'
         """),
-        dict(
-            dt=metric['datetime'],
-            instance_id=instance_id,
-            upstream=metric['upstream'],
-            row=(
-                None,
-                metric['connected']
-            )
-        )
-    )
+        dict(address=address, port=port, ttl=ttl)
+    ).fetchone()
+    return tuple(row) if row else None
 
 
-def insert_metric_heap_bloat(session, instance_id, metric):
+def upsert_discover_cache(
+        session, address, port, host_id, instance_id, discover):
     session.execute(
         dedent("""
-            INSERT INTO monitoring.metric_heap_bloat_current
-            VALUES (:dt, :instance_id, :dbname, :row)
+            INSERT INTO monitoring.discover_cache
+            VALUES (:address, :port, :host_id, :instance_id,
+                    CAST(:discover AS JSONB), NOW())
+            ON CONFLICT (agent_address, agent_port) DO UPDATE
+            SET host_id = EXCLUDED.host_id,
+                instance_id = EXCLUDED.instance_id,
+                discover = EXCLUDED.discover,
+                cdate = EXCLUDED.cdate
         """),
         dict(
-            dt=metric['datetime'],
-            instance_id=instance_id,
-            dbname=metric['dbname'],
-            row=(
-                None,
-                metric['ratio']
-            )
+            address=address, port=port,
+            host_id=host_id, instance_id=instance_id,
+            discover=json.dumps(discover),
         )
     )
 
 
-def insert_metric_btree_bloat(session, instance_id, metric):
+def delete_discover_cache(session, address, port):
     session.execute(
         dedent("""
-            INSERT INTO monitoring.metric_btree_bloat_current
-            VALUES (:dt, :instance_id, :dbname, :row)
+            DELETE FROM monitoring.discover_cache
+            WHERE agent_address = :address AND agent_port = :port
         """),
-        dict(
-            dt=metric['datetime'],
-            instance_id=instance_id,
-            dbname=metric['dbname'],
-            row=(
-                None,
-                metric['ratio']
-            )
-        )
+        dict(address=address, port=port)
     )
 
 
-def get_host_id(session, hostname):
-    row = session.execute(
-        "SELECT host_id FROM monitoring.hosts WHERE hostname = :hostname",
-        dict(hostname=hostname)
-    ).fetchone()
-    return row[0] if row else None
-
-
-def get_instance_id(session, host_id, port):
-    row = session.execute(
-        dedent("""
-            SELECT instance_id
-            FROM monitoring.instances
-            WHERE host_id = :host_id AND port = :port
-        """),
-        dict(host_id=host_id, port=port)
-    ).fetchone()
-    return row[0] if row else None
-
-
 def get_agent_key(session, hostname, pg_data, pg_port):
     row = session.execute(
         dedent("""
@@ -472,51 +217,62 @@ def get_agent_keys(session, hostname):
     ).fetchall()
 
 
-def append_state_changes(
-    session, dt, check_id, state, key, value, warning, critical
-):
+def update_check_states(session, instance_id, states):
+    # Write evaluated states of checks of an instance in a single statement.
+    #
+    # states is a list of dict with datetime, check_id, key, state, value,
+    # warning and critical, at most one per check_id and key. Upsert
+    # check_states, drop states of keys not in states, set checks of
+    # instance without states to UNDEF and append changed states to
+    # state_changes.
     session.execute(
         dedent("""
-            SELECT monitoring.append_state_changes(
-                :datetime, :check_id, :state, :key, :value, :warning, :critical
+            WITH data AS (
+                SELECT *
+                FROM json_to_recordset(CAST(:states AS JSON)) AS d(
+                    datetime TIMESTAMPTZ,
+                    check_id INTEGER,
+                    key VARCHAR(64),
+                    state monitoring.check_state_type,
+                    value REAL,
+                    warning REAL,
+                    critical REAL
+                )
+            ), upserted AS (
+                INSERT INTO monitoring.check_states (check_id, key, state)
+                SELECT check_id, key, state FROM data
+                ON CONFLICT (check_id, key)
+                DO UPDATE SET state = EXCLUDED.state
+            ), purged AS (
+                DELETE FROM monitoring.check_states AS cs
+                WHERE cs.check_id IN (SELECT check_id FROM data)
+                    AND NOT EXISTS (
+                        SELECT 1 FROM data
+                        WHERE data.check_id = cs.check_id
+                            AND data.key = cs.key
+                    )
+            ), undefined AS (
+                UPDATE monitoring.check_states AS cs
+                SET state = 'UNDEF'
+                FROM monitoring.checks AS c
+                WHERE c.check_id = cs.check_id
+                    AND c.instance_id = :instance_id
+                    AND cs.check_id NOT IN (SELECT check_id FROM data)
             )
+            INSERT INTO monitoring.state_changes
+                (datetime, check_id, state, key, value, warning, critical)
+            SELECT
+                d.datetime, d.check_id, d.state, d.key,
+                d.value, d.warning, d.critical
+            FROM data AS d
+            LEFT JOIN LATERAL (
+                SELECT sc.state
+                FROM monitoring.state_changes AS sc
+                WHERE sc.check_id = d.check_id AND sc.key = d.key
+                ORDER BY sc.datetime DESC
+                LIMIT 1
+            ) AS last ON TRUE
+            WHERE last.state IS DISTINCT FROM d.state
         """),
-        dict(
-            datetime=dt,
-            check_id=check_id,
-            state=state,
-            key=key,
-            value=value,
-            warning=warning,
-            critical=critical
-        )
-    )
-
-
-def purge_check_states(session, check_id, keys):
-    session.execute(
-        dedent("""
-            DELETE FROM monitoring.check_states
-            WHERE check_id = :check_id AND NOT (key = ANY(:keys))
-        """),
-        dict(
-            check_id=check_id,
-            keys=keys
-        )
-    )
-
-
-def undef_check_states(session, all_ids, to_keep_ids):
-    session.execute(
-        dedent("""
-            UPDATE monitoring.check_states
-            SET state = 'UNDEF'
-            WHERE
-                check_id = ANY(:all_ids)
-                AND NOT (check_id = ANY(:to_keep_ids))
-        """),
-        dict(
-            all_ids=all_ids,
-            to_keep_ids=to_keep_ids,
-        )
+        dict(instance_id=instance_id, states=json.dumps(states)),
     )
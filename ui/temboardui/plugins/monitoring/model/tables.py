@@ -90,5 +90,6 @@ collector_status = Table(
     Column('last_push', DateTime, nullable=True),
     Column('last_insert', DateTime, nullable=True),
     Column('status', UnicodeText),
+    Column('last_cursor', UnicodeText, nullable=True),
     schema="monitoring",
 )
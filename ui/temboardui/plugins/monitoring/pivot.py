@@ -1,40 +1,47 @@
 import csv
-import operator
-
-
-def get_csv_data(fd):
-    # CSV parser as generator
-    for r in csv.DictReader(fd):
-        yield r
 
 
 def pivot_timeserie(fd, index, key, value, output):
     # Simple pivot table implementation.
     # Beware, input data *MUST* be ordered by index value.
+    #
+    # Input is parsed once. Keys are discovered while reading, thus lines are
+    # kept as sparse mappings of key position to value until the header can
+    # be written. Output is then written line by line.
     fd.seek(0)
+    reader = csv.reader(fd)
+    header = next(reader, None)
+    if header is None:
+        output.write(index + '\n')
+        return
+    i_index = header.index(index)
+    i_key = header.index(key)
+    i_value = header.index(value)
+
     keys = {}
-    p = 1
-    # We need to get the keys first
-    for r in get_csv_data(fd):
-        if r[key] not in keys:
-            keys[r[key]] = p
-            p += 1
-    sk = sorted(list(keys.items()), key=operator.itemgetter(1))
-    # CSV Header
-    line = [index] + [x[0] for x in sk]
-    p_index = ''
-    fd.seek(0)
-    for r in get_csv_data(fd):
-        if r[index] != p_index:
+    lines = []
+    p_index = None
+    for r in reader:
+        if r[i_index] != p_index:
             # As data are ordered if we meet a new index value then the current
             # line is complete.
-            output.write(','.join(line)+'\n')
-            # And start a new line
-            line = [''] * (len(keys)+1)
-            line[0] = r[index]
-        # Append value to the current line
-        line[keys[r[key]]] = r[value]
-        # Keep a track of the index value
-        p_index = r[index]
-    # Write the last line
-    output.write(','.join(line)+'\n')
+            p_index = r[i_index]
+            values = {}
+            lines.append((p_index, values))
+        k = r[i_key]
+        p = keys.get(k)
+        if p is None:
+            p = keys[k] = len(keys)
+        values[p] = r[i_value]
+
+    # CSV Header, keys in order of appearance.
+    output.write(','.join([index] + sorted(keys, key=keys.get)) + '\n')
+    output.writelines(format_lines(lines, len(keys)))
+
+
+def format_lines(lines, width):
+    for index, values in lines:
+        line = [''] * width
+        for p, v in values.items():
+            line[p] = v
+        yield index + ',' + ','.join(line) + '\n'
@@ -119,7 +119,9 @@ $(function() {
     url += $.param({
       key: this.key_,
       start: timestampToIsoDate(startDate),
-      end: timestampToIsoDate(endDate)
+      end: timestampToIsoDate(endDate),
+      // No need for more points than pixels in chart.
+      points: document.getElementById("chart" + this.key_).offsetWidth || 1000
     });
 
     var chart = this.chart;
@@ -406,8 +406,10 @@ $(function() {
     }
 
     var params = "?start="+timestampToIsoDate(startDate)+"&end="+timestampToIsoDate(endDate)+"&noerror=1";
+    // No need for more points than pixels in chart.
+    var points = document.getElementById("chart"+id).offsetWidth || 1000;
     var data = null;
-    var dataReq = $.get(apiUrl+"/"+metrics[id].api+params, function(_data) {
+    var dataReq = $.get(apiUrl+"/"+metrics[id].api+params+"&points="+points, function(_data) {
       data = _data;
     });
     // Get the dates when the instance was unavailable
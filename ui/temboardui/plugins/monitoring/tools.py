@@ -1,10 +1,11 @@
 from builtins import str
 from dateutil import parser as parse_datetime
 from datetime import datetime, timedelta
+import json
 import logging
 import os
-
-from sqlalchemy.orm.exc import NoResultFound
+from shutil import copyfileobj
+from tempfile import SpooledTemporaryFile
 
 from temboardui.toolkit import taskmanager
 
@@ -27,6 +28,39 @@ from ...web.tornado import HTTPError
 logger = logging.getLogger(__package__)
 
 
+def spool_history(response, spool_size=4 * 1024 * 1024):
+    """Read agent /monitoring/history response in a temporary file.
+
+    This releases the single-threaded agent HTTP server before rows are
+    inserted. Attribute ndjson of returned file tells whether content is
+    newline-delimited JSON or a JSON array from older agents.
+    """
+    spool = SpooledTemporaryFile(max_size=spool_size)
+    copyfileobj(response, spool)
+    spool.seek(0)
+    content_type = response.getheader('Content-Type', '')
+    spool.ndjson = content_type.startswith('application/x-ndjson')
+    return spool
+
+
+def iter_history(spool):
+    """Generates (cursor, row) from history spooled by spool_history().
+
+    Rows are parsed one at a time. Rows from older agents have no cursor.
+    """
+    if not spool.ndjson:
+        for row in json.loads(spool.read().decode('utf-8')):
+            yield None, row
+        return
+
+    for line in spool:
+        line = line.strip()
+        if not line:
+            continue
+        item = json.loads(line.decode('utf-8'))
+        yield item['cursor'], item['metric']
+
+
 def merge_agent_info(session, host_info, instance_info):
     """Update the host, instance and database information with the
     data received from the agent."""
@@ -145,11 +179,16 @@ class TimeoutError(UserError):
 
 def insert_metrics(
         session, host_id, instance_id, data, labels=None, max_duration=30):
+    """Insert metrics of a collected point, grouped by metric table.
+
+    Each metric table is written with multi-row INSERT. Caller is responsible
+    for committing the transaction.
+    """
     start = datetime.utcnow()
     max_duration = timedelta(seconds=max_duration)
     labels = labels or {}
 
-    for metric_name in list(data.keys()):
+    for metric_name, values in group_metric_values(host_id, instance_id, data):
         call_duration = datetime.utcnow() - start
         if call_duration >= max_duration:
             logger.warning(
@@ -160,12 +199,6 @@ def insert_metrics(
             raise TimeoutError(
                 "Metrics insertion takes more than %s." % max_duration)
 
-        # Do not try to insert empty lines
-        if data[metric_name] is None:
-            continue
-        if len(data[metric_name]) == 0:
-            continue
-
         for record in generate_logfmt_records(metric_name, data[metric_name]):
             try:
                 logger.debug(
@@ -176,57 +209,23 @@ def insert_metrics(
             except Exception:
                 logger.exception("Failed to format logfmt.")
 
-        # Insert data
-        for metric_data in data[metric_name]:
-            logger.debug("Inserting data for metric %s.", metric_name)
-            if metric_name == 'sessions':
-                db.insert_metric_sessions(session, instance_id, metric_data)
-            elif metric_name == 'xacts':
-                db.insert_metric_xacts(session, instance_id, metric_data)
-            elif metric_name == 'locks':
-                db.insert_metric_locks(session, instance_id, metric_data)
-            elif metric_name == 'blocks':
-                db.insert_metric_blocks(session, instance_id, metric_data)
-            elif metric_name == 'bgwriter':
-                db.insert_metric_bgwriter(session, instance_id, metric_data)
-            elif metric_name == 'db_size':
-                db.insert_metric_db_size(session, instance_id, metric_data)
-            elif metric_name == 'tblspc_size':
-                db.insert_metric_tblspc_size(session, instance_id, metric_data)
-            elif metric_name == 'filesystems_size':
-                db.insert_metric_fs_size(session, host_id, metric_data)
-            elif metric_name == 'temp_files_size_delta':
-                db.insert_metric_temp_files_size_delta(
-                    session, instance_id, metric_data
-                )
-            elif metric_name == 'wal_files':
-                db.insert_metric_wal_files(session, instance_id, metric_data)
-            elif metric_name == 'cpu':
-                db.insert_metric_cpu(session, host_id, metric_data)
-            elif metric_name == 'process':
-                db.insert_metric_process(session, host_id, metric_data)
-            elif metric_name == 'memory':
-                db.insert_metric_memory(session, host_id, metric_data)
-            elif metric_name == 'loadavg':
-                db.insert_metric_loadavg(session, host_id, metric_data)
-            elif metric_name == 'vacuum_analyze':
-                db.insert_metric_vacuum_analyze(
-                    session, instance_id, metric_data
-                )
-            elif metric_name == 'replication_lag':
-                db.insert_metric_replication_lag(
-                    session, instance_id, metric_data
-                )
-            elif metric_name == 'replication_connection':
-                db.insert_metric_replication_connection(
-                    session, instance_id, metric_data
-                )
-            elif metric_name == 'heap_bloat':
-                db.insert_metric_heap_bloat(session, instance_id, metric_data)
-            elif metric_name == 'btree_bloat':
-                db.insert_metric_btree_bloat(session, instance_id, metric_data)
+        logger.debug(
+            "Inserting %s records for metric %s.", len(values), metric_name)
+        db.insert_metric_values(session, metric_name, values)
 
-            session.commit()
+
+def group_metric_values(host_id, instance_id, data):
+    # Generates (metric_name, values) for each known metric with records.
+    for metric_name in sorted(data.keys()):
+        table = db.METRIC_TABLES.get(metric_name)
+        # Do not try to insert empty lines
+        if not table or not data[metric_name]:
+            continue
+
+        yield metric_name, [
+            table.values(host_id, instance_id, metric)
+            for metric in data[metric_name]
+        ]
 
 
 def generate_logfmt_records(metric, points):
@@ -275,7 +274,8 @@ def populate_host_checks(session, host_id, instance_id, hostinfo):
 
 
 def update_collector_status(session, instance_id, status, last_pull=None,
-                            last_push=None, last_insert=None):
+                            last_push=None, last_insert=None,
+                            last_cursor=None):
     cs = CollectorStatus()
     cs.instance_id = instance_id
     cs.status = status
@@ -285,6 +285,8 @@ def update_collector_status(session, instance_id, status, last_pull=None,
         cs.last_push = last_push
     if last_insert:
         cs.last_insert = last_insert
+    if last_cursor:
+        cs.last_cursor = last_cursor
 
     session.merge(cs)
 
@@ -335,10 +337,26 @@ def preprocess_data(data, checks, timestamp):
 
 def check_preprocessed_data(session, host_id, instance_id, ppdata, home):
     # Function in charge of checking preprocessed monitoring values
-    keys = dict()
+    #
+    # Load enabled checks and current states of the instance once, evaluate
+    # thresholds in memory and write all states in a single statement.
+    checks = dict(
+        (c.name, c.check_id) for c in session.query(Check).filter(
+            Check.host_id == host_id,
+            Check.instance_id == instance_id,
+            Check.enabled == bool(True),
+        )
+    )
+    current = dict()
+    if checks:
+        current = dict(
+            ((cs.check_id, cs.key), cs.state)
+            for cs in session.query(CheckState).filter(
+                CheckState.check_id.in_(list(checks.values())))
+        )
 
+    states = dict()
     for raw in ppdata:
-        dt = raw.get('datetime')
         name = raw.get('name')
         key = raw.get('key')
         value = raw.get('value')
@@ -358,78 +376,41 @@ def check_preprocessed_data(session, host_id, instance_id, ppdata, home):
         if spec.get('operator')(value, critical):
             state = 'CRITICAL'
 
-        # Try to find enabled check for this host_id with the same name
-        try:
-            c = session.query(Check).filter(
-                Check.name == str(name),
-                Check.host_id == host_id,
-                Check.instance_id == instance_id,
-                Check.enabled == bool(True),
-            ).one()
-        except NoResultFound:
+        # Find enabled check for this host_id with the same name
+        check_id = checks.get(str(name))
+        if check_id is None:
             continue
 
-        # Update/insert check current state
-        try:
-            cs = session.query(CheckState).filter(
-                CheckState.check_id == c.check_id,
-                CheckState.key == str(key)
-            ).one()
-            # State has changed since last time
-            if cs.state != state:
-                taskmanager.schedule_task(
-                    'notify_state_change',
-                    listener_addr=os.path.join(home, '.tm.socket'),
-                    options={
-                        'check_id': c.check_id,
-                        'key': key,
-                        'value': value,
-                        'state': state,
-                        'prev_state': cs.state
-                    },
-                    expire=0,
-                )
-            cs.state = str(state)
-            session.merge(cs)
-
-        except NoResultFound:
-            cs = CheckState(
-                check_id=c.check_id, key=str(key), state=str(state)
-            )
-            session.add(cs)
-
-        session.flush()
-        # Append state change if any to history
-        db.append_state_changes(
-            session,
-            dt,
-            c.check_id,
-            cs.state,
-            cs.key,
-            value,
-            warning,
-            critical,
+        key = str(key)
+        states[(check_id, key)] = dict(
+            datetime=raw.get('datetime'),
+            check_id=check_id,
+            key=key,
+            state=state,
+            value=value,
+            warning=warning,
+            critical=critical,
         )
 
-        if c.check_id not in keys:
-            keys[c.check_id] = list()
-        keys[c.check_id].append(cs.key)
-
-        session.commit()
-        session.expunge_all()
-
-    # Purge CheckState
-    for check_id, ks in list(keys.items()):
-        db.purge_check_states(session, check_id, ks)
-        session.commit()
-
-    # Get the list of check_id for the given instance
-    req = session.query(Check).filter(Check.instance_id == instance_id)
-    all_check_ids = [check.check_id for check in req]
+    # Only last state per check and key is stored. Notify net transitions
+    # from stored state, as recorded in state_changes.
+    for (check_id, key), row in states.items():
+        prev_state = current.get((check_id, key))
+        if prev_state is not None and prev_state != row['state']:
+            taskmanager.schedule_task(
+                'notify_state_change',
+                listener_addr=os.path.join(home, '.tm.socket'),
+                options={
+                    'check_id': check_id,
+                    'key': key,
+                    'value': row['value'],
+                    'state': row['state'],
+                    'prev_state': prev_state
+                },
+                expire=0,
+            )
 
-    # Set to UNDEF each unchecked check for the given instance
-    # This may happen when postgres is not available
-    db.undef_check_states(session, all_check_ids, list(keys.keys()))
+    db.update_check_states(session, instance_id, list(states.values()))
     session.commit()
 
 
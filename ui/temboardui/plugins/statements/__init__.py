@@ -1,12 +1,19 @@
 from __future__ import division
 from builtins import str
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from decimal import Decimal
 from past.utils import old_div
 import json
 import logging
 from os import path
+from time import time
+try:
+    from StringIO import StringIO
+except Exception:
+    from io import StringIO
 
 import tornado.web
+from tornado.escape import url_escape
 
 from sqlalchemy.orm import (
     sessionmaker,
@@ -14,6 +21,7 @@ from sqlalchemy.orm import (
 )
 from sqlalchemy.sql import (
     column,
+    desc,
     extract,
     func,
     select,
@@ -35,6 +43,7 @@ from temboardui.errors import TemboardUIError
 
 from temboardui.web.tornado import (
     Blueprint,
+    HTTPError,
     TemplateRenderer,
     jsonify,
 )
@@ -42,6 +51,7 @@ from temboardui.plugins.monitoring.tools import (
     parse_start_end,
 )
 from temboardui.toolkit import taskmanager
+from temboardui.toolkit.configuration import OptionSpec
 from temboardui.agentclient import TemboardAgentClient
 
 
@@ -54,8 +64,16 @@ render_template = TemplateRenderer(plugin_path + '/templates')
 
 
 class StatementsPlugin(object):
+    s = 'statements'
+    options_specs = [
+        OptionSpec(s, 'max_workers', default=8, validator=int),
+        OptionSpec(s, 'pull_timeout', default=30, validator=int),
+    ]
+    del s
+
     def __init__(self, app):
         self.app = app
+        self.app.config.add_specs(self.options_specs)
 
     def load(self):
         self.app.webapp.add_rules(blueprint.rules)
@@ -68,7 +86,7 @@ class StatementsPlugin(object):
 
 
 METAS_QUERY = text("""
-    SELECT *
+    SELECT *, EXTRACT(EPOCH FROM NOW() - snapts)::FLOAT AS lag
     FROM statements.metas
     WHERE agent_address = :agent_address
     AND agent_port = :agent_port
@@ -100,9 +118,76 @@ BASE_QUERY_STATDATA = text("""
 """)
 
 
+TOPN_QUERY_STATDATA_INSTANCE = """
+WITH in_range AS (
+  SELECT dbid, datname, bucket, record
+  FROM statements.statements_rollup_db
+  WHERE agent_address = :agent_address
+  AND agent_port = :agent_port
+  AND width = :width
+  AND bucket BETWEEN :start - :width * INTERVAL '1 second' AND :end
+  AND tstzrange((record).ts, (record).ts, '[]')
+      <@ tstzrange(:start, :end, '[]')
+),
+first_occurence AS (
+  SELECT DISTINCT ON (dbid) dbid, (record).*
+  FROM in_range
+  ORDER BY dbid, bucket
+),
+last_occurence AS (
+  SELECT DISTINCT ON (dbid) dbid, datname, (record).*
+  FROM in_range
+  ORDER BY dbid, bucket DESC
+)
+SELECT
+  lo.datname,
+  lo.dbid,
+  (lo.calls - fo.calls) AS calls,
+  (lo.total_exec_time - fo.total_exec_time) AS total_exec_time,
+  (lo.total_exec_time - fo.total_exec_time) /
+    (lo.calls - fo.calls) AS mean_time,
+  (lo.shared_blks_read - fo.shared_blks_read) AS shared_blks_read,
+  (lo.shared_blks_hit - fo.shared_blks_hit) AS shared_blks_hit,
+  (lo.shared_blks_dirtied - fo.shared_blks_dirtied) AS shared_blks_dirtied,
+  (lo.shared_blks_written - fo.shared_blks_written) AS shared_blks_written,
+  (lo.local_blks_read - fo.local_blks_read) AS local_blks_read,
+  (lo.local_blks_hit - fo.local_blks_hit) AS local_blks_hit,
+  (lo.local_blks_dirtied - fo.local_blks_dirtied) AS local_blks_dirtied,
+  (lo.local_blks_written - fo.local_blks_written) AS local_blks_written,
+  (lo.temp_blks_read - fo.temp_blks_read) AS temp_blks_read,
+  (lo.temp_blks_written - fo.temp_blks_written) AS temp_blks_written,
+  (lo.blk_read_time - fo.blk_read_time) AS blk_read_time,
+  (lo.blk_write_time - fo.blk_write_time) AS blk_write_time
+FROM first_occurence AS fo
+JOIN last_occurence AS lo USING (dbid)
+WHERE (lo.calls - fo.calls) > 0
+"""
+
+
 @blueprint.instance_route(r'/statements/data')
 def json_data_instance(request):
     start, end = parse_start_end(request)
+    topn = parse_topn(request)
+
+    metas = request.db_session.execute(
+        METAS_QUERY,
+        dict(agent_address=request.instance.agent_address,
+             agent_port=request.instance.agent_port)).fetchone()
+    metas = dict(metas) if metas is not None else None
+
+    params = dict(agent_address=request.instance.agent_address,
+                  agent_port=request.instance.agent_port,
+                  start=start,
+                  end=end)
+
+    # Top-N over long ranges reads 5 minutes or 1 hour rollups, as for
+    # databases.
+    width = get_rollup_width(start, end, samples=12) if topn else None
+    if width:
+        params['width'] = width
+        statements, total = execute_topn(
+            request.db_session, TOPN_QUERY_STATDATA_INSTANCE, params, topn)
+        return jsonify(dict(data=statements, metas=metas, total=total))
 
     base_query = BASE_QUERY_STATDATA
     diffs = get_diffs_forstatdata()
@@ -113,22 +198,64 @@ def json_data_instance(request):
             .select_from(base_query)
             .group_by(column("dbid"), column("datname"))
             .having(func.max(column("calls")) - func.min(column("calls")) > 0))
+    if topn:
+        sort, limit, offset = topn
+        total = request.db_session.execute(
+            select([func.count()]).select_from(query.alias()), params,
+        ).scalar()
+        query = query.order_by(desc(column(sort))).limit(limit).offset(offset)
 
-    statements = request.db_session.execute(
-        query,
-        dict(agent_address=request.instance.agent_address,
-             agent_port=request.instance.agent_port,
-             start=start,
-             end=end)) \
-        .fetchall()
+    statements = request.db_session.execute(query, params).fetchall()
     statements = [dict(statement) for statement in statements]
+    response = dict(data=statements, metas=metas)
+    if topn:
+        response['total'] = total
+    return jsonify(response)
+
+
+# Statements counters available for top-N sort.
+TOPN_SORT_KEYS = (
+    'calls', 'total_exec_time', 'mean_time',
+    'shared_blks_read', 'shared_blks_hit',
+    'shared_blks_dirtied', 'shared_blks_written',
+    'local_blks_read', 'local_blks_hit',
+    'local_blks_dirtied', 'local_blks_written',
+    'temp_blks_read', 'temp_blks_written',
+    'blk_read_time', 'blk_write_time',
+)
 
-    metas = request.db_session.execute(
-        METAS_QUERY,
-        dict(agent_address=request.instance.agent_address,
-             agent_port=request.instance.agent_port)).fetchone()
-    metas = dict(metas) if metas is not None else None
-    return jsonify(dict(data=statements, metas=metas))
+
+def parse_topn(request):
+    # Returns (sort, limit, offset) if top-N mode is requested with limit
+    # parameter.
+    limit = request.handler.get_argument('limit', default=None)
+    if limit is None:
+        return None
+    sort = request.handler.get_argument('sort', default='total_exec_time')
+    if sort not in TOPN_SORT_KEYS:
+        raise HTTPError(406, 'Unknown sort key.')
+    try:
+        limit = int(limit)
+        offset = int(request.handler.get_argument('offset', default=0))
+        if limit < 1 or offset < 0:
+            raise ValueError()
+    except ValueError:
+        raise HTTPError(406, 'Limit and offset must be positive integers.')
+    return sort, limit, offset
+
+
+def execute_topn(session, query, params, topn):
+    # Execute text query, sorted and paginated, returning rows and the total
+    # number of rows, counted apart so that it does not depend on the page.
+    sort, limit, offset = topn
+    total = session.execute(
+        "SELECT count(*) FROM (%s) AS q" % query, params).scalar()
+    params = dict(params, limit=limit, offset=offset)
+    rows = session.execute(
+        "SELECT * FROM (%s) AS q "
+        "ORDER BY %s DESC NULLS LAST LIMIT :limit OFFSET :offset"
+        % (query, sort), params).fetchall()
+    return [dict(row) for row in rows], total
 
 
 BASE_QUERY_STATDATA_DATABASE = """
@@ -392,7 +519,7 @@ FROM
   AND agent_address = :agent_address
   AND agent_port = :agent_port
   AND dbid = :dbid
-WHERE (lo.calls - fo.calls) > 0;
+WHERE (lo.calls - fo.calls) > 0
 """
 
 
@@ -406,8 +533,85 @@ def json_data_database(request, dbid):
     return json_data(request, dbid)
 
 
+TOPN_QUERY_STATDATA_DATABASE = """
+WITH in_range AS (
+  SELECT queryid, userid, bucket, record
+  FROM statements.statements_rollup
+  WHERE agent_address = :agent_address
+  AND agent_port = :agent_port
+  AND width = :width
+  AND dbid = :dbid
+  AND bucket BETWEEN :start - :width * INTERVAL '1 second' AND :end
+  AND tstzrange((record).ts, (record).ts, '[]')
+      <@ tstzrange(:start, :end, '[]')
+),
+first_occurence AS (
+  SELECT DISTINCT ON (queryid, userid) queryid, userid, (record).*
+  FROM in_range
+  ORDER BY queryid, userid, bucket
+),
+last_occurence AS (
+  SELECT DISTINCT ON (queryid, userid) queryid, userid, (record).*
+  FROM in_range
+  ORDER BY queryid, userid, bucket DESC
+),
+diffs AS (
+  SELECT
+    lo.queryid,
+    lo.userid,
+    (lo.calls - fo.calls) AS calls,
+    (lo.total_exec_time - fo.total_exec_time) AS total_exec_time,
+    (lo.total_exec_time - fo.total_exec_time) /
+      (lo.calls - fo.calls) AS mean_time,
+    (lo.shared_blks_read - fo.shared_blks_read) AS shared_blks_read,
+    (lo.shared_blks_hit - fo.shared_blks_hit) AS shared_blks_hit,
+    (lo.shared_blks_dirtied - fo.shared_blks_dirtied) AS shared_blks_dirtied,
+    (lo.shared_blks_written - fo.shared_blks_written) AS shared_blks_written,
+    (lo.local_blks_read - fo.local_blks_read) AS local_blks_read,
+    (lo.local_blks_hit - fo.local_blks_hit) AS local_blks_hit,
+    (lo.local_blks_dirtied - fo.local_blks_dirtied) AS local_blks_dirtied,
+    (lo.local_blks_written - fo.local_blks_written) AS local_blks_written,
+    (lo.temp_blks_read - fo.temp_blks_read) AS temp_blks_read,
+    (lo.temp_blks_written - fo.temp_blks_written) AS temp_blks_written,
+    (lo.blk_read_time - fo.blk_read_time) AS blk_read_time,
+    (lo.blk_write_time - fo.blk_write_time) AS blk_write_time
+  FROM first_occurence AS fo
+  JOIN last_occurence AS lo USING (queryid, userid)
+  WHERE (lo.calls - fo.calls) > 0
+)
+SELECT
+  query,
+  diffs.queryid::text,
+  rolname,
+  diffs.userid::text,
+  diffs.calls,
+  diffs.total_exec_time,
+  diffs.mean_time,
+  diffs.shared_blks_read,
+  diffs.shared_blks_hit,
+  diffs.shared_blks_dirtied,
+  diffs.shared_blks_written,
+  diffs.local_blks_read,
+  diffs.local_blks_hit,
+  diffs.local_blks_dirtied,
+  diffs.local_blks_written,
+  diffs.temp_blks_read,
+  diffs.temp_blks_written,
+  diffs.blk_read_time,
+  diffs.blk_write_time
+FROM diffs
+JOIN statements.statements
+  ON statements.queryid = diffs.queryid
+  AND statements.userid = diffs.userid
+  AND agent_address = :agent_address
+  AND agent_port = :agent_port
+  AND dbid = :dbid
+"""
+
+
 def json_data(request, dbid, queryid=None, userid=None):
     start, end = parse_start_end(request)
+    topn = parse_topn(request) if queryid is None else None
 
     query = text("""
         SELECT DISTINCT(datname)
@@ -429,6 +633,15 @@ def json_data(request, dbid, queryid=None, userid=None):
                   start=start,
                   end=end)
 
+    # Top-N over long ranges reads 5 minutes or 1 hour rollups. Counters
+    # at range bounds are then rounded to bucket.
+    width = get_rollup_width(start, end, samples=12) if topn else None
+    if width:
+        params['width'] = width
+        statements, total = execute_topn(
+            request.db_session, TOPN_QUERY_STATDATA_DATABASE, params, topn)
+        return jsonify(dict(datname=datname, data=statements, total=total))
+
     query = BASE_QUERY_STATDATA_DATABASE
     queryidfilter = ''
     if queryid is not None and userid is not None:
@@ -436,6 +649,11 @@ def json_data(request, dbid, queryid=None, userid=None):
         params.update(dict(queryid=queryid, userid=userid))
     query = query.format(**dict(queryidfilter=queryidfilter))
 
+    if topn:
+        statements, total = execute_topn(
+            request.db_session, query, params, topn)
+        return jsonify(dict(datname=datname, data=statements, total=total))
+
     statements = request.db_session.execute(query, params).fetchall()
     statements = [dict(statement) for statement in statements]
     return jsonify(dict(datname=datname, data=statements))
@@ -593,16 +811,110 @@ BASE_QUERY_STATDATA_SAMPLE_QUERY = text("""
 """)
 
 
-def getstatdata_sample(request, mode, start, end, dbid=None, queryid=None,
-                       userid=None):
-    if mode == 'instance':
-        base_query = BASE_QUERY_STATDATA_SAMPLE_INSTANCE
+# Sampling of rollups of statements counters, by bucket width in seconds.
+BASE_QUERY_STATDATA_ROLLUP_INSTANCE = text("""
+    (
+      SELECT *
+      FROM (
+        SELECT
+          row_number() OVER (ORDER BY ts) AS number,
+          count(*) OVER (PARTITION BY 1) AS total,
+          *
+        FROM (
+          SELECT (record).*
+          FROM statements.statements_rollup_instance
+          WHERE agent_address = :agent_address
+          AND agent_port = :agent_port
+          AND width = :width
+          AND bucket BETWEEN :start - :width * INTERVAL '1 second' AND :end
+          AND tstzrange((record).ts, (record).ts, '[]')
+              <@ tstzrange(:start, :end, '[]')
+        ) AS statements_history
+      ) AS sh
+      WHERE number % ( int8larger((total)/(:samples +1),1) ) = 0
+    ) by_instance
+""")
 
-    elif mode == "db":
-        base_query = BASE_QUERY_STATDATA_SAMPLE_DATABASE
 
-    elif mode == "query":
-        base_query = BASE_QUERY_STATDATA_SAMPLE_QUERY
+BASE_QUERY_STATDATA_ROLLUP_DATABASE = text("""
+    (
+      SELECT *
+      FROM (
+        SELECT
+          row_number() OVER (ORDER BY ts) AS number,
+          count(*) OVER (PARTITION BY 1) AS total,
+          *
+        FROM (
+          SELECT (record).*
+          FROM statements.statements_rollup_db
+          WHERE agent_address = :agent_address
+          AND agent_port = :agent_port
+          AND width = :width
+          AND dbid = :dbid
+          AND bucket BETWEEN :start - :width * INTERVAL '1 second' AND :end
+          AND tstzrange((record).ts, (record).ts, '[]')
+              <@ tstzrange(:start, :end, '[]')
+        ) AS statements_history
+      ) AS sh
+      WHERE number % ( int8larger((total)/(:samples +1),1) ) = 0
+    ) by_db
+""")
+
+
+BASE_QUERY_STATDATA_ROLLUP_QUERY = text("""
+    (
+      SELECT *
+      FROM (
+        SELECT
+          row_number() OVER (ORDER BY ts) AS number,
+          count(*) OVER (PARTITION BY 1) AS total,
+          *
+        FROM (
+          SELECT (record).*
+          FROM statements.statements_rollup
+          WHERE agent_address = :agent_address
+          AND agent_port = :agent_port
+          AND width = :width
+          AND dbid = :dbid
+          AND queryid = :queryid
+          AND userid = :userid
+          AND bucket BETWEEN :start - :width * INTERVAL '1 second' AND :end
+          AND tstzrange((record).ts, (record).ts, '[]')
+              <@ tstzrange(:start, :end, '[]')
+        ) AS statements_history
+      ) AS sh
+      WHERE number % ( int8larger((total)/(:samples +1),1) ) = 0
+    ) by_db
+""")
+
+
+# Bucket width of statements rollups in seconds, coarsest first.
+ROLLUP_WIDTHS = [3600, 300]
+
+
+def get_rollup_width(start, end, samples):
+    # Coarsest rollup still giving samples points over range, if any.
+    if not (start and end):
+        return None
+    seconds = (end - start).total_seconds()
+    for width in ROLLUP_WIDTHS:
+        if seconds / width >= samples:
+            return width
+    return None
+
+
+def getstatdata_sample(request, mode, start, end, dbid=None, queryid=None,
+                       userid=None):
+    samples = 50
+    width = get_rollup_width(start, end, samples)
+    base_query = {
+        ('instance', False): BASE_QUERY_STATDATA_SAMPLE_INSTANCE,
+        ('db', False): BASE_QUERY_STATDATA_SAMPLE_DATABASE,
+        ('query', False): BASE_QUERY_STATDATA_SAMPLE_QUERY,
+        ('instance', True): BASE_QUERY_STATDATA_ROLLUP_INSTANCE,
+        ('db', True): BASE_QUERY_STATDATA_ROLLUP_DATABASE,
+        ('query', True): BASE_QUERY_STATDATA_ROLLUP_QUERY,
+    }[mode, width is not None]
 
     ts = column('ts')
     biggest = Biggest(ts)
@@ -662,9 +974,11 @@ def getstatdata_sample(request, mode, start, end, dbid=None, queryid=None,
 
     params = dict(agent_address=request.instance.agent_address,
                   agent_port=request.instance.agent_port,
-                  samples=50,
+                  samples=samples,
                   start=start,
                   end=end)
+    if width is not None:
+        params['width'] = width
 
     if mode == 'db' or mode == 'query':
         params['dbid'] = dbid
@@ -742,84 +1056,165 @@ def add_statement(session, instance, data):
         cur.execute("SET search_path TO statements")
         if not data.get('data'):
             logger.info("No statement data from %s.", agent_id)
+        # Load snapshot in staging table in a single COPY.
+        buf = StringIO()
         for statement in data.get('data'):
-            query = """
-                INSERT INTO statements_src_tmp
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            buf.write(format_copy_row(statement_values(
+                instance, data['snapshot_datetime'], statement)))
+        buf.seek(0)
+        cur.copy_expert("COPY statements_src_tmp FROM STDIN", buf)
+        delta = bool(data.get('delta'))
+        if data.get('removed'):
+            # Statements evicted from pg_stat_statements since previous
+            # snapshot.
+            cur.executemany(
+                """
+                DELETE FROM statements_last
+                WHERE agent_address = %s AND agent_port = %s
+                AND userid = %s AND dbid = %s AND queryid = %s
+                AND toplevel = %s
+                """,
+                [
+                    (
+                        instance.agent_address, instance.agent_port,
+                        userid, dbid, queryid, toplevel is not False,
+                    )
+                    for userid, dbid, queryid, toplevel in data['removed']
+                ]
+            )
+        query = """SELECT process_statements(%s, %s, %s, %s)"""
+        cur.execute(
+            query, (
+                instance.agent_address, instance.agent_port, delta,
+                data['snapshot_datetime'],
+            ))
+        # Save token to request only changes on next pull.
+        cur.execute(
             """
-            cur.execute(
-                query,
-                (
-                    instance.agent_address,
-                    instance.agent_port,
-                    data['snapshot_datetime'],
-                    statement['userid'],
-                    statement['rolname'],
-                    statement['dbid'],
-                    statement['datname'],
-                    statement['queryid'],
-                    statement['query'],
-                    statement['calls'],
-                    statement['total_exec_time']
-                    if 'total_exec_time' in statement
-                    else statement['total_time'],
-                    statement['rows'],
-                    statement['shared_blks_hit'],
-                    statement['shared_blks_read'],
-                    statement['shared_blks_dirtied'],
-                    statement['shared_blks_written'],
-                    statement['local_blks_hit'],
-                    statement['local_blks_read'],
-                    statement['local_blks_dirtied'],
-                    statement['local_blks_written'],
-                    statement['temp_blks_read'],
-                    statement['temp_blks_written'],
-                    statement['blk_read_time'],
-                    statement['blk_write_time'],
-                    statement['total_plan_time']
-                    if 'total_plan_time' in statement
-                    else None,
-                    statement['wal_records']
-                    if 'wal_records' in statement
-                    else None,
-                    statement['wal_fpi']
-                    if 'wal_fpi' in statement
-                    else None,
-                    statement['wal_bytes']
-                    if 'wal_bytes' in statement
-                    else None,
-                )
+            UPDATE metas SET snapshot = %s
+            WHERE agent_address = %s AND agent_port = %s
+            """,
+            (
+                data.get('snapshot'),
+                instance.agent_address, instance.agent_port,
             )
-        query = """SELECT process_statements(%s, %s)"""
-        cur.execute(query, (instance.agent_address, instance.agent_port))
+        )
         session.connection().connection.commit()
     except Exception as e:
         raise TemboardUIError(400, str(e))
 
 
+def statement_values(instance, snapshot_datetime, statement):
+    # Values of a statements_src_tmp row, in column order.
+    return (
+        instance.agent_address,
+        instance.agent_port,
+        snapshot_datetime,
+        statement['userid'],
+        statement['rolname'],
+        statement['dbid'],
+        statement['datname'],
+        statement['queryid'],
+        statement['query'],
+        statement['calls'],
+        statement['total_exec_time']
+        if 'total_exec_time' in statement
+        else statement['total_time'],
+        statement['rows'],
+        statement['shared_blks_hit'],
+        statement['shared_blks_read'],
+        statement['shared_blks_dirtied'],
+        statement['shared_blks_written'],
+        statement['local_blks_hit'],
+        statement['local_blks_read'],
+        statement['local_blks_dirtied'],
+        statement['local_blks_written'],
+        statement['temp_blks_read'],
+        statement['temp_blks_written'],
+        statement['blk_read_time'],
+        statement['blk_write_time'],
+        statement.get('total_plan_time'),
+        statement.get('wal_records'),
+        statement.get('wal_fpi'),
+        statement.get('wal_bytes'),
+        statement.get('toplevel') is not False,
+    )
+
+
+def format_copy_value(value):
+    # Format value for COPY text format.
+    if value is None:
+        return u'\\N'
+    if isinstance(value, str):
+        return (
+            value.replace(u'\\', u'\\\\')
+            .replace(u'\t', u'\\t')
+            .replace(u'\n', u'\\n')
+            .replace(u'\r', u'\\r')
+        )
+    if isinstance(value, float):
+        return str(repr(value))
+    return str(value)
+
+
+def format_copy_row(values):
+    return u'\t'.join(format_copy_value(v) for v in values) + u'\n'
+
+
 @workers.register(pool_size=1)
 def pull_data_worker(app):
+    # Pull instances concurrently, at most max_workers at a time. Each agent
+    # is pulled with its own session, thus an agent error is recorded in its
+    # metas and does not affect others.
+    start = time()
     engine = worker_engine(app.config.repository)
     session_factory = sessionmaker(bind=engine)
     Session = scoped_session(session_factory)
     worker_session = Session()
-    instances = worker_session.query(Instances)
-
-    for instance in instances:
+    instances = []
+    for instance in worker_session.query(Instances):
         plugin_names = [plugin.plugin_name for plugin in instance.plugins]
 
         if 'statements' not in plugin_names:
             continue
 
-        # FIXME should be done in parallel
-        try:
-            pull_data_for_instance(app, worker_session, instance)
-        except Exception:
-            logger.exception(
-                "Failed to pull data from %s:%s",
-                instance.agent_address, instance.agent_port,
-            )
+        instances.append(instance)
+    Session.remove()
+    if not instances:
+        return
+
+    executor = ThreadPoolExecutor(
+        max_workers=min(len(instances), app.config.statements.max_workers))
+    futures = [
+        executor.submit(pull_data_thread, app, Session, instance)
+        for instance in instances
+    ]
+    try:
+        for future in as_completed(futures):
+            future.result()
+    finally:
+        executor.shutdown(wait=False)
+
+    duration = time() - start
+    logger.info(
+        "Pulled statements of %s instances in %.3fs.",
+        len(instances), duration)
+    if duration > 60:
+        logger.warning(
+            "Pulling statements took longer than 1 minute. "
+            "Consider increasing [statements] max_workers.")
+
+
+def pull_data_thread(app, Session, instance):
+    try:
+        pull_data_for_instance(app, Session(), instance)
+    except Exception:
+        logger.exception(
+            "Failed to pull data from %s:%s",
+            instance.agent_address, instance.agent_port,
+        )
+    finally:
+        Session.remove()
 
 
 @workers.register(pool_size=1)
@@ -842,13 +1237,17 @@ def statements_pull1(app, host, port):
 def pull_data_for_instance(app, session, instance):
     agent_id = "%s:%s" % (instance.agent_address, instance.agent_port)
     logger.info("Pulling statements from %s.", agent_id)
+    start = time()
     client = TemboardAgentClient.factory(
         app.config,
         instance.agent_address, instance.agent_port,
         instance.agent_key,
     )
+    client.timeout = app.config.statements.pull_timeout
     try:
-        response = client.get('/statements')
+        snapshot = get_snapshot_token(session, instance)
+        response = client.get(
+            '/statements?snapshot=%s' % url_escape(snapshot or ''))
         response.raise_for_status()
         add_statement(session, instance, response.json())
         logger.info("Successfully pulled statements data for %s.", agent_id)
@@ -865,7 +1264,9 @@ def pull_data_for_instance(app, session, instance):
             logger.exception("Failed to pull statements data: %s", error)
 
         # If statements data cannot be retrieved store the error in the
-        # statements metas table
+        # statements metas table. Reset snapshot token to pull a full
+        # snapshot on next run.
+        session.connection().connection.rollback()
         cur = session.connection().connection.cursor()
         cur.execute("SET search_path TO statements")
         query = """
@@ -884,7 +1285,7 @@ def pull_data_for_instance(app, session, instance):
 
         query = """
             UPDATE metas
-            SET error = %s
+            SET error = %s, snapshot = NULL
             WHERE agent_address = %s AND agent_port = %s;
         """
         cur.execute(
@@ -897,6 +1298,32 @@ def pull_data_for_instance(app, session, instance):
         )
         session.connection().connection.commit()
 
+    # Expose pull duration in metas, along with snapts for lag.
+    cur = session.connection().connection.cursor()
+    cur.execute(
+        """
+        UPDATE statements.metas SET pull_duration = %s
+        WHERE agent_address = %s AND agent_port = %s
+        """,
+        (time() - start, instance.agent_address, instance.agent_port)
+    )
+    session.connection().connection.commit()
+
+
+def get_snapshot_token(session, instance):
+    # Token of latest snapshot ingested, if any.
+    cur = session.connection().connection.cursor()
+    cur.execute(
+        """
+        SELECT snapshot FROM statements.metas
+        WHERE agent_address = %s AND agent_port = %s
+        """,
+        (instance.agent_address, instance.agent_port)
+    )
+    row = cur.fetchone()
+    cur.close()
+    return row[0] if row else None
+
 
 @workers.register(pool_size=1)
 def statements_purge_worker(app):
@@ -18,6 +18,7 @@ $(function() {
       userid: null,
       datname: null,
       sortBy: 'total_exec_time',
+      sortDesc: true,
       filter: '',
       from: null,
       to: null,
@@ -32,15 +33,26 @@ $(function() {
       },
       queryidUserid: function() {
         return this.queryid, this.userid;
+      },
+      serverPaging: serverPaging,
+      pageSort: function() {
+        return [this.serverPaging, this.currentPage, this.sortBy, this.sortDesc];
       }
     },
     methods: {
       fetchData: fetchData,
+      fetchStatements: fetchStatements,
       highlight: highlight,
       onFiltered: onFiltered
     },
     watch: {
       fromTo: fetchData,
+      pageSort: function(newValue, oldValue) {
+        // Page and sort of a long listing is done by server, unless filtered.
+        if (this.serverPaging || oldValue[0]) {
+          this.fetchStatements();
+        }
+      },
       dbid: function() {
         var newQueryParams = _.assign({}, this.$route.query);
         if (!this.dbid) {
@@ -74,24 +86,45 @@ $(function() {
     }
   });
 
-  function fetchData() {
-    this.statements = [];
-    var startDate = this.from;
-    var endDate = this.to;
+  // Counters server can sort by, descending only.
+  var serverSortKeys = [
+    'calls', 'total_exec_time', 'mean_time',
+    'shared_blks_read', 'shared_blks_hit',
+    'shared_blks_dirtied', 'shared_blks_written',
+    'temp_blks_read', 'temp_blks_written'
+  ];
 
-    var url = this.dbid ? '/' + this.dbid : '';
-    url += this.queryid ? '/' + this.queryid : '';
-    url += this.userid ? '/' + this.userid : '';
+  function serverPaging() {
+    return !this.queryid && !this.filter && this.sortDesc &&
+      serverSortKeys.indexOf(this.sortBy) !== -1;
+  }
+
+  function getUrl() {
+    var url = v.dbid ? '/' + v.dbid : '';
+    url += v.queryid ? '/' + v.queryid : '';
+    url += v.userid ? '/' + v.userid : '';
+    return url;
+  }
+
+  function fetchStatements() {
+    this.statements = [];
+    var params = {
+      start: timestampToIsoDate(this.from),
+      end: timestampToIsoDate(this.to),
+      noerror: 1
+    };
+    var serverPaging = this.serverPaging;
+    if (serverPaging) {
+      params.sort = this.sortBy;
+      params.limit = this.perPage;
+      params.offset = (this.currentPage - 1) * this.perPage;
+    }
 
     this.isLoading = true;
     dataRequest && dataRequest.abort();
     dataRequest = $.get(
-      apiUrl + url,
-      {
-        start: timestampToIsoDate(startDate),
-        end: timestampToIsoDate(endDate),
-        noerror: 1
-      },
+      apiUrl + getUrl(),
+      params,
       function(data) {
         this.isLoading = false;
         this.datname = data.datname;
@@ -100,11 +133,20 @@ $(function() {
         if (this.queryid) {
           this.statements[0]._showDetails = true;
         }
-        this.totalRows = this.statements.length;
+        this.totalRows = serverPaging ? data.total : this.statements.length;
 
         this.metas = data.metas;
       }.bind(this)
     );
+  }
+
+  function fetchData() {
+    var startDate = this.from;
+    var endDate = this.to;
+    var url = getUrl();
+
+    this.currentPage = 1;
+    this.fetchStatements();
 
     chartRequest && chartRequest.abort();
     chartRequest = $.get(
@@ -53,6 +53,8 @@ class TemboardClient(object):
     Error = TemboardHTTPError
 
     log_headers = False
+    # Socket timeout in seconds.
+    timeout = 30
 
     @classmethod
     def factory(cls, config, host, port):
@@ -110,7 +112,8 @@ class TemboardClient(object):
             body = ensure_bytes(body)
 
         conn = http.client.HTTPSConnection(
-            self.host, self.port, context=self.ssl_context, timeout=30,
+            self.host, self.port,
+            context=self.ssl_context, timeout=self.timeout,
         )
         conn.response_class = TemboardResponse
 
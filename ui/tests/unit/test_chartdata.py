@@ -0,0 +1,40 @@
+try:
+    # python2
+    from StringIO import StringIO
+except Exception:
+    from io import StringIO
+
+
+def test_parse_timestamp():
+    from temboardui.plugins.monitoring.chartdata import parse_timestamp
+
+    assert 1640995200000 == parse_timestamp('2022-01-01 00:00:00+00')
+    assert 1640995200500 == parse_timestamp('2022-01-01 02:00:00.5+02')
+    assert 1640995200000 == parse_timestamp('2021-12-31 20:30:00-03:30')
+
+
+def test_csv_to_columns():
+    from temboardui.plugins.monitoring.chartdata import csv_to_columns
+
+    data = csv_to_columns(StringIO(
+        "date,a,b\n"
+        "2022-01-01 00:00:00+00,1,\n"
+        "2022-01-01 00:01:00+00,2.5,3\n"
+    ))
+    assert ['date', 'a', 'b'] == data['labels']
+    assert [
+        [1640995200000, 1640995260000],
+        [1., 2.5],
+        [None, 3.],
+    ] == data['columns']
+
+    assert dict(labels=[], columns=[]) == csv_to_columns(StringIO(""))
+
+
+def test_metrics_static_expand():
+    from temboardui.plugins.monitoring.chartdata import METRICS
+
+    for name, metric in METRICS.items():
+        sql = metric['sql_nozoom']
+        assert 'expand_data' not in sql, name
+        assert 'FROM expand_metric_' in sql, name
@@ -0,0 +1,52 @@
+def test_live_hub_shares_poll():
+    import threading
+    from time import sleep
+    from temboardui.plugins.dashboard import LiveHub
+
+    calls = []
+
+    def fetch(after):
+        calls.append(after)
+        sleep(.1)
+        return dict(timestamp=after + 1)
+
+    hub = LiveHub()
+    results = []
+
+    def follower():
+        results.append(hub.next(0, fetch))
+
+    thread = threading.Thread(target=follower)
+    thread.start()
+    sleep(.01)
+    # Second tab waits for pending poll.
+    assert dict(timestamp=1) == hub.next(0, fetch)
+    thread.join()
+
+    assert [dict(timestamp=1)] == results
+    assert [0] == calls
+    # Cached snapshot is served without polling agent.
+    assert dict(timestamp=1) == hub.next(.5, fetch)
+    assert 1 == len(calls)
+    # Polling resumes from latest snapshot.
+    assert dict(timestamp=2) == hub.next(1, fetch)
+    assert [0, 1] == calls
+
+
+def test_live_hub_next_delay(mocker):
+    from temboardui.plugins.dashboard import LiveHub
+
+    time = mocker.patch('temboardui.plugins.dashboard.time.time')
+    hub = LiveHub()
+
+    # Empty agent history is not cached.
+    time.return_value = 100.
+    assert dict(next=2) == hub.next(0, lambda after: dict(next=2))
+    assert {} == hub.snapshot()
+
+    hub.next(0, lambda after: dict(timestamp=1, next=1.5))
+    # Cached snapshot counts delay from now.
+    time.return_value = 101.
+    assert dict(timestamp=1, next=.5) == hub.next(0, None)
+    time.return_value = 103.
+    assert dict(timestamp=1, next=0) == hub.next(0, None)
@@ -0,0 +1,32 @@
+try:
+    # python2
+    from StringIO import StringIO
+except Exception:
+    from io import StringIO
+
+
+def test_downsample():
+    from temboardui.plugins.monitoring.downsample import downsample_timeserie
+
+    in_ = StringIO("i,a,b\n" + "".join(
+        "%d,%d,%s\n" % (i, 100 if i == 37 else i % 10, '' if i % 2 else i)
+        for i in range(100)
+    ))
+    out_ = StringIO()
+    downsample_timeserie(in_, points=10, output=out_)
+    lines = out_.getvalue().splitlines()
+    assert "i,a,b" == lines[0]
+    assert "0,0,0" == lines[1]
+    assert "99,9," == lines[-1]
+    # Peak is preserved.
+    assert "37,100," in lines
+    # 2 buckets, min and max of 2 series, plus first and last rows.
+    assert len(lines) - 1 <= 10
+    indexes = [int(line.split(',')[0]) for line in lines[1:]]
+    assert sorted(indexes) == indexes
+
+    # Short serie is untouched.
+    in_ = StringIO("i,a\n1,1\n2,2\n")
+    out_ = StringIO()
+    downsample_timeserie(in_, points=10, output=out_)
+    assert "i,a\n1,1\n2,2\n" == out_.getvalue()
@@ -0,0 +1,152 @@
+from io import BytesIO
+
+
+class FakeResponse(BytesIO):
+    def __init__(self, body, content_type):
+        BytesIO.__init__(self, body)
+        self.content_type = content_type
+
+    def getheader(self, name, default=None):
+        return self.content_type
+
+
+def test_iter_history_ndjson():
+    from temboardui.plugins.monitoring.tools import (
+        iter_history, spool_history,
+    )
+
+    response = FakeResponse(
+        b'{"cursor": "c1", "metric": {"datetime": "d1"}}\n'
+        b'{"cursor": "c2", "metric": {"datetime": "d2"}}\n',
+        'application/x-ndjson',
+    )
+    rows = list(iter_history(spool_history(response, spool_size=8)))
+
+    assert [
+        ('c1', dict(datetime='d1')),
+        ('c2', dict(datetime='d2')),
+    ] == rows
+
+
+def test_iter_history_legacy():
+    from temboardui.plugins.monitoring.tools import (
+        iter_history, spool_history,
+    )
+
+    response = FakeResponse(b'[{"datetime": "d1"}]', 'application/json')
+    rows = list(iter_history(spool_history(response)))
+
+    assert [(None, dict(datetime='d1'))] == rows
+
+
+def test_group_metric_values():
+    from temboardui.plugins.monitoring.tools import group_metric_values
+
+    data = dict(
+        xacts=[
+            dict(datetime='d', dbname='db0', measure_interval=60.,
+                 n_commit=1, n_rollback=0),
+            dict(datetime='d', dbname='db1', measure_interval=60.,
+                 n_commit=2, n_rollback=1),
+        ],
+        loadavg=[dict(datetime='d', load1=1., load5=.5, load15=.1)],
+        locks=[],
+        unknown=[dict(datetime='d')],
+    )
+
+    groups = dict(group_metric_values(1, 2, data))
+
+    assert ['loadavg', 'xacts'] == sorted(groups)
+    assert [('d', 1, (None, 1., .5, .1))] == groups['loadavg']
+    assert [
+        ('d', 2, 'db0', (None, '60.0', 1, 0)),
+        ('d', 2, 'db1', (None, '60.0', 2, 1)),
+    ] == groups['xacts']
+
+
+def test_collector_batch_concurrent(mocker):
+    from time import sleep
+    from temboardui.plugins.monitoring import collector_batch
+
+    worker_engine = mocker.patch(
+        'temboardui.plugins.monitoring.worker_engine')
+
+    def fetch_history(app, Session, address, port, key):
+        if 'slow' == address:
+            sleep(.1)
+        if 'dead' == address:
+            raise Exception("Dead agent")
+        return address
+
+    mocker.patch(
+        'temboardui.plugins.monitoring.fetch_history',
+        side_effect=fetch_history)
+    ingest = mocker.patch('temboardui.plugins.monitoring.ingest_history')
+
+    collector_batch(mocker.Mock(name='app'), [
+        ('slow', 2345, 'key'),
+        ('dead', 2345, 'key'),
+        ('fast', 2345, 'key'),
+    ])
+
+    pulls = [c[0][2] for c in ingest.call_args_list]
+    assert ['fast', 'slow'] == pulls
+    # One connection per fetch thread, plus ingestion.
+    _, kw = worker_engine.call_args
+    assert 4 == kw['pool_size']
+    assert 0 == kw['max_overflow']
+
+
+def test_check_preprocessed_data(mocker):
+    from temboardui.plugins.monitoring.tools import check_preprocessed_data
+
+    schedule_task = mocker.patch(
+        'temboardui.plugins.monitoring.tools.taskmanager.schedule_task')
+    update = mocker.patch(
+        'temboardui.plugins.monitoring.tools.db.update_check_states')
+    session = mocker.Mock(name='session')
+    check = mocker.Mock(check_id=1)
+    check.name = 'load1'
+    state = mocker.Mock(check_id=1, key='None', state='OK')
+    session.query.return_value.filter.side_effect = [[check], [state]]
+
+    check_preprocessed_data(session, 1, 2, [
+        dict(datetime='d0', name='load1', key=None, value=1.,
+             warning=2., critical=4.),
+        dict(datetime='d1', name='load1', key=None, value=3.,
+             warning=2., critical=4.),
+        dict(datetime='d1', name='unknown', key=None, value=3.,
+             warning=2., critical=4.),
+    ], '/home')
+
+    # Two queries for the whole payload.
+    assert 2 == session.query.call_count
+    # One notification when state changes from stored state.
+    assert 1 == schedule_task.call_count
+    options = schedule_task.call_args[1]['options']
+    assert 'OK' == options['prev_state']
+    assert 'WARNING' == options['state']
+    # Last state per check and key is written at once.
+    (_, instance_id, states), _ = update.call_args
+    assert 2 == instance_id
+    assert [dict(
+        datetime='d1', check_id=1, key='None', state='WARNING', value=3.,
+        warning=2., critical=4.,
+    )] == states
+    assert session.commit.called
+
+    # WARNING -> OK -> WARNING in one payload is not a net transition.
+    # Neither notification nor state change is recorded.
+    schedule_task.reset_mock()
+    state.state = 'WARNING'
+    session.query.return_value.filter.side_effect = [[check], [state]]
+    check_preprocessed_data(session, 1, 2, [
+        dict(datetime='d0', name='load1', key=None, value=1.,
+             warning=2., critical=4.),
+        dict(datetime='d1', name='load1', key=None, value=3.,
+             warning=2., critical=4.),
+    ], '/home')
+
+    assert not schedule_task.called
+    (_, _, states), _ = update.call_args
+    assert ['WARNING'] == [s['state'] for s in states]
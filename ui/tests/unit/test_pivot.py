@@ -30,3 +30,23 @@ def test_pivot():
         output=out_
     )
     assert out_.getvalue() == expected
+
+
+def test_pivot_columns_order():
+    from temboardui.plugins.monitoring.pivot import pivot_timeserie
+
+    in_ = StringIO(
+            "k,v,i\n"
+            "b,2,1\n"
+            "a,1,1\n"
+            "a,3,2\n"
+            )
+    out_ = StringIO()
+    pivot_timeserie(in_, index='i', key='k', value='v', output=out_)
+    assert out_.getvalue() == "i,b,a\n1,2,1\n2,,3\n"
+
+    # Header only, as returned by COPY on an empty range.
+    out_ = StringIO()
+    pivot_timeserie(
+        StringIO("i,k,v\n"), index='i', key='k', value='v', output=out_)
+    assert out_.getvalue() == "i\n"
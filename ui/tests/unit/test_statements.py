@@ -0,0 +1,99 @@
+def test_format_copy_row():
+    from temboardui.plugins.statements import format_copy_row
+
+    row = format_copy_row([
+        u'127.0.0.1', 2345, None, True, 0.1, u'SELECT\t1\n-- \\o/',
+    ])
+    assert (
+        u'127.0.0.1\t2345\t\\N\tTrue\t0.1\tSELECT\\t1\\n-- \\\\o/\n' == row
+    )
+
+
+def test_pull_data_worker_concurrent(mocker):
+    from time import sleep
+    from temboardui.plugins.statements import pull_data_worker
+
+    mocker.patch('temboardui.plugins.statements.worker_engine')
+    mocker.patch('temboardui.plugins.statements.sessionmaker')
+    Session = mocker.patch('temboardui.plugins.statements.scoped_session')
+
+    def instance(address, plugin='statements'):
+        plugins = [mocker.Mock(plugin_name=plugin)]
+        return mocker.Mock(
+            agent_address=address, agent_port=2345, plugins=plugins)
+
+    Session.return_value.return_value.query.return_value = [
+        instance('slow'), instance('dead'), instance('fast'),
+        instance('other', plugin='monitoring'),
+    ]
+
+    pulled = []
+
+    def pull_data_for_instance(app, session, instance):
+        if 'slow' == instance.agent_address:
+            sleep(.1)
+        if 'dead' == instance.agent_address:
+            raise Exception("Dead agent")
+        pulled.append(instance.agent_address)
+
+    mocker.patch(
+        'temboardui.plugins.statements.pull_data_for_instance',
+        side_effect=pull_data_for_instance)
+
+    app = mocker.Mock(name='app')
+    app.config.statements.max_workers = 4
+    pull_data_worker(app)
+
+    assert ['fast', 'slow'] == pulled
+
+
+def test_get_rollup_width():
+    from datetime import datetime, timedelta
+    from temboardui.plugins.statements import get_rollup_width
+
+    end = datetime(2022, 1, 1)
+    assert get_rollup_width(end - timedelta(hours=1), end, 50) is None
+    assert 300 == get_rollup_width(end - timedelta(hours=6), end, 50)
+    assert 3600 == get_rollup_width(end - timedelta(days=7), end, 50)
+    assert get_rollup_width(None, end, 50) is None
+
+
+def test_parse_topn(mocker):
+    import pytest
+    from temboardui.plugins.statements import HTTPError, parse_topn
+
+    def request(**arguments):
+        request = mocker.Mock(name='request')
+        request.handler.get_argument.side_effect = \
+            lambda k, default=None: arguments.get(k, default)
+        return request
+
+    assert parse_topn(request()) is None
+    assert ('total_exec_time', 20, 0) == parse_topn(request(limit='20'))
+    assert ('calls', 20, 40) == parse_topn(
+        request(limit='20', offset='40', sort='calls'))
+
+    with pytest.raises(HTTPError):
+        parse_topn(request(limit='20', sort='query; DROP TABLE'))
+    with pytest.raises(HTTPError):
+        parse_topn(request(limit='-1'))
+
+
+def test_execute_topn(mocker):
+    from temboardui.plugins.statements import execute_topn
+
+    session = mocker.Mock(name='session')
+    session.execute.return_value.scalar.return_value = 10
+    session.execute.return_value.fetchall.return_value = []
+
+    # Total does not depend on page being empty.
+    rows, total = execute_topn(
+        session, "SELECT 1 AS calls", dict(dbid=1), ('calls', 20, 40))
+    assert [] == rows
+    assert 10 == total
+
+    (count, params), _ = session.execute.call_args_list[0]
+    assert count.startswith("SELECT count(*) FROM (SELECT 1 AS calls)")
+    (page, params), _ = session.execute.call_args_list[1]
+    assert "ORDER BY calls DESC NULLS LAST" in page
+    assert dict(dbid=1, limit=20, offset=40) == params